@@ -0,0 +1,62 @@
+"""Measures the per-request cost of loading parsed tiers' parsers: scanning
+the installed packages on each load (as was done before the parsers registry)
+versus looking the parser up in the process-wide registry. A dummy parsers
+package is generated in a temporary folder, so that there's something to find.
+
+Usage (with seshat installed, or from the repository's root with PYTHONPATH=.):
+    python benchmarks/bench_parser_registry.py [--tiers 5] [--repeat 20]
+"""
+import argparse
+import sys
+import timeit
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from seshat.parsers import scan_parsers, parser_factory
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--tiers", type=int, default=5,
+                       help="Number of parsed tiers in the checking scheme (i.e., parser loads per request)")
+argparser.add_argument("--repeat", type=int, default=20, help="Number of timed runs")
+
+DUMMY_PARSERS = '''from seshat.parsers.base import BaseCustomParser
+
+
+class BenchParser(BaseCustomParser):
+    NAME = "BenchParser"
+
+    def check_annotation(self, annot: str) -> None:
+        pass
+'''
+
+
+def scanning_load(tiers_count: int):
+    """The loading path that was used before the parsers registry"""
+    for _ in range(tiers_count):
+        scan_parsers()["seshat_parser_bench"]["BenchParser"]()
+
+
+def registry_load(tiers_count: int):
+    for _ in range(tiers_count):
+        parser_factory("seshat_parser_bench", "BenchParser")
+
+
+def main():
+    args = argparser.parse_args()
+    with TemporaryDirectory() as tmp_dir:
+        package_dir = Path(tmp_dir) / "seshat_parser_bench"
+        package_dir.mkdir()
+        (package_dir / "__init__.py").write_text(DUMMY_PARSERS)
+        sys.path.insert(0, tmp_dir)
+
+        scanning_time = min(timeit.repeat(lambda: scanning_load(args.tiers),
+                                          number=1, repeat=args.repeat))
+        registry_time = min(timeit.repeat(lambda: registry_load(args.tiers),
+                                          number=1, repeat=args.repeat))
+    print(f"{'parser loads':>12} {'scanning (ms)':>14} {'registry (ms)':>14} {'speedup':>8}")
+    print(f"{args.tiers:>12} {scanning_time * 1000:>14.3f} {registry_time * 1000:>14.3f} "
+          f"{scanning_time / registry_time:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Compares the in-memory TextGrid parser with the former temporary file
+round-trip (`TextGrid.fromFile`), on synthetic TextGrids of growing size.
+
+Usage (with seshat installed, or from the repository's root with PYTHONPATH=.):
+    python benchmarks/bench_parsing.py [--intervals 10000 50000] [--tiers 4]
+"""
+import argparse
+import random
+import timeit
+from tempfile import NamedTemporaryFile
+
+from textgrid import TextGrid, IntervalTier, Interval
+
+from seshat.tg_parsing import parse_textgrid, parse_compact_textgrid
+from seshat.utils import tg_to_str
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--intervals", type=int, nargs="+", default=[1000, 10000, 50000],
+                       help="Number of intervals per tier")
+argparser.add_argument("--tiers", type=int, default=4, help="Number of tiers")
+argparser.add_argument("--repeat", type=int, default=5, help="Number of timed runs")
+
+
+def gen_textgrid_str(tiers_count: int, intervals_count: int) -> str:
+    duration = intervals_count * 1.0
+    tg = TextGrid(minTime=0.0, maxTime=duration)
+    for tier_idx in range(tiers_count):
+        tier = IntervalTier("tier_%i" % tier_idx, 0.0, duration)
+        for i in range(intervals_count):
+            mark = random.choice(["a", "b", "ch", ""])
+            tier.intervals.append(Interval(float(i), i + 1.0, mark))
+        tg.append(tier)
+    return tg_to_str(tg)
+
+
+def tempfile_parse(textgrid_str: str) -> TextGrid:
+    """The parsing path that was used before the in-memory parser"""
+    with NamedTemporaryFile(mode="w") as temptg:
+        temptg.write(textgrid_str)
+        temptg.flush()
+        return TextGrid.fromFile(temptg.name)
+
+
+def main():
+    args = argparser.parse_args()
+    print(f"{'intervals':>10} {'tempfile (s)':>14} {'in-memory (s)':>14} {'speedup':>8} {'compact (s)':>12}")
+    for intervals_count in args.intervals:
+        tg_str = gen_textgrid_str(args.tiers, intervals_count)
+        tempfile_time = min(timeit.repeat(lambda: tempfile_parse(tg_str),
+                                          number=1, repeat=args.repeat))
+        memory_time = min(timeit.repeat(lambda: parse_textgrid(tg_str),
+                                        number=1, repeat=args.repeat))
+        compact_time = min(timeit.repeat(lambda: parse_compact_textgrid(tg_str),
+                                         number=1, repeat=args.repeat))
+        print(f"{intervals_count:>10} {tempfile_time:>14.4f} {memory_time:>14.4f} "
+              f"{tempfile_time / memory_time:>7.1f}x {compact_time:>12.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""Times each stage of the textgrid check/merge pipeline (parsing, checking,
+ref/target interweaving, times merging and serialization), on synthetic
+textgrids of growing size (tiers × intervals per tier), with checking schemes
+made of unchecked, categorical or parsed tiers. A dummy parsers package is
+generated in a temporary folder for the parsed tiers.
+
+Results can be saved as JSON (`--output`), and compared to such a file
+(`--baseline`): the script then exits with an error if any stage got slower
+than the baseline by more than the tolerance.
+
+Usage (with seshat installed, or from the repository's root with PYTHONPATH=.):
+    python benchmarks/bench_pipeline.py [--sizes 2x1000 4x10000] [--output results.json]
+    python benchmarks/bench_pipeline.py --baseline results.json [--tolerance 1.2]
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import timeit
+from datetime import datetime
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import List, Dict, Tuple, Callable, Optional
+
+from seshat.models.errors import error_log
+from seshat.models.textgrids import BaseTextGridDocument, SingleAnnotatorTextGrid, MergedAnnotsTextGrid
+from seshat.models.tg_checking import TextGridCheckingScheme
+from seshat.tg_compact import CompactTextGrid, CompactTier
+from seshat.tg_parsing import parse_compact_textgrid
+from seshat.utils import tg_to_str
+
+TIER_TYPES = ("unchecked", "categorical", "parsed")
+# marks of the synthetic annotations: "zz" is invalid for the categorical and parsed tiers
+MARKS = ["a", "b", "ch", "", "zz"]
+# time differences (in seconds) that aren't considered as regressions, whatever the ratio
+NOISE_FLOOR = 0.001
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--sizes", type=str, nargs="+", default=["2x1000", "4x10000", "4x50000"],
+                       help="Sizes of the synthetic textgrids, as TIERSxINTERVALS")
+argparser.add_argument("--tier-types", type=str, nargs="+", choices=TIER_TYPES, default=list(TIER_TYPES),
+                       help="Types of tiers of the checking schemes")
+argparser.add_argument("--repeat", type=int, default=3, help="Number of timed runs of each stage")
+argparser.add_argument("--seed", type=int, default=4577, help="Seed of the synthetic textgrids")
+argparser.add_argument("--output", type=Path, help="Saves the results to that JSON file")
+argparser.add_argument("--baseline", type=Path, help="Compares the results to that JSON file")
+argparser.add_argument("--tolerance", type=float, default=1.2,
+                       help="Stages slower than the baseline by more than that factor are regressions")
+
+DUMMY_PARSERS = '''import re
+
+from seshat.parsers.base import BaseCustomParser, AnnotationError
+
+
+class BenchParser(BaseCustomParser):
+    NAME = "BenchParser"
+    # not memoizing, so the parser's cost is measured
+    CACHE_VERDICTS = False
+    LABEL_RE = re.compile("^(a|b|ch)$")
+
+    def check_annotation(self, annot: str) -> None:
+        if self.LABEL_RE.match(annot.strip()) is None:
+            raise AnnotationError("%s isn't a valid label" % annot)
+'''
+
+
+def gen_textgrid(tiers_count: int, intervals_count: int, rng: random.Random) -> CompactTextGrid:
+    duration = intervals_count * 1.0
+    tg = CompactTextGrid(minTime=0.0, maxTime=duration)
+    for tier_idx in range(tiers_count):
+        marks = [rng.choice(MARKS) for _ in range(intervals_count)]
+        tg.append(CompactTier.from_lists("tier_%i" % tier_idx, 0.0, duration,
+                                         [float(i) for i in range(intervals_count)],
+                                         [i + 1.0 for i in range(intervals_count)],
+                                         marks))
+    return tg
+
+
+def gen_target(ref_tg: CompactTextGrid, rng: random.Random, conflicts_rate: float = 0.01) -> CompactTextGrid:
+    """Same annotations as the reference, with slightly shifted frontiers, a
+    few of them shifted beyond the merging threshold"""
+    target_tg = CompactTextGrid(minTime=ref_tg.minTime, maxTime=ref_tg.maxTime)
+    for ref_tier in ref_tg:
+        intervals = list(ref_tier)
+        frontiers = [interval.maxTime for interval in intervals[:-1]]
+        for i, frontier in enumerate(frontiers):
+            shift = 0.3 if rng.random() < conflicts_rate else 0.05
+            frontiers[i] = frontier + rng.uniform(-shift, shift)
+        target_tg.append(CompactTier.from_lists(ref_tier.name, ref_tier.minTime, ref_tier.maxTime,
+                                                [ref_tier.minTime] + frontiers,
+                                                frontiers + [ref_tier.maxTime],
+                                                [interval.mark for interval in intervals]))
+    return target_tg
+
+
+def gen_scheme(tier_type: str, tiers_count: int) -> TextGridCheckingScheme:
+    tiers_specs = []
+    for tier_idx in range(tiers_count):
+        specs = {"name": "tier_%i" % tier_idx, "required": True, "allow_empty": True}
+        if tier_type == "categorical":
+            specs.update(checking_type="CATEGORICAL", categories=["a", "b", "ch"])
+        elif tier_type == "parsed":
+            specs.update(checking_type="PARSED",
+                         parser={"name": "BenchParser", "module": "seshat_parser_pipeline_bench"})
+        else:
+            specs.update(checking_type="NONE")
+        tiers_specs.append(specs)
+    return TextGridCheckingScheme.from_tierspecs_schema(tiers_specs, "bench %s scheme" % tier_type)
+
+
+def load_doc(doc_class, tg: CompactTextGrid, scheme: TextGridCheckingScheme) -> BaseTextGridDocument:
+    """Textgrid document with its textgrid already parsed"""
+    doc = doc_class.from_textgrid(tg, [], None)
+    doc.checking_scheme = scheme
+    doc._textgrid_obj = tg
+    return doc
+
+
+def check(doc: BaseTextGridDocument):
+    error_log.flush()
+    doc.check()
+
+
+def interweave(ref_doc: BaseTextGridDocument, target_doc: BaseTextGridDocument):
+    error_log.flush()
+    return MergedAnnotsTextGrid.from_ref_and_target(ref_doc, target_doc)
+
+
+def uncached(merge_fn: Callable) -> Callable:
+    """Runs a merged document's times merging method, making sure its
+    (memoized) times merge is computed again"""
+    def run():
+        merge_fn.__self__._times_merging = None
+        return merge_fn()
+    return run
+
+
+def time_stage(fn: Callable, repeat: int) -> Dict[str, float]:
+    times = timeit.repeat(fn, number=1, repeat=repeat)
+    return {"min": min(times), "median": statistics.median(times)}
+
+
+def run_benchmarks(sizes: List[Tuple[int, int]], tier_types: List[str], repeat: int, seed: int) -> List[Dict]:
+    results = []
+
+    def record(stage: str, tier_type: str, tiers_count: int, intervals_count: int, fn: Callable):
+        timings = time_stage(fn, repeat)
+        results.append({"stage": stage, "tier_type": tier_type, "tiers": tiers_count,
+                        "intervals": intervals_count, **timings})
+        print(f"{stage:>20} {tier_type:>12} {tiers_count:>6} {intervals_count:>10} "
+              f"{timings['min']:>10.4f} {timings['median']:>10.4f}", file=sys.stderr)
+
+    print(f"{'stage':>20} {'tier type':>12} {'tiers':>6} {'intervals':>10} {'min (s)':>10} {'median (s)':>10}",
+          file=sys.stderr)
+    for tiers_count, intervals_count in sizes:
+        rng = random.Random(seed)
+        ref_tg = gen_textgrid(tiers_count, intervals_count, rng)
+        target_tg = gen_target(ref_tg, rng)
+        tg_str = tg_to_str(ref_tg)
+
+        # stages that don't depend on the checking scheme
+        record("parse", "any", tiers_count, intervals_count, lambda: parse_compact_textgrid(tg_str))
+        record("tg_to_str", "any", tiers_count, intervals_count, lambda: tg_to_str(ref_tg))
+
+        for tier_type in tier_types:
+            scheme = gen_scheme(tier_type, tiers_count)
+            ref_doc = load_doc(SingleAnnotatorTextGrid, ref_tg, scheme)
+            target_doc = load_doc(SingleAnnotatorTextGrid, target_tg, scheme)
+            record("check", tier_type, tiers_count, intervals_count, lambda: check(ref_doc))
+
+            merged_doc = interweave(ref_doc, target_doc)
+            merged_doc = load_doc(MergedAnnotsTextGrid, merged_doc.textgrid, scheme)
+            record("check_merged", tier_type, tiers_count, intervals_count, lambda: check(merged_doc))
+            if tier_type != tier_types[0]:
+                continue
+            # merging doesn't depend on the tiers' type
+            record("from_ref_and_target", "any", tiers_count, intervals_count,
+                   lambda: interweave(ref_doc, target_doc))
+            record("check_times_merging", "any", tiers_count, intervals_count,
+                   uncached(merged_doc.check_times_merging))
+            record("gen_merged_times", "any", tiers_count, intervals_count,
+                   uncached(merged_doc.gen_merged_times))
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict], baseline: Dict, tolerance: float) -> List[Dict]:
+    """Prints the ratio of each stage's time to the baseline's, and returns
+    the regressions"""
+    baseline_times = {(r["stage"], r["tier_type"], r["tiers"], r["intervals"]): r["min"]
+                      for r in baseline["results"]}
+    regressions = []
+    print(f"\nCompared to the baseline (commit {baseline['meta'].get('commit')}):")
+    print(f"{'stage':>20} {'tier type':>12} {'tiers':>6} {'intervals':>10} "
+          f"{'baseline (s)':>12} {'current (s)':>12} {'ratio':>7}")
+    for result in results:
+        key = (result["stage"], result["tier_type"], result["tiers"], result["intervals"])
+        if key not in baseline_times:
+            continue
+        ratio = result["min"] / baseline_times[key]
+        # differences of a few runs of the timer's resolution are just noise
+        flag = " !" if ratio > tolerance and result["min"] - baseline_times[key] > NOISE_FLOOR else ""
+        if flag:
+            regressions.append(result)
+        print(f"{key[0]:>20} {key[1]:>12} {key[2]:>6} {key[3]:>10} "
+              f"{baseline_times[key]:>12.4f} {result['min']:>12.4f} {ratio:>6.2f}x{flag}")
+    return regressions
+
+
+def main():
+    args = argparser.parse_args()
+    sizes = [tuple(int(n) for n in size.split("x")) for size in args.sizes]
+    # keeping the payloads in their (unsaved) documents, there's no database
+    BaseTextGridDocument.INLINE_MAX_SIZE = sys.maxsize
+
+    with TemporaryDirectory() as tmp_dir:
+        package_dir = Path(tmp_dir) / "seshat_parser_pipeline_bench"
+        package_dir.mkdir()
+        (package_dir / "__init__.py").write_text(DUMMY_PARSERS)
+        sys.path.insert(0, tmp_dir)
+        results = run_benchmarks(sizes, args.tier_types, args.repeat, args.seed)
+
+    output = {
+        "meta": {"commit": git_commit(),
+                 "date": datetime.now().isoformat(timespec="seconds"),
+                 "python": platform.python_version(),
+                 "platform": platform.platform(),
+                 "repeat": args.repeat,
+                 "seed": args.seed},
+        "results": results
+    }
+    if args.output is not None:
+        args.output.write_text(json.dumps(output, indent=2))
+
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} stage(s) slower than the baseline by more than {args.tolerance}x")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
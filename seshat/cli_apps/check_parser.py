@@ -3,14 +3,19 @@ from itertools import chain
 
 from seshat.configs import set_up_db
 from .commons import argparser
-from seshat.parsers import list_parsers
+from seshat.parsers import list_parsers, reload_parsers
 
 argparser.add_argument("-p", "--parser", type=str, help="Name of the parser, to check its validity")
 argparser.add_argument("-l", "--list", action="store_true", help="List all available parsers")
+argparser.add_argument("--reload", action="store_true",
+                       help="Rescan the installed parsers, and make the server's workers reload theirs")
 
 def main():
     args = argparser.parse_args()
     set_up_db(args.config)
+    if args.reload:
+        reload_parsers()
+        print("Parsers reloaded")
     parsers_dict = list_parsers()
     if args.list:
         parsers_count = len(list(chain.from_iterable(parsers_dict.values())))
@@ -15,6 +15,9 @@ argparser.add_argument("--step", type=str, choices=["annots", "merge_annots", "m
                        help="Step for which to check the textgrids")
 argparser.add_argument("--merge", action="store_true",
                        help="Test a textgrid couple for mergeability.")
+argparser.add_argument("--stream", action="store_true",
+                       help="Check the textgrid one tier at a time, without loading it whole "
+                            "(the default for big textgrids)")
 
 
 # TODO : allow for double annotator tasks checking (annot merge, time merge)
@@ -30,9 +33,13 @@ def main():
     campaign: Campaign = Campaign.objects.get(slug=args.campaign)
 
     # creating a "fake" Textgrid document
-    tg_doc = SingleAnnotatorTextGrid(textgrid_file=tg_bytes, checking_scheme=campaign.checking_scheme)
+    tg_doc = SingleAnnotatorTextGrid.from_textgrid(tg_bytes, [], None)
+    tg_doc.checking_scheme = campaign.checking_scheme
     error_log.flush()
-    tg_doc.check()
+    if args.stream:
+        tg_doc.check_streaming()
+    else:
+        tg_doc.check()
 
     if error_log.has_errors:
         if error_log.structural:
@@ -46,6 +53,13 @@ def main():
                 print(f"\t- In tier '{tier}'")
                 for error in errors:
                     print(f"\t\t* In interval {error.annot_idx}: {error.msg}")
+
+        if error_log.truncated:
+            print("-> Some errors were not reported, or the checks were stopped, "
+                  "as the errors budget was exceeded")
+            for tier, count in error_log.annot_counts.items():
+                if count > len(error_log.annot.get(tier, ())):
+                    print(f"\t- {count} annotation errors in tier '{tier}'")
     else:
         print("✓ No errors. Textgrid is valid")
 
@@ -0,0 +1,22 @@
+from seshat.configs import set_up_db
+from .commons import argparser
+from ..models import blobs
+
+argparser.add_argument("--grace-period", type=float, default=3600,
+                       help="Blobs that were never referenced by any textgrid are only deleted "
+                            "once older than that (in seconds)")
+
+
+def main():
+    args = argparser.parse_args()
+    set_up_db(args.config)
+    if blobs.blob_store is None:
+        print("No blob store is set up for that config (see TEXTGRID_BLOB_STORE_ROOT)")
+        exit(1)
+
+    deleted = blobs.blob_store.collect_garbage(args.grace_period)
+    print(f"Deleted {deleted} unreferenced blobs")
+
+
+if __name__ == "__main__":
+    main()
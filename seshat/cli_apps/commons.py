@@ -3,7 +3,16 @@ from argparse import ArgumentDefaultsHelpFormatter
 
 from seshat.configs import get_config, config_mapping
 
+
+def config_class(config_name: str):
+    """Config class from its name (as in `config_mapping`)"""
+    if config_name not in config_mapping:
+        raise argparse.ArgumentTypeError("invalid choice: %r (choose from %s)"
+                                         % (config_name, ", ".join(config_mapping)))
+    return get_config(config_name)
+
+
 argparser = argparse.ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
-argparser.add_argument("--config", default=get_config(), type=str,
-                       choices=list(config_mapping.keys()),
+argparser.add_argument("--config", default=get_config(), type=config_class,
+                       metavar="{%s}" % ",".join(config_mapping),
                        help="db name or address")
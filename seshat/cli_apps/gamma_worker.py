@@ -0,0 +1,133 @@
+import multiprocessing
+import time
+from multiprocessing.connection import Connection
+from typing import List, Optional
+
+from seshat.configs import set_up_db, get_config, config_mapping
+from seshat.models.jobs import GammaJob, worker_name
+from .commons import argparser
+
+argparser.description = ("Runs the campaigns' gamma computations queued by the server. "
+                         "Several workers (on several nodes) can share the same database.")
+argparser.add_argument("--concurrency", type=int,
+                       help="Maximum number of gamma computations run in parallel "
+                            "(defaults to the config's GAMMA_WORKER_CONCURRENCY)")
+argparser.add_argument("--poll-interval", type=float, default=2.0,
+                       help="Time (in seconds) between two polls of the jobs queue")
+argparser.add_argument("--once", action="store_true",
+                       help="Exits once the queue is empty and the claimed jobs are done")
+
+
+def run_job(config_name: str, job_id, results: Connection) -> None:
+    """Runs the job, and sends back its error message (None if it succeeded)"""
+    set_up_db(get_config(config_name))
+    try:
+        GammaJob.objects.get(id=job_id).run()
+    except Exception as error:
+        results.send(f"{type(error).__name__}: {error}")
+    else:
+        results.send(None)
+
+
+class JobProcess:
+    """A job's computation, run in its own process (with its own db
+    connection), so that it can be killed if it doesn't finish in time"""
+
+    def __init__(self, job: GammaJob, config_name: str):
+        self.job = job
+        context = multiprocessing.get_context("spawn")
+        self.results, results_sender = context.Pipe(duplex=False)
+        self.process = context.Process(target=run_job, args=(config_name, job.id, results_sender))
+        self.process.start()
+        results_sender.close()
+        self.deadline = time.monotonic() + GammaJob.TIMEOUT
+
+    @property
+    def is_done(self) -> bool:
+        return self.results.poll() or not self.process.is_alive()
+
+    @property
+    def is_overdue(self) -> bool:
+        return time.monotonic() > self.deadline
+
+    def error(self) -> Optional[str]:
+        """Error message of the finished computation (None if it succeeded)"""
+        try:
+            error = self.results.recv()
+        except EOFError:
+            # the process died without sending anything back
+            self.process.join()
+            return f"The computation's process exited with code {self.process.exitcode}"
+        self.process.join()
+        return error
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+
+
+def poll_running_jobs(running: List[JobProcess], worker: str):
+    """Finishes the jobs whose computation is over, and sends the heartbeats
+    of the others. Computations that timed out or whose job was taken over by
+    another worker are killed. Those jobs are removed from `running`."""
+    for job_process in list(running):
+        job = job_process.job
+        if job_process.is_done:
+            running.remove(job_process)
+            error = job_process.error()
+            job.finish(worker, error=error)
+            if error is None:
+                print(f"Gamma computation for campaign {job.campaign.slug} is done")
+            else:
+                print(f"Gamma computation for campaign {job.campaign.slug} failed: {error}")
+        elif job_process.is_overdue:
+            # heartbeats would keep a hung computation's job running forever
+            running.remove(job_process)
+            job_process.kill()
+            job.finish(worker, error=f"The computation didn't finish within {GammaJob.TIMEOUT}s")
+            print(f"Gamma computation for campaign {job.campaign.slug} timed out")
+        elif not job.beat(worker):
+            # the other worker computes it again
+            running.remove(job_process)
+            job_process.kill()
+            print(f"Job for campaign {job.campaign.slug} was taken over by another worker")
+
+
+def main():
+    args = argparser.parse_args()
+    config = args.config
+    # the computations' processes load the config again, by its name
+    config_name = next(name for name, config_cls in config_mapping.items() if config_cls is config)
+    set_up_db(config)
+    concurrency = args.concurrency or int(config.GAMMA_WORKER_CONCURRENCY)
+    worker = worker_name()
+    # the heartbeats have to be well under the stale timeout
+    heartbeat_interval = min(args.poll_interval, GammaJob.STALE_AFTER / 4)
+
+    print(f"Gamma worker {worker} started, running up to {concurrency} jobs at once")
+    running: List[JobProcess] = []
+    try:
+        while True:
+            abandoned_count = GammaJob.fail_abandoned()
+            if abandoned_count:
+                print(f"Failed {abandoned_count} abandoned job(s)")
+
+            while len(running) < concurrency:
+                job = GammaJob.claim(worker)
+                if job is None:
+                    break
+                print(f"Computing gamma for campaign {job.campaign.slug} (attempt {job.attempts})")
+                running.append(JobProcess(job, config_name))
+
+            if not running and args.once:
+                break
+
+            time.sleep(heartbeat_interval)
+            poll_running_jobs(running, worker)
+    except KeyboardInterrupt:
+        # the interrupted jobs will be claimed again by another worker once stale
+        print(f"Interrupted, {len(running)} running job(s) left unfinished")
+
+
+if __name__ == "__main__":
+    main()
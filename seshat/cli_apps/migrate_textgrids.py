@@ -0,0 +1,69 @@
+import zlib
+from typing import Tuple
+
+import tqdm
+
+from seshat.configs import set_up_db
+from ..models import SingleAnnotatorTextGrid
+from ..models.textgrids import LoggedTextGrid, BaseTextGridDocument
+from .commons import argparser
+
+argparser.add_argument("--batch-size", type=int, default=500,
+                       help="Number of textgrid documents loaded at once")
+argparser.add_argument("--inline-max-size", type=int,
+                       help="Payload size (in bytes) under which textgrids are moved in their document. "
+                            "Defaults to the config's TEXTGRID_INLINE_MAX_SIZE")
+argparser.add_argument("--dry-run", action="store_true",
+                       help="Only count the textgrids that would be moved")
+
+
+def iter_gridfs_documents(doc_class, batch_size: int):
+    """Iterates, batch by batch, over the textgrid documents that are still stored
+    in GridFS. Batches are paginated on the documents ids."""
+    last_id = None
+    while True:
+        query = doc_class.objects(textgrid_inline=None, textgrid_file__ne=None)
+        if last_id is not None:
+            query = query(id__gt=last_id)
+        batch = list(query.order_by("id").limit(batch_size))
+        if not batch:
+            return
+        yield from batch
+        last_id = batch[-1].id
+
+
+def migrate_documents(doc_class, inline_max_size: int, batch_size: int,
+                      dry_run: bool = False) -> Tuple[int, int]:
+    """Moves the documents' GridFS textgrids up to that size in the documents
+    themselves. Returns the number of moved textgrids, and of those left in GridFS."""
+    moved, skipped = 0, 0
+    for tg_doc in tqdm.tqdm(iter_gridfs_documents(doc_class, batch_size),
+                            desc=doc_class.__name__):
+        grid_file = tg_doc.textgrid_file.get()
+        if grid_file is None or grid_file.length > inline_max_size:
+            skipped += 1
+            continue
+        moved += 1
+        if dry_run:
+            continue
+        compressed = zlib.compress(grid_file.read())
+        doc_class.objects(id=tg_doc.id).update_one(set__textgrid_inline=compressed,
+                                                   unset__textgrid_file=True)
+        tg_doc.textgrid_file.delete()
+    return moved, skipped
+
+
+def main():
+    args = argparser.parse_args()
+    set_up_db(args.config)
+    inline_max_size = args.inline_max_size or BaseTextGridDocument.INLINE_MAX_SIZE
+
+    # SingleAnnotatorTextGrid's collection also holds the merged textgrids documents
+    for doc_class in (SingleAnnotatorTextGrid, LoggedTextGrid):
+        moved, skipped = migrate_documents(doc_class, inline_max_size, args.batch_size, args.dry_run)
+        print(f"{doc_class.__name__}: {moved} textgrids moved inline, "
+              f"{skipped} left in GridFS")
+
+
+if __name__ == "__main__":
+    main()
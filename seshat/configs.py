@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from typing import Union, Optional
 
 from dotenv import load_dotenv
 from mongoengine import connect
@@ -26,6 +27,48 @@ class BaseConfig:
     MONGODB_HOST = '127.0.0.1'
     MONGODB_PORT = 27017
 
+    # Size (in bytes) of each worker's cache of parsed TextGrids
+    TEXTGRID_CACHE_SIZE = 256 * 1024 ** 2
+    # TextGrids up to that size (in bytes) are stored compressed in their
+    # MongoDB document instead of GridFS
+    TEXTGRID_INLINE_MAX_SIZE = 64 * 1024
+    # If set, TextGrids are stored (deduplicated) in a content-addressed
+    # blob store located in that folder, instead of in MongoDB
+    TEXTGRID_BLOB_STORE_ROOT = None
+    # TextGrids bigger than that (in bytes) are checked one tier at a time
+    TEXTGRID_STREAMING_CHECK_SIZE = 8 * 1024 ** 2
+    # Touching this file (in the LOGS_FOLDER, unless it's an absolute path)
+    # makes all the workers reload their parsers (done by `check-parser
+    # --reload` and the parsers reload endpoint)
+    PARSERS_RELOAD_STAMP = "parsers.reload"
+    # If not 0, custom parsers are run by a pool of that many worker processes
+    # (per server worker), instead of in the server's workers
+    PARSERS_POOL_WORKERS = 0
+    # Time limits (in seconds) of the pool's parsers, for each batch of
+    # annotations and for all the annotations of a textgrid
+    PARSERS_CALL_TIMEOUT = 5
+    PARSERS_FILE_TIMEOUT = 60
+    # Maximum number of pool workers restarts (after a timeout or a crash) per minute
+    PARSERS_POOL_MAX_RESTARTS = 10
+    # Number of workers of the pools used by checking schemes with parallel checking
+    CHECKING_WORKERS = 4
+    # Maximum number of errors reported when checking a TextGrid (the checks
+    # are stopped once it's exceeded), and per tier for annotation errors.
+    # Note that reports with more errors used to be returned in full, and are
+    # now truncated by default. Set these to 0 (or leave them empty) to report
+    # all the errors.
+    TEXTGRID_MAX_ERRORS = 1000
+    TEXTGRID_MAX_TIER_ERRORS = 200
+    # Number of gamma computations run in parallel by each gamma worker
+    # (the `gamma-worker` command)
+    GAMMA_WORKER_CONCURRENCY = 2
+    # Running gamma jobs whose worker hasn't given any sign of life for that
+    # long (in seconds) are taken over by another worker
+    GAMMA_JOBS_STALE_TIMEOUT = 300
+    # Gamma computations that haven't finished after that long (in seconds)
+    # are killed by their worker, and their job fails
+    GAMMA_JOBS_TIMEOUT = 6 * 3600
+
 
 class DevConfig(BaseConfig):
     """Debug Flask Config """
@@ -88,6 +131,15 @@ def get_config(flask_config=None):
     return config_cls
 
 
+def errors_limit(value: Union[int, str, None]) -> Optional[int]:
+    """Errors limit from its config value (possibly a string, if it's set by an
+    environment variable). Empty, null or negative values mean "no limit"."""
+    if value is None or value == "":
+        return None
+    limit = int(value)
+    return limit if limit > 0 else None
+
+
 def set_up_db(config: BaseConfig):
     """Setting up the database based on a config object"""
     # the connect argument makes mongoengine connect lazily to the db,
@@ -96,3 +148,29 @@ def set_up_db(config: BaseConfig):
             host=config.MONGODB_HOST,
             port=config.MONGODB_PORT,
             connect=False)
+    from .models import blobs
+    from .models.textgrids import textgrid_cache, BaseTextGridDocument, SingleAnnotatorTextGrid
+    textgrid_cache.max_size = int(config.TEXTGRID_CACHE_SIZE)
+    BaseTextGridDocument.INLINE_MAX_SIZE = int(config.TEXTGRID_INLINE_MAX_SIZE)
+    SingleAnnotatorTextGrid.STREAMING_CHECK_MIN_SIZE = int(config.TEXTGRID_STREAMING_CHECK_SIZE)
+    if config.TEXTGRID_BLOB_STORE_ROOT:
+        blobs.blob_store = blobs.LocalBlobStore(config.TEXTGRID_BLOB_STORE_ROOT)
+    from .models import tg_checking
+    tg_checking.CHECKING_WORKERS = int(config.CHECKING_WORKERS)
+    from .models import errors
+    errors.default_budget = errors.ErrorsBudget(
+        max_errors=errors_limit(config.TEXTGRID_MAX_ERRORS),
+        max_tier_errors=errors_limit(config.TEXTGRID_MAX_TIER_ERRORS))
+    from .models.jobs import GammaJob
+    GammaJob.STALE_AFTER = int(config.GAMMA_JOBS_STALE_TIMEOUT)
+    GammaJob.TIMEOUT = int(config.GAMMA_JOBS_TIMEOUT)
+    from .parsers import parsers_registry
+    if config.PARSERS_RELOAD_STAMP:
+        parsers_registry.reload_stamp = Path(config.LOGS_FOLDER) / config.PARSERS_RELOAD_STAMP
+    if int(config.PARSERS_POOL_WORKERS):
+        from .parsers.pool import ParsersPool
+        parsers_registry.pool = ParsersPool(workers=int(config.PARSERS_POOL_WORKERS),
+                                            call_timeout=float(config.PARSERS_CALL_TIMEOUT),
+                                            file_timeout=float(config.PARSERS_FILE_TIMEOUT),
+                                            max_restarts=int(config.PARSERS_POOL_MAX_RESTARTS))
+        parsers_registry.pool.reload_stamp = parsers_registry.reload_stamp
@@ -1,4 +1,5 @@
-from typing import Dict
+from collections import defaultdict
+from typing import Dict, List
 
 import slugify
 from flask_smorest import Blueprint, abort
@@ -9,11 +10,12 @@ from .commons import LoggedInMethodView
 from ..models import BaseCorpus
 from ..models.campaigns import Campaign
 from ..models.tg_checking import TextGridCheckingScheme, ParsedTier
-from ..parsers import list_parsers
-from ..parsers.base import AnnotationError
+from ..parsers import list_parsers, reload_parsers, parsers_registry
+from ..parsers.base import ParserFailure
 from ..schemas.campaigns import CampaignCreation, CampaignStatus, CampaignWikiPage
 from ..schemas.campaigns import CampaignSlug, CampaignEditSchema, CampaignSubscriptionUpdate, \
-    CampaignWikiPageUpdate, CheckingSchemeSummary, TierQuickCheck, QuickCheckResponse, ParserClass
+    CampaignWikiPageUpdate, CheckingSchemeSummary, TierQuickCheck, QuickCheckResponse, ParserClass, \
+    BatchQuickCheck, BatchQuickCheckResponse
 from ..schemas.tasks import TaskShortStatus
 
 campaigns_blp = Blueprint("campaigns", __name__, url_prefix="/campaigns",
@@ -25,14 +27,30 @@ class AvailableParsersHandler(AdminMethodView):
 
     @campaigns_blp.response(200, schema=ParserClass(many=True))
     def get(self):
-        """List installed custom parsers"""
+        """List installed custom parsers, along with this worker's verdicts cache statistics"""
         parsers = []
+        verdicts_stats = parsers_registry.verdicts_stats()
         for mod_name, parsers_dict in list_parsers().items():
             for parser_name, parser_class in parsers_dict.items():
-                parsers.append({"name": parser_name, "module": mod_name})
+                parser = {"name": parser_name, "module": mod_name}
+                if (mod_name, parser_name) in verdicts_stats:
+                    parser["verdicts_cache"] = verdicts_stats[(mod_name, parser_name)]
+                parsers.append(parser)
         return parsers
 
 
+@campaigns_blp.route("parsers/reload/")
+class ReloadParsersHandler(AdminMethodView):
+
+    @campaigns_blp.response(200, schema=ParserClass(many=True))
+    def post(self):
+        """Rescans the installed custom parsers, for all the server's workers"""
+        reload_parsers()
+        return [{"name": parser_name, "module": mod_name}
+                for mod_name, parsers_dict in list_parsers().items()
+                for parser_name in parsers_dict]
+
+
 @campaigns_blp.route("admin/")
 class CampaignAdminHandler(AdminMethodView):
 
@@ -206,6 +224,27 @@ class ListTextGridCheckingSchemes(LoggedInMethodView):
         return [checking_scheme.summary for checking_scheme in TextGridCheckingScheme.objects]
 
 
+def get_checking_scheme(campaign_slug: str) -> TextGridCheckingScheme:
+    campaign: Campaign = Campaign.objects.only("check_textgrids", "checking_scheme").get(slug=campaign_slug)
+    if not campaign.check_textgrids:
+        abort(403, message="No checking scheme for that campaign")
+    return campaign.checking_scheme
+
+
+def get_parsed_tier(checking_scheme: TextGridCheckingScheme, campaign_slug: str, tier_name: str) -> ParsedTier:
+    try:
+        tier_specs = checking_scheme.check_plan.tier_schemes[tier_name]
+    except KeyError:
+        return abort(403, message="Checking scheme for campaign %s doesn't have a tier named %s"
+                                  % (campaign_slug, tier_name))
+
+    if not isinstance(tier_specs, ParsedTier):
+        return abort(403, message="Annotation checking is only for parsed tiers")
+    if tier_specs.parser is None:
+        return abort(403, message="The parser for tier %s couldn't be found" % tier_name)
+    return tier_specs
+
+
 @campaigns_blp.route("/quickcheck/<campaign_slug>")
 class ParsedTierQuickCheck(LoggedInMethodView):
 
@@ -215,24 +254,54 @@ class ParsedTierQuickCheck(LoggedInMethodView):
         """Check if a single annotation of a parsed tier is valid.
         Used when annotators want to check if an annotation is valid without
         having to submit the full file."""
-        campaign: Campaign = Campaign.objects.get(slug=campaign_slug)
-        if not campaign.check_textgrids:
-            abort(403, message="No checking scheme for that campaign")
-        try:
-            tier_specs = campaign.checking_scheme.tiers_specs[tier_name]
-        except KeyError:
-            return abort(403, message="Checking scheme for campaign %s doesn't have a tier named %s"
-                                      % (campaign_slug, tier_name))
-
-        if not isinstance(tier_specs, ParsedTier):
-            return abort(403, message="Annotation checking is only for parsed tiers")
-
-        try:
-            tier_specs.parser.check_annotation(annotation)
-        except AnnotationError as err:
+        checking_scheme = get_checking_scheme(campaign_slug)
+        with parsers_registry.pinned():
+            tier_specs = get_parsed_tier(checking_scheme, campaign_slug, tier_name)
+            try:
+                error_msg = tier_specs.parser.get_verdict(annotation)
+            except ParserFailure as e:
+                return abort(503, message="The parser failed: %s" % e)
+        if error_msg is not None:
             return {
                 "is_valid": False,
-                "error_msg": str(err)
+                "error_msg": error_msg
             }
         else:
             return {"is_valid": True}
+
+
+@campaigns_blp.route("/quickcheck/<campaign_slug>/batch")
+class ParsedTierBatchQuickCheck(LoggedInMethodView):
+
+    @campaigns_blp.arguments(BatchQuickCheck, as_kwargs=True)
+    @campaigns_blp.response(200, schema=BatchQuickCheckResponse)
+    def post(self, campaign_slug: str, annotations: List[Dict]):
+        """Checks a batch of annotations of parsed tiers in one go, and returns
+        their verdicts in the same order. Each tier's distinct annotations
+        are checked in a single batch by the tier's parser."""
+        checking_scheme = get_checking_scheme(campaign_slug)
+        # index of each distinct annotation, per tier
+        tiers_annots: Dict[str, Dict[str, int]] = defaultdict(dict)
+        for quickcheck in annotations:
+            tier_annots = tiers_annots[quickcheck["tier_name"]]
+            tier_annots.setdefault(quickcheck["annotation"], len(tier_annots))
+
+        tiers_errors: Dict[str, Dict[str, str]] = {}
+        with parsers_registry.pinned():
+            for tier_name, tier_annots in tiers_annots.items():
+                tier_specs = get_parsed_tier(checking_scheme, campaign_slug, tier_name)
+                distinct_annots = list(tier_annots)
+                try:
+                    annots_errors = tier_specs.parser.check_annotations(distinct_annots)
+                except ParserFailure as e:
+                    return abort(503, message="The parser for tier %s failed: %s" % (tier_name, e))
+                tiers_errors[tier_name] = {distinct_annots[i]: error_msg for i, error_msg in annots_errors}
+
+        verdicts = []
+        for quickcheck in annotations:
+            error_msg = tiers_errors[quickcheck["tier_name"]].get(quickcheck["annotation"])
+            if error_msg is not None:
+                verdicts.append({"is_valid": False, "error_msg": error_msg})
+            else:
+                verdicts.append({"is_valid": True})
+        return {"verdicts": verdicts}
@@ -5,6 +5,7 @@ from flask_smorest import abort
 from jwt import DecodeError
 from mongoengine import DoesNotExist
 
+from ..models.errors import error_log
 from ..models.users import User, Admin, Annotator
 
 
@@ -37,7 +38,9 @@ class LoggedInMethodView(MethodView):
         self.user.check_token(token)
         self.check_user_type()
         try:
-            return super().dispatch_request(*args, **kwargs)
+            # each request gets its own errors log, even if the worker is threaded
+            with error_log.scope():
+                return super().dispatch_request(*args, **kwargs)
         except DoesNotExist:
             abort(404, message="Entity not found in database")
 
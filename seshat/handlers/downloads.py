@@ -37,7 +37,7 @@ class CurrentTextGridDownloadHandler(AnnotatorMethodView):
         tg_name = task.current_tg_template(self.user)
         task.log_download(self.user, tg_name)
         tg_doc = task.textgrids[tg_name]
-        return send_file(tg_doc.textgrid_file,
+        return send_file(tg_doc.open_payload(),
                          as_attachment=True,
                          attachment_filename="%s_%s.TextGrid"
                                              % (task.name, tg_name),
@@ -53,7 +53,7 @@ class ConflictLogDownloadHandler(AnnotatorMethodView):
         tg_name = task.current_tg_template(self.user)
         task.log_download(self.user, tg_name)
         tg_doc = task.textgrids[tg_name]
-        return send_file(tg_doc.textgrid_file,
+        return send_file(tg_doc.open_payload(),
                          as_attachment=True,
                          attachment_filename="%s_%s.TextGrid"
                                              % (task.name, tg_name),
@@ -72,7 +72,7 @@ class TaskTextGridListDownload(AdminMethodView):
         and returns it as Bytes object"""
         try:
             if isinstance(task.files[file_name], BaseTextGridDocument):
-                data = task.files[file_name].textgrid_file.read()
+                data = bytes(task.files[file_name].payload)
                 filename = f"{task.name}_{file_name}.TextGrid"
             else:
                 return abort(404, message="Textgrid hasn't been completed yet")
@@ -112,7 +112,7 @@ class TextGridDownloadHandler(AdminMethodView):
         """Download a specific textgrid"""
         tg_doc: BaseTextGridDocument = BaseTextGridDocument.objects.get(id=textgrid_id)
         # TODO : figure out textgrid name based on task/annotators/campaign
-        return send_file(tg_doc.textgrid_file,
+        return send_file(tg_doc.open_payload(),
                          as_attachment=True,
                          attachment_filename="%s.TextGrid" % textgrid_id,
                          cache_timeout=0)
@@ -8,7 +8,7 @@ from ..models import SingleAnnotatorTask, DoubleAnnotatorTask, Annotator, Campai
 from ..models.errors import error_log
 from ..schemas.tasks import TaskShortStatus, TasksAssignment, TaskFullStatusAdmin, \
     TaskComment, TaskCommentSubmission, \
-    TaskTextgridSubmission, TextGridErrors, TaskLockRequest
+    TaskTextgridSubmission, TaskTextgridValidation, TextGridErrors, TaskLockRequest
 
 tasks_blp = Blueprint("tasks", __name__, url_prefix="/tasks",
                       description="Operations to manage, interact with and display tasks")
@@ -149,17 +149,19 @@ class SubmitTaskFileHandler(AnnotatorMethodView):
 @tasks_blp.route("/validate/<task_id>")
 class ValidateTaskFileHandler(AnnotatorMethodView):
 
-    @tasks_blp.arguments(TaskTextgridSubmission, as_kwargs=True)
+    @tasks_blp.arguments(TaskTextgridValidation, as_kwargs=True)
     @tasks_blp.response(200, schema=TextGridErrors)
-    def post(self, task_id: str, textgrid_str: str):
+    def post(self, task_id: str, textgrid_str: str, fail_fast: bool):
         """Submits a textgrid to a task. The task will figure out by itself
-        the current step it's supposed to belong to, and return any validation error"""
+        the current step it's supposed to belong to, and return any validation error.
+        In fail-fast mode, the validation stops at the first structural error."""
         task: BaseTask = BaseTask.objects.get(id=task_id)
         if task.is_locked:
             return abort(403, message="Task is locked")
         if not task.allow_file_upload(self.user):
             return abort(403, message="Cannot upload file for this task, at this step.")
         error_log.flush()
+        error_log.set_budget(fail_fast=fail_fast)
         task.validate_textgrid(textgrid_str, self.user)
         return error_log.to_errors_summary()
 
@@ -0,0 +1,156 @@
+"""Content-addressed storage for textgrid payloads. Blobs are keyed by the
+SHA-256 digest of their content, so identical payloads (re-submissions,
+templates, validation-only uploads) are only stored once. References
+to each blob are counted in MongoDB, so blobs can be shared across
+workers and nodes."""
+import abc
+import hashlib
+import mmap
+import os
+import time
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Optional, BinaryIO, Union, Iterator, Tuple
+
+from mongoengine import Document, StringField, IntField
+
+
+class BlobRef(Document):
+    """Counts the references to a blob stored in the blob store"""
+    digest = StringField(primary_key=True)
+    length = IntField(required=True)
+    refcount = IntField(default=0)
+    meta = {"collection": "blob_refs"}
+
+
+class BlobStore(abc.ABC):
+    """Base class for the blob store backends"""
+
+    @staticmethod
+    def digest(payload: Union[bytes, memoryview]) -> str:
+        return hashlib.sha256(payload).hexdigest()
+
+    def put(self, payload: Union[bytes, memoryview]) -> str:
+        """Stores the payload (if it isn't already), and returns its digest.
+        Doesn't add any reference to the blob."""
+        digest = self.digest(payload)
+        if not self.exists(digest):
+            self.write(digest, payload)
+        return digest
+
+    def acquire(self, digest: str):
+        """Adds a reference to the blob"""
+        BlobRef.objects(digest=digest).update_one(inc__refcount=1,
+                                                  set_on_insert__length=self.size(digest),
+                                                  upsert=True)
+
+    def release(self, digest: str):
+        """Removes a reference to the blob. Unreferenced blobs are only deleted
+        by `collect_garbage`."""
+        BlobRef.objects(digest=digest).update_one(dec__refcount=1)
+
+    def collect_garbage(self, grace_period: float = 3600) -> int:
+        """Deletes the blobs that aren't referenced anymore, as well as the
+        blobs that never got referenced (their document's save failed) and
+        that are older than the grace period (in seconds). Blobs being
+        re-acquired at the same time could be lost, hence this should be run as
+        a maintenance operation (see the `collect-blobs` command). Returns the
+        number of deleted blobs."""
+        deleted = 0
+        for blob_ref in BlobRef.objects(refcount__lte=0):
+            if BlobRef.objects(digest=blob_ref.digest, refcount__lte=0).delete():
+                self.delete(blob_ref.digest)
+                deleted += 1
+        max_mtime = time.time() - grace_period
+        for digest, mtime in self.iter_blobs():
+            if mtime < max_mtime and BlobRef.objects(digest=digest).first() is None:
+                self.delete(digest)
+                deleted += 1
+        return deleted
+
+    @abc.abstractmethod
+    def exists(self, digest: str) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def size(self, digest: str) -> int:
+        pass
+
+    @abc.abstractmethod
+    def write(self, digest: str, payload: Union[bytes, memoryview]):
+        pass
+
+    @abc.abstractmethod
+    def read(self, digest: str) -> Union[bytes, memoryview]:
+        pass
+
+    @abc.abstractmethod
+    def open(self, digest: str) -> BinaryIO:
+        pass
+
+    @abc.abstractmethod
+    def delete(self, digest: str):
+        pass
+
+    @abc.abstractmethod
+    def iter_blobs(self) -> Iterator[Tuple[str, float]]:
+        """Yields the digest and the modification time of each stored blob"""
+        pass
+
+
+class LocalBlobStore(BlobStore):
+    """Stores blobs as files in a local (or network-mounted) folder, sharded
+    using the first characters of their digest"""
+
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+
+    def path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    def exists(self, digest: str) -> bool:
+        return self.path(digest).exists()
+
+    def size(self, digest: str) -> int:
+        return self.path(digest).stat().st_size
+
+    def write(self, digest: str, payload: Union[bytes, memoryview]):
+        blob_path = self.path(digest)
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        # writing to a temporary file first, so a blob is never seen half-written
+        with NamedTemporaryFile(dir=str(blob_path.parent), delete=False) as tmp_file:
+            tmp_file.write(payload)
+        os.replace(tmp_file.name, str(blob_path))
+
+    def read(self, digest: str) -> Union[bytes, memoryview]:
+        """Memory-maps the blob, and returns a (read-only) view over it"""
+        with open(str(self.path(digest)), "rb") as blob_file:
+            try:
+                mapped = mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty files can't be mapped
+                return b""
+        return memoryview(mapped)
+
+    def open(self, digest: str) -> BinaryIO:
+        """Returns the blob's file object, so downloads are streamed from the
+        disk in chunks instead of being loaded in memory. The uwsgi configs
+        disable the server's file wrapper (it doesn't support the in-memory
+        files of the other downloads), so there is no zero-copy sendfile."""
+        return open(str(self.path(digest)), "rb")
+
+    def delete(self, digest: str):
+        try:
+            self.path(digest).unlink()
+        except FileNotFoundError:
+            pass
+
+    def iter_blobs(self) -> Iterator[Tuple[str, float]]:
+        # skipping the temporary files of the blobs being written
+        for blob_path in self.root.glob("??/??/*"):
+            if len(blob_path.name) == 64:
+                yield blob_path.name, blob_path.stat().st_mtime
+
+
+# set up by `set_up_db` if a blob store is configured, else payloads are
+# stored in their document or in GridFS
+blob_store: Optional[BlobStore] = None
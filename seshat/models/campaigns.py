@@ -1,12 +1,11 @@
 import csv
-import subprocess
 import zipfile
 from collections import defaultdict
 from datetime import datetime
 from io import BytesIO, StringIO
 from pathlib import Path
 from statistics import mean
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from mongoengine import (Document, StringField, ReferenceField, ListField,
                          DateTimeField, EmbeddedDocument, EmbeddedDocumentField, BooleanField,
@@ -14,6 +13,7 @@ from mongoengine import (Document, StringField, ReferenceField, ListField,
 from textgrid import TextGrid
 
 from .corpora import CSVCorpus, BaseCorpus
+from .jobs import GammaJob
 from .tasks import BaseTask, DoubleAnnotatorTask, SingleAnnotatorTask
 from .textgrids import SingleAnnotatorTextGrid
 from .tg_checking import TextGridCheckingScheme
@@ -118,13 +118,15 @@ class Campaign(Document):
             raise ValidationError("Can't serve audio files with a csv corpus")
         super().validate(clean)
 
-    def launch_gamma_update(self):
-        """Launches a subprocess that computes the gamma statistics for
-        that campaign. Does not wait for the subprocess to finish"""
-        process = subprocess.Popen(["campaign-gamma", self.slug])
+    def launch_gamma_update(self) -> GammaJob:
+        """Queues the computation of the gamma statistics for that campaign,
+        which is run by a gamma worker (see the `gamma-worker` command).
+        Doesn't wait for the computation to finish"""
+        job = GammaJob.enqueue(self)
         self.stats.gamma_updating = True
         self.stats.can_update_gamma = False
         self.save()
+        return job
 
     def update_stats(self, gamma_only=False):
         if self.stats is None:
@@ -233,6 +235,11 @@ class Campaign(Document):
         return {"slug": self.slug,
                 "name": self.name}
 
+    @property
+    def gamma_job_status(self) -> Optional[Dict]:
+        job = GammaJob.last_job(self)
+        return job.to_msg() if job is not None else None
+
     @property
     def status(self):
         if self.stats is None:
@@ -243,7 +250,7 @@ class Campaign(Document):
             "name": self.name,
             "description": self.description,
             "creator": self.creator.short_profile,
-            "stats": self.stats.to_msg(),
+            "stats": {**self.stats.to_msg(), "gamma_job": self.gamma_job_status},
             "corpus_path": self.corpus.name,
             "tiers_number": len(self.checking_scheme.tiers_specs) if self.checking_scheme is not None else None,
             "check_textgrids": self.check_textgrids,
@@ -1,7 +1,9 @@
-from collections import defaultdict
-from typing import List, Dict
+from collections import defaultdict, Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Dict, Iterator, Optional
 
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from textgrid import Interval
 
 
@@ -32,19 +34,26 @@ class TextGridAnnotationError(BaseTextGridError):
 
 @dataclass
 class TextgridAnnotationMismatch(BaseTextGridError):
+    """An annotation that differs between the ref and target tiers. Annotations
+    missing from the target are deletions (without a target interval), and
+    extra annotations in the target are insertions (without a ref interval)."""
     ref_tier: str
     target_tier: str
     annot_idx: int
-    ref_interval: Interval
-    target_interval: Interval
+    ref_interval: Optional[Interval]
+    target_interval: Optional[Interval]
+    target_idx: Optional[int] = None
+    kind: str = "substitution"
 
     def to_msg(self) -> Dict:
         return {
             "ref_tier": self.ref_tier,
             "target_tier": self.target_tier,
             "index": self.annot_idx,
-            "ref_annot": self.ref_interval.mark,
-            "target_annot": self.target_interval.mark,
+            "target_index": self.target_idx if self.target_idx is not None else self.annot_idx,
+            "kind": self.kind,
+            "ref_annot": self.ref_interval.mark if self.ref_interval is not None else None,
+            "target_annot": self.target_interval.mark if self.target_interval is not None else None,
         }
 
 
@@ -57,18 +66,25 @@ class MergeConflictsError(BaseTextGridError):
     time_b: float
     index_before: int
 
-    def to_msg(self) -> Dict:
+    @staticmethod
+    def conflict_msg(tier_a: str, tier_b: str, time_a: float, time_b: float,
+                     index_before: int) -> Dict:
+        """Message of a merge conflict, without building its error"""
         from .textgrids import MergedAnnotsTextGrid
         return {
-            "tier_a": self.tier_a,
-            "tier_b": self.tier_b,
-            "time_a": self.time_a,
-            "time_b": self.time_b,
-            "index_before": self.index_before,
-            "index_after": self.index_before + 1,
+            "tier_a": tier_a,
+            "tier_b": tier_b,
+            "time_a": time_a,
+            "time_b": time_b,
+            "index_before": index_before,
+            "index_after": index_before + 1,
             "threshold": MergedAnnotsTextGrid.DIFF_THRESHOLD
         }
 
+    def to_msg(self) -> Dict:
+        return self.conflict_msg(self.tier_a, self.tier_b, self.time_a, self.time_b,
+                                 self.index_before)
+
 
 @dataclass
 class TextGridStructuralError(BaseTextGridError):
@@ -79,34 +95,146 @@ class TextGridStructuralError(BaseTextGridError):
         return {"msg": self.msg}
 
 
+class ErrorBudgetExceeded(Exception):
+    """Raised by an errors log to stop the checks that are run in its
+    `checking` block"""
+    pass
+
+
+@dataclass(frozen=True)
+class ErrorsBudget:
+    """Limits to the errors reported by an errors log. Annotation errors in
+    excess of a tier's limit are only counted. Once the global limit is
+    exceeded, or at the first structural error in fail-fast mode, the
+    checks are stopped."""
+    max_errors: Optional[int] = None
+    max_tier_errors: Optional[int] = None
+    fail_fast: bool = False
+
+
+# budget of the new errors logs, set up by `set_up_db`
+default_budget = ErrorsBudget()
+
+
 class ErrorsLog:
 
-    def __init__(self):
+    def __init__(self, budget: Optional[ErrorsBudget] = None):
+        self.budget = budget if budget is not None else default_budget
         self.structural: List[TextGridStructuralError] = list()
         self.annot: Dict[str, List[TextGridAnnotationError]] = defaultdict(list)
         self.mismatch: List[TextgridAnnotationMismatch] = list()
         self.timing: List[MergeConflictsError] = list()
+        # number of annotation errors found in each tier, including the unreported ones
+        self.annot_counts: Dict[str, int] = Counter()
+        # some errors weren't reported, or the checks were stopped
+        self.truncated = False
+        self._reported_count = 0
+        self._checking_depth = 0
+
+    def set_budget(self, **limits):
+        """Updates some of the budget's limits (see `ErrorsBudget`)"""
+        self.budget = replace(self.budget, **limits)
+
+    @contextmanager
+    def checking(self):
+        """Checks run in that block are stopped (silently) once the errors budget
+        is exceeded. Outside of it, errors in excess are only dropped."""
+        self._checking_depth += 1
+        try:
+            yield self
+        except ErrorBudgetExceeded:
+            pass
+        finally:
+            self._checking_depth -= 1
+
+    def _stop(self):
+        self.truncated = True
+        if self._checking_depth:
+            raise ErrorBudgetExceeded()
+
+    def _spend(self) -> bool:
+        """Accounts for a new error to be reported. Returns False if the budget
+        is already spent, in which case the error shouldn't be reported."""
+        if self.budget.max_errors is not None and self._reported_count >= self.budget.max_errors:
+            self._stop()
+            return False
+        self._reported_count += 1
+        return True
+
+    def _spend_annot(self, tier: str) -> bool:
+        self.annot_counts[tier] += 1
+        max_tier_errors = self.budget.max_tier_errors
+        if max_tier_errors is not None and len(self.annot.get(tier, ())) >= max_tier_errors:
+            self.truncated = True
+            return False
+        return self._spend()
 
     def log_structural(self, msg: str):
-        self.structural.append(TextGridStructuralError(msg))
+        if self._spend():
+            self.structural.append(TextGridStructuralError(msg))
+        if self.budget.fail_fast:
+            self._stop()
 
     def log_mismatch(self, ref_tier: str, target_tier: str, annot_idx: int,
-                     ref_interval: Interval, target_interval):
-        self.mismatch.append(TextgridAnnotationMismatch(
-            ref_tier, target_tier, annot_idx, ref_interval, target_interval
-        ))
+                     ref_interval: Optional[Interval], target_interval: Optional[Interval],
+                     target_idx: Optional[int] = None, kind: str = "substitution"):
+        if self._spend():
+            self.mismatch.append(TextgridAnnotationMismatch(
+                ref_tier, target_tier, annot_idx, ref_interval, target_interval, target_idx, kind
+            ))
 
     def log_merge(self, merge_conflict: MergeConflictsError):
-        self.timing.append(merge_conflict)
+        if self._spend():
+            self.timing.append(merge_conflict)
 
     def log_annot(self, tier: str, annot_idx: int, interval: Interval, msg: str):
-        self.annot[tier].append(TextGridAnnotationError(tier, annot_idx, interval, msg))
+        if self._spend_annot(tier):
+            self.annot[tier].append(TextGridAnnotationError(tier, annot_idx, interval, msg))
+
+    def reserve_annots(self, tier: str, count: int) -> int:
+        """For `count` annotation errors about to be logged in that tier, returns
+        how many of them can be reported. The others are only counted, so
+        there's no need to build (and log) them."""
+        max_tier_errors = self.budget.max_tier_errors
+        if max_tier_errors is None:
+            return count
+        room = max(max_tier_errors - len(self.annot.get(tier, ())), 0)
+        if count > room:
+            self.annot_counts[tier] += count - room
+            self.truncated = True
+            return room
+        return count
+
+    def merge(self, other: 'ErrorsLog'):
+        """Appends another log's errors to this one's, within this log's budget"""
+        self.truncated |= other.truncated
+        for error in other.structural:
+            if self._spend():
+                self.structural.append(error)
+        for tier, count in other.annot_counts.items():
+            errors = other.annot.get(tier, [])
+            # counting the errors that weren't reported by the other log
+            self.annot_counts[tier] += count - len(errors)
+            for error in errors:
+                if self._spend_annot(tier):
+                    self.annot[tier].append(error)
+        for error in other.mismatch:
+            if self._spend():
+                self.mismatch.append(error)
+        for error in other.timing:
+            if self._spend():
+                self.timing.append(error)
+        if other.structural and self.budget.fail_fast:
+            self._stop()
 
     def flush(self):
         self.structural = list()
         self.annot = defaultdict(list)
         self.mismatch = list()
         self.timing = list()
+        self.annot_counts = Counter()
+        self.truncated = False
+        self._reported_count = 0
 
     @property
     def total_errors(self) -> int:
@@ -115,7 +243,7 @@ class ErrorsLog:
 
     @property
     def has_errors(self) -> bool:
-        return bool(self.total_errors)
+        return bool(self.total_errors) or self.truncated
 
     def to_errors_summary(self):
         return {
@@ -125,8 +253,41 @@ class ErrorsLog:
             "time_conflict": [error.to_msg() for error in self.timing],
             "annot": {tier: [error.to_msg() for error in errors]
                       for tier, errors in self.annot.items()},
-            "total_error_count": self.total_errors
+            "total_error_count": self.total_errors,
+            "annot_counts": dict(self.annot_counts),
+            "truncated": self.truncated
         }
 
 
-error_log = ErrorsLog()
+_current_errors_log: ContextVar[ErrorsLog] = ContextVar("errors_log")
+
+
+class ErrorsLogProxy:
+    """Stands for the errors log of the current context (that is, of the
+    current request, thread or greenlet), so concurrent requests served by the
+    same worker don't mix up their errors. Use `scope` to bind a new log."""
+
+    @staticmethod
+    def get_current() -> ErrorsLog:
+        try:
+            return _current_errors_log.get()
+        except LookupError:
+            # no log bound to this context yet
+            errors_log = ErrorsLog()
+            _current_errors_log.set(errors_log)
+            return errors_log
+
+    @contextmanager
+    def scope(self, budget: Optional[ErrorsBudget] = None) -> Iterator[ErrorsLog]:
+        """Binds a new, empty, errors log for the duration of the block"""
+        token = _current_errors_log.set(ErrorsLog(budget))
+        try:
+            yield _current_errors_log.get()
+        finally:
+            _current_errors_log.reset(token)
+
+    def __getattr__(self, name: str):
+        return getattr(self.get_current(), name)
+
+
+error_log = ErrorsLogProxy()
@@ -0,0 +1,149 @@
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Optional, Dict
+
+from mongoengine import Document, ReferenceField, StringField, DateTimeField, IntField, Q, NotUniqueError
+
+
+def worker_name() -> str:
+    """Identifies the current worker process, among all the nodes"""
+    return "%s:%i" % (socket.gethostname(), os.getpid())
+
+
+class GammaJob(Document):
+    """Computation of a campaign's gamma agreement values, queued by the server
+    and run by a gamma worker (see the `gamma-worker` command). Workers, on
+    any node, claim the pending jobs atomically. While a job runs, its worker
+    sends heartbeats: running jobs without any heartbeat for `STALE_AFTER`
+    seconds are claimed again (up to `MAX_ATTEMPTS` times), since their worker
+    is most likely dead. Computations still running after `TIMEOUT` seconds
+    are killed by their worker, and their job fails."""
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    STALE_AFTER = 300  # in seconds
+    MAX_ATTEMPTS = 3
+    TIMEOUT = 6 * 3600  # in seconds
+
+    campaign = ReferenceField('Campaign', required=True)
+    status = StringField(choices=(PENDING, RUNNING, DONE, FAILED), default=PENDING, required=True)
+    creation_time = DateTimeField(default=datetime.now, required=True)
+    start_time = DateTimeField()
+    finish_time = DateTimeField()
+    # worker that claimed the job, and its last sign of life
+    worker = StringField()
+    heartbeat = DateTimeField()
+    attempts = IntField(default=0)
+    # number of tasks whose gamma has been computed, out of `tasks_count`
+    progress = IntField(default=0)
+    tasks_count = IntField()
+    error = StringField()
+    meta = {"collection": "gamma_jobs",
+            "indexes": [("status", "creation_time"),
+                        ("campaign", "-creation_time"),
+                        # deduplicates the concurrent requests of the same campaign
+                        {"fields": ["campaign"], "unique": True,
+                         "partialFilterExpression": {"status": PENDING},
+                         "name": "pending_campaign_job"}]}
+
+    @classmethod
+    def enqueue(cls, campaign: 'Campaign') -> 'GammaJob':
+        """Queues a gamma computation for that campaign. Requests made while a
+        job is still pending for that campaign all share that job."""
+        pending = cls.objects(campaign=campaign, status=cls.PENDING)
+        try:
+            return pending.upsert_one(set_on_insert__creation_time=datetime.now())
+        except NotUniqueError:
+            # a concurrent request inserted the pending job first
+            job = pending.first()
+            if job is None:
+                # ... and it has already been claimed
+                return cls.enqueue(campaign)
+            return job
+
+    @classmethod
+    def last_job(cls, campaign: 'Campaign') -> Optional['GammaJob']:
+        return cls.objects(campaign=campaign).order_by("-creation_time").first()
+
+    @classmethod
+    def claim(cls, worker: str) -> Optional['GammaJob']:
+        """Atomically claims the oldest pending job (or stale running job) for
+        that worker, if there's any"""
+        now = datetime.now()
+        stale = Q(status=cls.RUNNING,
+                  heartbeat__lt=now - timedelta(seconds=cls.STALE_AFTER),
+                  attempts__lt=cls.MAX_ATTEMPTS)
+        return (cls.objects(Q(status=cls.PENDING) | stale)
+                .order_by("creation_time")
+                .modify(new=True,
+                        set__status=cls.RUNNING,
+                        set__worker=worker,
+                        set__start_time=now,
+                        set__heartbeat=now,
+                        inc__attempts=1))
+
+    @classmethod
+    def fail_abandoned(cls) -> int:
+        """Fails the stale running jobs that can't be claimed again. Returns
+        their number."""
+        stale_date = datetime.now() - timedelta(seconds=cls.STALE_AFTER)
+        abandoned = list(cls.objects(status=cls.RUNNING, heartbeat__lt=stale_date,
+                                     attempts__gte=cls.MAX_ATTEMPTS))
+        for job in abandoned:
+            job.finish(job.worker, error="The job's workers stopped responding %i times" % job.attempts)
+        return len(abandoned)
+
+    def beat(self, worker: str) -> bool:
+        """Records a sign of life of the job's worker. Returns False if the job
+        has been claimed by another worker in the meantime."""
+        return bool(GammaJob.objects(id=self.id, worker=worker, status=self.RUNNING)
+                    .update_one(set__heartbeat=datetime.now()))
+
+    def finish(self, worker: str, error: Optional[str] = None):
+        """Marks the job as done (or failed, if there's an error), unless it
+        has been claimed by another worker in the meantime"""
+        updated = (GammaJob.objects(id=self.id, worker=worker, status=self.RUNNING)
+                   .update_one(set__status=self.FAILED if error is not None else self.DONE,
+                               set__finish_time=datetime.now(),
+                               set__error=error))
+        if not updated:
+            return
+        campaign = self.campaign
+        campaign.reload()
+        # the campaign might have been queued again while this job was running
+        campaign.stats.gamma_updating = bool(
+            GammaJob.objects(campaign=campaign, status__in=(self.PENDING, self.RUNNING)).count())
+        campaign.update_stats(gamma_only=True)
+
+    def run(self):
+        """Computes the gamma values of the campaign's double-annotator tasks
+        that don't have them yet, recording the job's progress along the way"""
+        from .tasks import DoubleAnnotatorTask
+        campaign = self.campaign
+        if campaign.stats is None or not campaign.stats.can_compute_gamma:
+            raise ValueError("It's not possible to compute the gamma agreement for campaign %s" % campaign.name)
+        tasks = [task for task in campaign.tasks
+                 if isinstance(task, DoubleAnnotatorTask)
+                 and task.merged_tg is not None
+                 and not task.tiers_gamma]
+        GammaJob.objects(id=self.id).update_one(set__tasks_count=len(tasks), set__progress=0)
+        for progress, task in enumerate(tasks, start=1):
+            task.compute_gamma()
+            task.save()
+            GammaJob.objects(id=self.id).update_one(set__progress=progress)
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in (self.PENDING, self.RUNNING)
+
+    def to_msg(self) -> Dict:
+        return {"status": self.status,
+                "progress": self.progress,
+                "tasks_count": self.tasks_count,
+                "creation_time": self.creation_time,
+                "start_time": self.start_time,
+                "finish_time": self.finish_time,
+                "error": self.error}
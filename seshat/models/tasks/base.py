@@ -3,16 +3,27 @@ from datetime import datetime
 from enum import Enum
 from io import BytesIO
 from pathlib import Path
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Type
 
 from flask import current_app
 from mongoengine import EmbeddedDocument, ReferenceField, DateTimeField, StringField, BooleanField, Document, \
-    EmbeddedDocumentListField, DateField, Q, ValidationError, DoesNotExist
+    EmbeddedDocumentListField, DateField, Q, ValidationError, DoesNotExist, MapField, FloatField
 from mongoengine import (PULL, NULLIFY, signals)
 
 from ..commons import notif_dispatch
+from ..errors import error_log
 from ..textgrids import BaseTextGridDocument
-from ..textgrids import LoggedTextGrid
+from ..textgrids import LoggedTextGrid, UploadChecks, TierCheck
+from ...parsers import parsers_registry
+from ...utils import SizedLRUCache, StagesTimer
+
+# Per-worker cache of the uploads' checks, keyed by the uploaded file's digest,
+# the checking scheme (its version and its parsers' fingerprints), the task
+# step, the checked textgrid's class and the errors budget. Clients usually
+# validate a textgrid right before submitting the very same file, which then
+# doesn't have to be checked again. Uploads checked by parsers whose verdicts
+# can't be reused aren't cached. Entries are sized by their number of errors.
+upload_checks_cache = SizedLRUCache(max_size=500000)
 
 
 class TaskComment(EmbeddedDocument):
@@ -36,6 +47,8 @@ class FileDownload(EmbeddedDocument):
 class FileUpload(EmbeddedDocument):
     tg_file = ReferenceField('LoggedTextGrid', required=True)
     is_valid = BooleanField(required=True)
+    # time spent (in seconds) in each stage of the upload's processing
+    timings: Dict[str, float] = MapField(FloatField())
 
 
 class BaseTask(Document):
@@ -157,13 +170,71 @@ class BaseTask(Document):
 
         return buffer.getvalue()
 
+    def load_upload(self, doc_class: Type[BaseTextGridDocument], textgrid: str, creators: List['Annotator'],
+                    timer: StagesTimer) -> BaseTextGridDocument:
+        """Textgrid document of an uploaded file. The document keeps the file in
+        memory, and the textgrid it's parsed into, so the upload's processing
+        stages don't have to read back or parse it again."""
+        with timer.stage("store"):
+            return doc_class.from_textgrid(textgrid, creators, self)
+
+    def check_upload(self, tg: BaseTextGridDocument, annotator: 'Annotator',
+                     timer: Optional[StagesTimer] = None):
+        """Checks a textgrid uploaded by that annotator. The checks of its tiers
+        are recorded (to be logged with the upload), and the tiers that didn't
+        change since the annotator's previous upload at this step aren't
+        checked again. Files that were already checked at this step (usually
+        validated before being submitted) aren't checked at all (nor parsed):
+        the errors they had are logged again."""
+        timer = timer if timer is not None else StagesTimer()
+        step = self.steps_names[self.current_step]
+        checking_scheme = self.campaign.checking_scheme
+        scheme_version = checking_scheme.version if checking_scheme else None
+        # the parsers used (and fingerprinted) are the same for the whole check
+        with parsers_registry.pinned():
+            # the parsers' fingerprints: checks by another version of a parser (or
+            # by a parser whose verdicts can't be reused) aren't reused either
+            fingerprint = checking_scheme.check_plan.verdicts_fingerprint if checking_scheme else ()
+            cache_key = (tg.payload_digest,
+                         checking_scheme.id if checking_scheme else None, scheme_version,
+                         fingerprint, step, type(tg).__name__, error_log.budget)
+            cached = upload_checks_cache.get(cache_key) if fingerprint is not None else None
+            if cached is not None:
+                check_log, tiers_checks = cached
+                tg.upload_checks = UploadChecks(step=step, scheme_version=scheme_version, previous={},
+                                                tiers={name: TierCheck._from_son(tier_check.to_mongo())
+                                                       for name, tier_check in tiers_checks.items()})
+                error_log.merge(check_log)
+                return
+
+            if not tg.is_streamed:
+                with timer.stage("parse"):
+                    tg.textgrid
+            with timer.stage("check"):
+                tg.upload_checks = UploadChecks(step=step, scheme_version=scheme_version,
+                                                previous=LoggedTextGrid.previous_checks(self, annotator, step))
+                with error_log.scope(error_log.budget) as check_log:
+                    tg.check()
+            if fingerprint is not None:
+                upload_checks_cache.put(cache_key, (check_log, dict(tg.upload_checks.tiers)),
+                                        1 + check_log.total_errors + sum(check_log.annot_counts.values()))
+            error_log.merge(check_log)
+
     def _log_upload(self, textgrid: str,
                     annotator: 'Annotator',
-                    is_valid: bool = None):
-        logged_tg = LoggedTextGrid.from_textgrid(textgrid, [annotator], self)
-        logged_tg.save()
+                    is_valid: bool = None,
+                    checked_tg: Optional[BaseTextGridDocument] = None,
+                    timer: Optional[StagesTimer] = None):
+        """Logs the upload (along with its checked textgrid's tiers checks,
+        and the timings of its processing stages)"""
+        timer = timer if timer is not None else StagesTimer()
+        with timer.stage("log"):
+            logged_tg = LoggedTextGrid.from_upload(textgrid, annotator, self, checked_tg)
+            if checked_tg is not None and checked_tg.upload_checks is not None:
+                logged_tg.record_checks(checked_tg.upload_checks)
+            logged_tg.save()
         self.file_uploads.append(
-            FileUpload(tg_file=logged_tg, is_valid=is_valid)
+            FileUpload(tg_file=logged_tg, is_valid=is_valid, timings=timer.timings)
         )
         self.save()
 
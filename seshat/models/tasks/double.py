@@ -1,18 +1,22 @@
 from datetime import datetime
 from enum import Enum
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple, Iterator, List
 
+import numpy as np
 from mongoengine import (EmbeddedDocument, FloatField, IntField, BooleanField, StringField, EmbeddedDocumentListField,
-                         ReferenceField, EmbeddedDocumentField, MapField, signals)
+                         ReferenceField, EmbeddedDocumentField, MapField, BinaryField, signals)
 
 from ..commons import notif_dispatch
 from ..errors import MergeConflictsError, error_log
 from ..tasks.base import BaseTask
 from ..textgrids import MergedAnnotsTextGrid, BaseTextGridDocument, SingleAnnotatorTextGrid, MergedTimesTextGrid
 from ..tg_checking import TextGridCheckingScheme
+from ...utils import StagesTimer
 
 
 class FrontierMerge(EmbeddedDocument):
+    """Merge of a pair of frontiers, as stored before `TierMerge` stored its
+    conflicts as arrays"""
     time_a = FloatField(required=True)
     time_b = FloatField(required=True)
     interval_index_before = IntField(required=True)
@@ -22,24 +26,64 @@ class FrontierMerge(EmbeddedDocument):
 
 
 class TierMerge(EmbeddedDocument):
+    """Frontiers of a pair of tiers that couldn't be merged (the conflicts).
+    They're stored as parallel arrays: the index of the interval before each
+    conflicting frontier, and that frontier's time in each tier."""
     tier_a = StringField(required=True)
     tier_b = StringField(required=True)
+    # number of compared frontiers, merged or not
+    frontiers_count = IntField(default=0)
+    conflicts_indexes = BinaryField()
+    conflicts_times_a = BinaryField()
+    conflicts_times_b = BinaryField()
+    # frontiers merges of the tiers merged before the conflicts were stored as arrays
     frontiers_merge = EmbeddedDocumentListField(FrontierMerge)
 
+    @classmethod
+    def from_conflicts(cls, tier_a: str, tier_b: str, frontiers_count: int,
+                       indexes: np.ndarray, times_a: np.ndarray, times_b: np.ndarray) -> 'TierMerge':
+        return cls(tier_a=tier_a, tier_b=tier_b, frontiers_count=frontiers_count,
+                   conflicts_indexes=indexes.astype(np.int32).tobytes(),
+                   conflicts_times_a=times_a.astype(np.float64).tobytes(),
+                   conflicts_times_b=times_b.astype(np.float64).tobytes())
+
+    @property
+    def conflicts(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Index of the interval before each conflicting frontier, and its times in both tiers"""
+        if self.frontiers_merge:
+            conflicts = [frontier_merge for frontier_merge in self.frontiers_merge
+                         if not frontier_merge.could_merge]
+            return (np.array([conflict.interval_index_before for conflict in conflicts], dtype=np.int32),
+                    np.array([conflict.time_a for conflict in conflicts], dtype=np.float64),
+                    np.array([conflict.time_b for conflict in conflicts], dtype=np.float64))
+        return (np.frombuffer(self.conflicts_indexes or b"", dtype=np.int32),
+                np.frombuffer(self.conflicts_times_a or b"", dtype=np.float64),
+                np.frombuffer(self.conflicts_times_b or b"", dtype=np.float64))
+
+    def iter_conflicts(self) -> Iterator[Tuple[int, float, float]]:
+        indexes, times_a, times_b = self.conflicts
+        return zip(indexes.tolist(), times_a.tolist(), times_b.tolist())
+
 
 class MergeResults(EmbeddedDocument):
     tiers_merges = EmbeddedDocumentListField(TierMerge)
 
-    def to_merge_conflicts_errors(self):
+    def to_merge_conflicts_errors(self) -> Iterator[MergeConflictsError]:
         for tier_merge in self.tiers_merges:
-            for frontier_merge in tier_merge.frontiers_merge:
-                if not frontier_merge.could_merge:
-                    yield MergeConflictsError(
-                        tier_a=tier_merge.tier_a,
-                        tier_b=tier_merge.tier_b,
-                        time_a=frontier_merge.time_a,
-                        time_b=frontier_merge.time_b,
-                        index_before=frontier_merge.interval_index_before)
+            for index_before, time_a, time_b in tier_merge.iter_conflicts():
+                yield MergeConflictsError(
+                    tier_a=tier_merge.tier_a,
+                    tier_b=tier_merge.tier_b,
+                    time_a=time_a,
+                    time_b=time_b,
+                    index_before=index_before)
+
+    def to_merge_table(self) -> List[Dict]:
+        """Messages of the merge conflicts (see `MergeConflictsError.conflict_msg`)"""
+        return [MergeConflictsError.conflict_msg(tier_merge.tier_a, tier_merge.tier_b,
+                                                 time_a, time_b, index_before)
+                for tier_merge in self.tiers_merges
+                for index_before, time_a, time_b in tier_merge.iter_conflicts()]
 
 
 class DoubleAnnotatorTask(BaseTask):
@@ -231,22 +275,23 @@ class DoubleAnnotatorTask(BaseTask):
         }
 
         if self.current_step == self.Steps.MERGING_TIMES:
-            double_annot_data["frontiers_merge_table"] = [error.to_msg() for error
-                                                          in self.times_conflicts.to_merge_conflicts_errors()]
+            double_annot_data["frontiers_merge_table"] = self.times_conflicts.to_merge_table()
 
         return {**super().get_annotator_status(annotator), "double_annot_data": double_annot_data}
 
-    def process_ref(self, textgrid: str):
-        """Handles the submission of a textgrid sent by the reference annotator"""
+    def process_ref(self, textgrid: str, timer: StagesTimer) -> BaseTextGridDocument:
+        """Handles the submission of a textgrid sent by the reference annotator.
+        Returns the checked textgrid."""
         if self.merged_tg is None:
             # it's a completed single-annotator textgrid
-            tg = SingleAnnotatorTextGrid.from_textgrid(textgrid, [self.reference], self)
-            tg.check()
+            tg = self.load_upload(SingleAnnotatorTextGrid, textgrid, [self.reference], timer)
+            self.check_upload(tg, self.reference, timer)
             if not error_log.has_errors:
                 self.ref_tg = tg
                 if self.target_tg is not None:
                     error_log.flush()
-                    merged_tg = MergedAnnotsTextGrid.from_ref_and_target(self.ref_tg, self.target_tg)
+                    with timer.stage("merge"):
+                        merged_tg = MergedAnnotsTextGrid.from_ref_and_target(self.ref_tg, self.target_tg)
                     if not error_log.has_errors:
                         self.merged_tg = merged_tg
                         self.notify_merged_ready(self.target)
@@ -255,94 +300,106 @@ class DoubleAnnotatorTask(BaseTask):
 
         elif self.merged_annots_tg is None:
             # processing the merged annots textgrid
-            tg = MergedAnnotsTextGrid.from_textgrid(textgrid, self.annotators, self)
-            tg.check()
+            tg = self.load_upload(MergedAnnotsTextGrid, textgrid, self.annotators, timer)
+            self.check_upload(tg, self.reference, timer)
             if not error_log.has_errors:
                 self.merged_annots_tg = tg
-                merged_times_tg, self.times_conflicts = tg.gen_merged_times()
-                self.merged_times_tg = MergedTimesTextGrid.from_textgrid(merged_times_tg,
-                                                                         self.annotators,
-                                                                         self)
+                with timer.stage("merge"):
+                    merged_times_tg, self.times_conflicts = tg.gen_merged_times()
+                    self.merged_times_tg = MergedTimesTextGrid.from_textgrid(merged_times_tg,
+                                                                             self.annotators,
+                                                                             self)
 
         elif self.final_tg is None:
-            tg = MergedTimesTextGrid.from_textgrid(textgrid, self.annotators, self)
-            tg.check()
+            tg = self.load_upload(MergedTimesTextGrid, textgrid, self.annotators, timer)
+            self.check_upload(tg, self.reference, timer)
             if not error_log.has_errors:
-                final_tg, _ = tg.check_times_merging()
-                self.final_tg = SingleAnnotatorTextGrid.from_textgrid(final_tg, self.annotators, self)
+                with timer.stage("merge"):
+                    # the times were already merged by the check
+                    final_tg, _ = tg.merge_times()
+                    self.final_tg = SingleAnnotatorTextGrid.from_textgrid(final_tg, self.annotators, self)
                 self.is_done = True
                 self.finish_time = datetime.now()
                 self.notify_done()
                 self.campaign.update_stats()
 
         else:  # re-submitting a final textgrid
-            tg = SingleAnnotatorTextGrid.from_textgrid(textgrid, self.annotators, self)
-            tg.check()
+            tg = self.load_upload(SingleAnnotatorTextGrid, textgrid, self.annotators, timer)
+            self.check_upload(tg, self.reference, timer)
             if not error_log.has_errors:
                 # we don't notify since it's already done
                 self.final_tg = tg
                 self.finish_time = datetime.now()
                 self.tiers_gamma = {}
+        return tg
 
-    def process_target(self, textgrid: str):
-        """Handles the submission of a textgrid sent by the target annotator"""
+    def process_target(self, textgrid: str, timer: StagesTimer) -> Optional[BaseTextGridDocument]:
+        """Handles the submission of a textgrid sent by the target annotator.
+        Returns the checked textgrid, if any."""
+        tg = None
         if self.merged_tg is None:
             # it's a completed textgrid
-            tg = SingleAnnotatorTextGrid.from_textgrid(textgrid, self.annotators, self)
-            tg.check()
+            tg = self.load_upload(SingleAnnotatorTextGrid, textgrid, self.annotators, timer)
+            self.check_upload(tg, self.target, timer)
             if not error_log.has_errors:
                 self.target_tg = tg
                 if self.ref_tg is not None:
                     error_log.flush()
-                    merged_tg = MergedAnnotsTextGrid.from_ref_and_target(self.ref_tg, self.target_tg)
+                    with timer.stage("merge"):
+                        merged_tg = MergedAnnotsTextGrid.from_ref_and_target(self.ref_tg, self.target_tg)
                     if not error_log.has_errors:
                         self.merged_tg = merged_tg
                         self.notify_merged_ready(self.reference)
                         self.tiers_gamma = None
                         self.campaign.update_stats(gamma_only=True)
+        return tg
 
     def submit_textgrid(self, textgrid: str, annotator: 'Annotator'):
         if self.is_locked:
             return
 
         error_log.flush()
+        timer = StagesTimer()
+        tg = None
         if annotator == self.reference:
-            self.process_ref(textgrid)
+            tg = self.process_ref(textgrid, timer)
         elif annotator == self.target:
-            self.process_target(textgrid)
+            tg = self.process_target(textgrid, timer)
 
-        self.cascade_save()
-        self._log_upload(textgrid, annotator, not error_log.has_errors)
+        with timer.stage("persist"):
+            self.cascade_save()
+        self._log_upload(textgrid, annotator, not error_log.has_errors, tg, timer)
 
     def validate_textgrid(self, textgrid: str, annotator: 'Annotator'):
         if self.is_locked:
             return
 
         error_log.flush()
-        tg: BaseTextGridDocument = None
+        timer = StagesTimer()
         if annotator == self.reference:
             if self.merged_tg is None:
                 # it's a completed textgrid
-                tg = SingleAnnotatorTextGrid.from_textgrid(textgrid, [self.reference], self)
+                doc_class, creators = SingleAnnotatorTextGrid, [self.reference]
 
             elif self.merged_annots_tg is None:
                 # processing the merged annots textgrid
-                tg = MergedAnnotsTextGrid.from_textgrid(textgrid, self.annotators, self)
+                doc_class, creators = MergedAnnotsTextGrid, self.annotators
 
             elif self.merged_times_tg is not None and self.final_tg is None:
                 # the times haven't been merged yet
-                tg = MergedTimesTextGrid.from_textgrid(textgrid, self.annotators, self)
+                doc_class, creators = MergedTimesTextGrid, self.annotators
             else:
                 # it's the final textgrid
-                tg = SingleAnnotatorTextGrid.from_textgrid(textgrid, self.annotators, self)
+                doc_class, creators = SingleAnnotatorTextGrid, self.annotators
         elif annotator == self.target:
             # only one possible textgrid to validate
-            tg = SingleAnnotatorTextGrid.from_textgrid(textgrid, [self.target_tg], self)
+            doc_class, creators = SingleAnnotatorTextGrid, [self.target_tg]
         else:
             return
 
-        tg.check()
-        self._log_upload(textgrid, annotator, not error_log.has_errors)
+        tg = self.load_upload(doc_class, textgrid, creators, timer)
+        self.check_upload(tg, annotator, timer)
+        self._log_upload(textgrid, annotator, not error_log.has_errors, tg, timer)
 
     def compute_gamma(self):
         checking_scheme: TextGridCheckingScheme = self.campaign.checking_scheme
@@ -7,6 +7,7 @@ from mongoengine import ReferenceField, signals
 from ..textgrids import BaseTextGridDocument, SingleAnnotatorTextGrid
 from ..errors import error_log
 from .base import BaseTask
+from ...utils import StagesTimer
 
 
 class SingleAnnotatorTask(BaseTask):
@@ -65,8 +66,9 @@ class SingleAnnotatorTask(BaseTask):
         if self.is_locked:
             return
 
-        tg = SingleAnnotatorTextGrid.from_textgrid(textgrid, self.annotators, self)
-        tg.check()
+        timer = StagesTimer()
+        tg = self.load_upload(SingleAnnotatorTextGrid, textgrid, self.annotators, timer)
+        self.check_upload(tg, annotator, timer)
         if not error_log.has_errors:
             self.is_done = True
             if self.final_tg is None:
@@ -75,18 +77,20 @@ class SingleAnnotatorTask(BaseTask):
             self.final_tg = tg
             self.finish_time = datetime.now()
 
-        self.cascade_save()
-        self._log_upload(textgrid, annotator, not error_log.has_errors)
+        with timer.stage("persist"):
+            self.cascade_save()
+        self._log_upload(textgrid, annotator, not error_log.has_errors, tg, timer)
 
     def validate_textgrid(self, textgrid: str, annotator: 'Annotator'):
         if self.is_locked:
             return
 
         error_log.flush()
-        tg = SingleAnnotatorTextGrid.from_textgrid(textgrid, [self.annotator], self)
+        timer = StagesTimer()
+        tg = self.load_upload(SingleAnnotatorTextGrid, textgrid, [self.annotator], timer)
 
-        tg.check()
-        self._log_upload(textgrid, annotator, not error_log.has_errors)
+        self.check_upload(tg, annotator, timer)
+        self._log_upload(textgrid, annotator, not error_log.has_errors, tg, timer)
 
 signals.post_delete.connect(BaseTask.post_delete_cleanup, sender=SingleAnnotatorTask)
 signals.pre_save.connect(BaseTask.pre_save, sender=SingleAnnotatorTask)
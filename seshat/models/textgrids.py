@@ -1,21 +1,105 @@
-import re
+import hashlib
+import json
+import zlib
 from collections import Counter
-from copy import deepcopy
+from dataclasses import dataclass, field
 from datetime import datetime
-from statistics import mean
-from typing import Tuple, Set
+from io import BytesIO
+from typing import Tuple, Set, BinaryIO, Dict, Optional
 from typing import Union, List
 
-from mongoengine import Document, ReferenceField, ListField, FileField, DateTimeField, BooleanField
-from textgrid import Interval, TextGrid, IntervalTier
+import numpy as np
+from mongoengine import Document, ReferenceField, ListField, FileField, DateTimeField, BinaryField, \
+    ValidationError, StringField, IntField, signals, DENY, EmbeddedDocument, MapField, EmbeddedDocumentField, \
+    DictField
+from textgrid import TextGrid, Interval
+
+from . import blobs
+from .errors import error_log, ErrorsLog, TextGridAnnotationError
+from .tg_checking import TextGridCheckingScheme, SuffixedCheckPlan, TierScheme
+from ..parsers import parsers_registry
+from ..tg_compact import CompactTextGrid, CompactTier, renamed_tier, readonly_view
+from ..tg_parsing import parse_compact_textgrid, decode_textgrid, read_tier_names, iter_compact_tiers
+from ..utils import tg_to_str, SizedLRUCache, line_delta, apply_line_delta, sequence_edits
+
+# Per-worker cache of parsed textgrids, keyed by their payload's digest (see
+# `BaseTextGridDocument.payload_digest`), so that all the documents holding
+# the same file (an upload, its log, the textgrid it was merged into, and
+# that textgrid's upload) share it. Cached textgrids are shared between
+# documents and thus have to be left untouched. It also holds the texts of the
+# logged uploads, keyed by ("text", upload id) (see `LoggedTextGrid.to_str`).
+textgrid_cache = SizedLRUCache(max_size=256 * 1024 ** 2)
+
+
+class TierCheck(EmbeddedDocument):
+    """Annotation errors found in a tier, along with the tier's content hash
+    (see `CompactTier.content_hash`) and its scheme's verdicts fingerprint
+    (see `TierScheme.verdicts_fingerprint`), so they can be reused for an
+    identical tier, checked the same way, instead of checking it again"""
+    content_hash = StringField(required=True)
+    verdicts_fingerprint = StringField()
+    # reported errors, as in the errors summaries
+    errors = ListField(DictField())
+    # number of errors found, including the unreported ones
+    errors_count = IntField(default=0)
 
-from .errors import error_log
-from .tg_checking import TextGridCheckingScheme
-from ..utils import open_str_textgrid, tg_to_str, consecutive_couples
+    @classmethod
+    def from_log(cls, tier_scheme: TierScheme, tier: CompactTier,
+                 check_log: ErrorsLog) -> Optional['TierCheck']:
+        """Tier check holding the errors logged by the tier's (isolated) check.
+        Checks whose results might not be the same the next time (truncated,
+        with a structural error such as a parser's failure, or by a parser
+        whose verdicts aren't reusable) aren't kept."""
+        verdicts_fingerprint = tier_scheme.verdicts_fingerprint
+        if check_log.structural or check_log.truncated or verdicts_fingerprint is None:
+            return None
+        return cls(content_hash=tier.content_hash,
+                   verdicts_fingerprint=verdicts_fingerprint,
+                   errors=[error.to_msg() for error in check_log.annot.get(tier.name, [])],
+                   errors_count=check_log.annot_counts.get(tier.name, 0))
+
+    def matches(self, tier_scheme: TierScheme, tier: CompactTier) -> bool:
+        """That check can be reused for that tier"""
+        return (self.content_hash == tier.content_hash
+                and self.verdicts_fingerprint is not None
+                and self.verdicts_fingerprint == tier_scheme.verdicts_fingerprint)
+
+    def to_log(self, tier_name: str) -> ErrorsLog:
+        """Errors log holding that check's errors, to be merged into the current log"""
+        check_log = ErrorsLog()
+        if self.errors_count:
+            check_log.annot[tier_name] = [
+                TextGridAnnotationError(tier_name, error["index"],
+                                        Interval(error["start"], error["end"], error["annotation"]),
+                                        error["msg"])
+                for error in self.errors]
+            check_log.annot_counts[tier_name] = self.errors_count
+        return check_log
+
+
+@dataclass
+class UploadChecks:
+    """Checks of the tiers of a textgrid uploaded at some step of its task (see
+    `BaseTask.check_upload`). The checks of the annotator's previous upload at
+    that step, against the same version of the checking scheme, are reused for
+    the tiers that didn't change."""
+    step: str
+    scheme_version: Optional[int]
+    previous: Dict[str, TierCheck]
+    # checks of the upload's tiers, reused or not
+    tiers: Dict[str, TierCheck] = field(default_factory=dict)
 
 
 class BaseTextGridDocument(Document):
-    textgrid_file = FileField(required=True)
+    # If a blob store is set up, payloads are all stored in it. Else, payloads
+    # up to that size (in bytes) are stored zlib-compressed in the document
+    # itself, and bigger ones are stored in GridFS.
+    INLINE_MAX_SIZE = 64 * 1024
+
+    textgrid_file = FileField()
+    textgrid_inline = BinaryField()
+    # SHA-256 digest of the payload, if it's stored in the blob store
+    textgrid_hash = StringField()
     task = ReferenceField('BaseTask')
     checking_scheme: TextGridCheckingScheme = ReferenceField(TextGridCheckingScheme)
     creators: List['User'] = ListField(ReferenceField('User'))
@@ -25,44 +109,170 @@ class BaseTextGridDocument(Document):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._textgrid_obj: TextGrid = None
+        self._textgrid_obj: CompactTextGrid = None
+        # payload set on this instance, so it doesn't have to be read back from its storage
+        self._payload_bytes: Optional[bytes] = None
+        self._payload_digest: Optional[str] = None
+        # blob referenced by the saved document (new blobs are only written,
+        # and referenced, once the document is saved)
+        self._stored_hash: Optional[str] = self.textgrid_hash if self.id is not None else None
+        # set for uploaded textgrids, whose tiers' checks are recorded (and reused)
+        self.upload_checks: Optional[UploadChecks] = None
 
     @classmethod
-    def from_textgrid(cls, tg: Union[TextGrid, str],
+    def from_textgrid(cls, tg: Union[TextGrid, CompactTextGrid, str],
                       creators: List['Annotator'],
                       task: 'BaseTask'):
         if task is not None:
             checking_scheme = task.campaign.checking_scheme
         else:
             checking_scheme = None
-        if isinstance(tg, TextGrid):
-            tg_file = tg_to_str(tg).encode(encoding='utf-8')
-        elif isinstance(tg, str):
-            tg_file = tg.encode('utf-8')
-        else:
+        if not isinstance(tg, (TextGrid, CompactTextGrid, str, bytes)):
             raise TypeError("Unsupported textgrid object type %s")
-        return cls(textgrid_file=tg_file, task=task, creators=creators,
-                   checking_scheme=checking_scheme)
+        new_doc = cls(task=task, creators=creators,
+                      checking_scheme=checking_scheme)
+        if isinstance(tg, bytes):
+            new_doc.payload = tg
+        else:
+            # textgrid objects are kept, and won't have to be parsed again
+            new_doc.textgrid = tg
+        return new_doc
+
+    @property
+    def has_payload(self) -> bool:
+        return (self.textgrid_hash is not None
+                or self.textgrid_inline is not None
+                or bool(self.textgrid_file))
+
+    def validate(self, clean=True):
+        if not self.has_payload:
+            raise ValidationError("The textgrid document doesn't have any textgrid payload")
+        super().validate(clean)
+
+    @staticmethod
+    def get_blob_store() -> blobs.BlobStore:
+        if blobs.blob_store is None:
+            raise ValueError("This textgrid is stored in a blob store, but none has been set up")
+        return blobs.blob_store
 
     @property
-    def textgrid(self):
+    def payload(self) -> Union[bytes, memoryview]:
+        """The textgrid file's raw content, whatever the way it's stored"""
+        if self._payload_bytes is not None:
+            return self._payload_bytes
+        if self.textgrid_hash is not None:
+            return self.get_blob_store().read(self.textgrid_hash)
+        if self.textgrid_inline is not None:
+            return zlib.decompress(self.textgrid_inline)
+        grid_file = self.textgrid_file.get()
+        grid_file.seek(0)
+        return grid_file.read()
+
+    @payload.setter
+    def payload(self, payload: bytes):
+        if self.textgrid_file:
+            self.textgrid_file.delete()
+        self.textgrid_inline = None
+        self.textgrid_hash = None
+        if blobs.blob_store is not None:
+            # the blob itself is only written when the document is saved
+            self.textgrid_hash = blobs.blob_store.digest(payload)
+        elif len(payload) <= self.INLINE_MAX_SIZE:
+            self.textgrid_inline = zlib.compress(payload)
+        else:
+            self.textgrid_file.put(payload)
+        self._textgrid_obj = None
+        self._payload_bytes = bytes(payload)
+        self._payload_digest = self.textgrid_hash
+
+    @property
+    def payload_size(self) -> int:
+        """Size of the textgrid file, in bytes"""
+        if self._payload_bytes is not None:
+            return len(self._payload_bytes)
+        if self.textgrid_hash is not None:
+            return self.get_blob_store().size(self.textgrid_hash)
+        if self.textgrid_file:
+            return self.textgrid_file.get().length
+        return len(self.payload)
+
+    @property
+    def payload_digest(self) -> str:
+        """SHA-256 digest of the textgrid file (computed once per instance)"""
+        if self.textgrid_hash is not None:
+            return self.textgrid_hash
+        if self._payload_digest is None:
+            self._payload_digest = hashlib.sha256(self.payload).hexdigest()
+        return self._payload_digest
+
+    def open_payload(self) -> BinaryIO:
+        """File-like object over the textgrid file, for the download handlers.
+        Payloads set on this instance are read from memory."""
+        if self._payload_bytes is not None:
+            return BytesIO(self._payload_bytes)
+        if self.textgrid_hash is not None:
+            return self.get_blob_store().open(self.textgrid_hash)
+        if self.textgrid_inline is not None:
+            return BytesIO(self.payload)
+        grid_file = self.textgrid_file.get()
+        # the GridOut object is cached by the proxy, and might have been read already
+        grid_file.seek(0)
+        return grid_file
+
+    @property
+    def textgrid(self) -> CompactTextGrid:
         if self._textgrid_obj is None:
-            # TODO : make sure to catch a potential textgrid parsing error somewhere
-            self._textgrid_obj = open_str_textgrid(self.textgrid_file.read().decode("utf-8").strip())
+            self._textgrid_obj = textgrid_cache.get(self.payload_digest)
+            if self._textgrid_obj is None:
+                # TODO : make sure to catch a potential textgrid parsing error somewhere
+                self._textgrid_obj = parse_compact_textgrid(self.payload)
+                textgrid_cache.put(self.payload_digest, self._textgrid_obj, self._textgrid_obj.nbytes)
         return self._textgrid_obj
 
     @textgrid.setter
-    def textgrid(self, tg: Union[TextGrid, str]):
+    def textgrid(self, tg: Union[TextGrid, CompactTextGrid, str]):
         if isinstance(tg, str):
-            self.textgrid_file.put(tg.encode("utf-8"))
-        elif isinstance(tg, TextGrid):
+            self.payload = tg.encode("utf-8")
+        elif isinstance(tg, (TextGrid, CompactTextGrid)):
+            if isinstance(tg, TextGrid):
+                tg = CompactTextGrid.from_textgrid(tg)
+            self.payload = tg_to_str(tg).encode("utf-8")
             self._textgrid_obj = tg
-            self.textgrid_file.put(tg_to_str(tg).encode("utf-8"))
+            # that file, once uploaded again, won't have to be parsed
+            textgrid_cache.put(self.payload_digest, tg, tg.nbytes)
         else:
-            raise ValueError("Expecting textgrid in string format or as a TextGrid object")
+            raise ValueError("Expecting textgrid in string format or as a (Compact)TextGrid object")
 
     def to_str(self):
-        return self.textgrid_file.read().decode("utf-8")
+        return decode_textgrid(self.payload)
+
+    @classmethod
+    def pre_save_store_blob(cls, sender, document: 'BaseTextGridDocument', **kwargs):
+        """Writes the document's new payload to the blob store, right before
+        the document referencing it is saved"""
+        if document.textgrid_hash is None or document.textgrid_hash == document._stored_hash:
+            return
+        blob_store = document.get_blob_store()
+        if not blob_store.exists(document.textgrid_hash):
+            if document._payload_bytes is None:
+                raise ValueError("The textgrid's blob %s is missing" % document.textgrid_hash)
+            blob_store.write(document.textgrid_hash, document._payload_bytes)
+
+    @classmethod
+    def post_save_acquire_blob(cls, sender, document: 'BaseTextGridDocument', **kwargs):
+        """Moves the document's blob reference to its new payload once it's saved"""
+        if document.textgrid_hash == document._stored_hash:
+            return
+        if document.textgrid_hash is not None:
+            document.get_blob_store().acquire(document.textgrid_hash)
+        if document._stored_hash is not None:
+            document.get_blob_store().release(document._stored_hash)
+        document._stored_hash = document.textgrid_hash
+
+    @classmethod
+    def post_delete_release_blob(cls, sender, document: 'BaseTextGridDocument', **kwargs):
+        if document._stored_hash is not None:
+            document.get_blob_store().release(document._stored_hash)
 
     def check(self):
         raise NotImplemented()
@@ -77,45 +287,263 @@ class BaseTextGridDocument(Document):
 
 
 class LoggedTextGrid(BaseTextGridDocument):
-    meta = {"collection": "logged_textgrid"}
+    """Textgrid uploaded by an annotator. Since annotators usually upload
+    many near-identical versions while fixing their errors, uploads are
+    stored as line deltas against the previous upload of the same task and
+    annotator. A full version (a "keyframe") is stored every
+    `KEYFRAME_INTERVAL` uploads, which bounds the cost of rebuilding one.
+    The uploads' texts are kept in the textgrids cache (see `to_str`), so that
+    each upload's delta doesn't rebuild its predecessor's whole chain."""
+    KEYFRAME_INTERVAL = 16
+
+    # previous upload, that the delta applies to
+    delta_base: 'LoggedTextGrid' = ReferenceField('LoggedTextGrid')
+    # zlib-compressed JSON of the line delta (see `utils.line_delta`)
+    delta = BinaryField()
+    # number of deltas between this upload and its keyframe
+    delta_depth = IntField(default=0)
+    # task step and checking scheme version that the upload was checked at,
+    # and the checks of its tiers (see `UploadChecks`)
+    checked_step = StringField()
+    scheme_version = IntField()
+    tiers_checks: Dict[str, TierCheck] = MapField(EmbeddedDocumentField(TierCheck))
+    meta = {"collection": "logged_textgrid",
+            "indexes": [("task", "creators", "-creation_time")]}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # text of the upload, if the document was built from it
+        self._text: Optional[str] = None
+
+    @classmethod
+    def keyframe(cls, textgrid: str, annotator: 'Annotator', task: 'BaseTask',
+                 checked_tg: Optional[BaseTextGridDocument] = None) -> 'LoggedTextGrid':
+        """Full version of the upload. If the uploaded textgrid's checked document
+        is given, its stored payload is shared instead of being stored again
+        (unless it's in GridFS, whose files can't be shared)."""
+        if checked_tg is None or (checked_tg.textgrid_inline is None and checked_tg.textgrid_hash is None):
+            return cls.from_textgrid(textgrid, [annotator], task)
+        logged_tg = cls(task=task, creators=[annotator],
+                        checking_scheme=task.campaign.checking_scheme,
+                        textgrid_inline=checked_tg.textgrid_inline,
+                        textgrid_hash=checked_tg.textgrid_hash)
+        # the checked document might not be saved, hence its blob not be written yet
+        logged_tg._payload_bytes = checked_tg._payload_bytes
+        return logged_tg
+
+    @classmethod
+    def from_upload(cls, textgrid: str, annotator: 'Annotator', task: 'BaseTask',
+                    checked_tg: Optional[BaseTextGridDocument] = None) -> 'LoggedTextGrid':
+        logged_tg = cls._from_upload(textgrid, annotator, task, checked_tg)
+        # cached once it's saved, for the next upload (see `post_save_cache_text`)
+        logged_tg._text = textgrid
+        return logged_tg
+
+    @classmethod
+    def _from_upload(cls, textgrid: str, annotator: 'Annotator', task: 'BaseTask',
+                     checked_tg: Optional[BaseTextGridDocument] = None) -> 'LoggedTextGrid':
+        previous: LoggedTextGrid = (cls.objects(task=task, creators=annotator)
+                                    .order_by("-creation_time").first())
+        if previous is None or previous.delta_depth + 1 >= cls.KEYFRAME_INTERVAL:
+            return cls.keyframe(textgrid, annotator, task, checked_tg)
+
+        delta = zlib.compress(json.dumps(line_delta(previous.to_str(), textgrid)).encode("utf-8"))
+        if checked_tg is not None and checked_tg.textgrid_inline is not None:
+            keyframe_size = len(checked_tg.textgrid_inline)
+        else:
+            keyframe_size = len(zlib.compress(textgrid.encode("utf-8")))
+        # a new keyframe is stored if the textgrid changed too much
+        if len(delta) >= keyframe_size:
+            return cls.keyframe(textgrid, annotator, task, checked_tg)
+        return cls(task=task, creators=[annotator],
+                   checking_scheme=task.campaign.checking_scheme,
+                   delta_base=previous,
+                   delta=delta,
+                   delta_depth=previous.delta_depth + 1)
+
+    @classmethod
+    def previous_checks(cls, task: 'BaseTask', annotator: 'Annotator', step: str) -> Dict[str, TierCheck]:
+        """Tiers checks of the annotator's last upload for that task and step,
+        checked against the current version of the task's checking scheme"""
+        checking_scheme = task.campaign.checking_scheme
+        if checking_scheme is None:
+            return {}
+        previous: LoggedTextGrid = (cls.objects(task=task, creators=annotator,
+                                                checking_scheme=checking_scheme,
+                                                checked_step=step,
+                                                scheme_version=checking_scheme.version)
+                                    .order_by("-creation_time").only("tiers_checks").first())
+        return dict(previous.tiers_checks) if previous is not None else {}
+
+    def record_checks(self, upload_checks: UploadChecks):
+        self.checked_step = upload_checks.step
+        self.scheme_version = upload_checks.scheme_version
+        self.tiers_checks = upload_checks.tiers
+
+    @property
+    def has_payload(self) -> bool:
+        return self.delta is not None or super().has_payload
+
+    @BaseTextGridDocument.payload.getter
+    def payload(self) -> Union[bytes, memoryview]:
+        if self.delta is None:
+            return BaseTextGridDocument.payload.fget(self)
+        return self.to_str().encode("utf-8")
+
+    def to_str(self) -> str:
+        """The upload's text. Rebuilt texts (of saved uploads) are cached."""
+        if self._text is not None:
+            return self._text
+        cache_key = ("text", self.id)
+        if self.id is not None:
+            text = textgrid_cache.get(cache_key)
+            if text is not None:
+                return text
+        if self.delta is None:
+            text = super().to_str()
+        else:
+            delta = json.loads(zlib.decompress(self.delta))
+            text = apply_line_delta(self.delta_base.to_str(), delta)
+        if self.id is not None:
+            textgrid_cache.put(cache_key, text, len(text))
+        return text
+
+    @classmethod
+    def post_save_cache_text(cls, sender, document: 'LoggedTextGrid', **kwargs):
+        if document._text is not None:
+            textgrid_cache.put(("text", document.id), document._text, len(document._text))
+
+    @payload.setter
+    def payload(self, payload: bytes):
+        self.delta = None
+        self.delta_base = None
+        self.delta_depth = 0
+        BaseTextGridDocument.payload.fset(self, payload)
+        self._text = None
+        if self.id is not None:
+            text = decode_textgrid(payload)
+            textgrid_cache.put(("text", self.id), text, len(text))
+
+    def open_payload(self) -> BinaryIO:
+        if self.delta is None:
+            return super().open_payload()
+        return BytesIO(self.payload)
 
 
 class SingleAnnotatorTextGrid(BaseTextGridDocument):
+    # textgrid files bigger than that (in bytes) are checked tier by tier, straight
+    # from their payload, instead of being parsed as a whole (see `check_streaming`)
+    STREAMING_CHECK_MIN_SIZE = 8 * 1024 ** 2
 
-    def check_duplicate_tiers(self):
+    def check_duplicate_tiers(self, tier_names: List[str] = None):
         # checking for any tier duplicate
-        names_counter = Counter(self.textgrid.getNames())
+        if tier_names is None:
+            tier_names = self.textgrid.getNames()
+        names_counter = Counter(tier_names)
         for tier_name, count in names_counter.items():
             if count > 1:
                 error_log.log_structural("Duplicate tier name:  %s" % tier_name)
 
-    def check_scheme_tiers(self):
-        tg_tier_names = set(self.textgrid.getNames())
+    def check_scheme_tiers(self, tier_names: List[str] = None):
+        if tier_names is None:
+            tier_names = self.textgrid.getNames()
+        tg_tier_names = set(tier_names)
+
+        check_plan = self.checking_scheme.check_plan
 
         # checking that required tiers are all here
-        required_tiers = set(self.checking_scheme.required_tiers_names)
-        missing_tiers = required_tiers - set(self.textgrid.getNames())
+        missing_tiers = check_plan.required_tiers - tg_tier_names
         if missing_tiers:
             error_log.log_structural("The tiers %s are missing in the TextGrid file" % ", ".join(missing_tiers))
 
         # removing all tiers that are referenced in the scheme
-        tg_tier_names -= set(self.checking_scheme.all_tiers_names)
+        tg_tier_names -= check_plan.all_tiers
 
         # remaining tiers are invalid
         if tg_tier_names:
             error_log.log_structural("The tiers %s are unexpected (and thus invalid)" % ", ".join(tg_tier_names))
 
+    def check_tiers(self, tiers: List[Tuple[TierScheme, CompactTier]]):
+        """Checks each tier against its tier scheme. For uploaded textgrids,
+        the tiers' checks are recorded, and the tiers that are identical to
+        the ones of the previous upload aren't checked again: their recorded
+        errors are logged instead."""
+        if self.upload_checks is None:
+            self.checking_scheme.run_tier_checks(
+                [(tier_scheme.check_tier, (tier,)) for tier_scheme, tier in tiers],
+                annotations_count=sum(len(tier) for _, tier in tiers))
+            return
+
+        previous = self.upload_checks.previous
+        reused = {}
+        for tier_scheme, tier in tiers:
+            tier_check = previous.get(tier.name)
+            if tier_check is not None and tier_check.matches(tier_scheme, tier):
+                reused[tier.name] = tier_check
+        changed_tiers = [(tier_scheme, tier) for tier_scheme, tier in tiers if tier.name not in reused]
+        checks_logs = self.checking_scheme.run_tier_checks(
+            [(tier_scheme.check_tier, (tier,)) for tier_scheme, tier in changed_tiers],
+            annotations_count=sum(len(tier) for _, tier in changed_tiers),
+            isolated=True)
+        checks_logs = {tier.name: check_log for (_, tier), check_log in zip(changed_tiers, checks_logs)}
+
+        # logging the errors in the tiers' order, as if they had all been checked
+        for tier_scheme, tier in tiers:
+            if tier.name in reused:
+                tier_check = reused[tier.name]
+                check_log = tier_check.to_log(tier.name)
+            else:
+                check_log = checks_logs[tier.name]
+                tier_check = TierCheck.from_log(tier_scheme, tier, check_log)
+            if tier_check is not None:
+                self.upload_checks.tiers[tier.name] = tier_check
+            error_log.merge(check_log)
+
     def check_annotations(self):
-        valid_tiers = set(self.checking_scheme.all_tiers_names) & set(self.textgrid.getNames())
-        for tier_name in valid_tiers:
-            tier_scheme = self.checking_scheme.get_tier_scheme(tier_name)
-            tier_scheme.check_tier(self.textgrid.getFirst(tier_name))
+        check_plan = self.checking_scheme.check_plan
+        tg_tier_names = set(self.textgrid.getNames())
+        valid_tiers = [self.textgrid.getFirst(tier_name)
+                       for tier_name in check_plan.tiers_names
+                       if tier_name in tg_tier_names]
+        self.check_tiers([(check_plan.tier_schemes[tier.name], tier) for tier in valid_tiers])
+
+    def check_streaming(self):
+        """Same as `check`, but reads the textgrid one tier at a time from its
+        payload (from memory if it was just uploaded, else from its storage),
+        so the parsed textgrid is never held in memory as a whole. Tier
+        names are checked before any annotation is read."""
+        with error_log.checking(), parsers_registry.pinned():
+            with self.open_payload() as tg_file:
+                tier_names = read_tier_names(tg_file)
+            self.check_duplicate_tiers(tier_names)
+            if not self.checking_scheme:
+                return
+            self.check_scheme_tiers(tier_names)
+
+            check_plan = self.checking_scheme.check_plan
+            valid_tiers = check_plan.all_tiers & set(tier_names)
+            with parsers_registry.file_deadline(), self.open_payload() as tg_file:
+                for tier in iter_compact_tiers(tg_file, valid_tiers):
+                    # as in `check_annotations`, only the first of duplicate tiers is checked
+                    if tier.name not in valid_tiers:
+                        continue
+                    valid_tiers -= {tier.name}
+                    self.check_tiers([(check_plan.tier_schemes[tier.name], tier)])
+
+    @property
+    def is_streamed(self) -> bool:
+        """The textgrid isn't parsed yet, and is big enough to be checked while
+        streaming it (see `check_streaming`)"""
+        return self._textgrid_obj is None and self.payload_size > self.STREAMING_CHECK_MIN_SIZE
 
     def check(self):
-        self.check_duplicate_tiers()
-        if self.checking_scheme:
-            self.check_scheme_tiers()
-            self.check_annotations()
+        if self.is_streamed:
+            return self.check_streaming()
+        with error_log.checking(), parsers_registry.pinned():
+            self.check_duplicate_tiers()
+            if self.checking_scheme:
+                self.check_scheme_tiers()
+                self.check_annotations()
 
 
 class DoubleAnnotatorTextGrid(SingleAnnotatorTextGrid):
@@ -123,21 +551,59 @@ class DoubleAnnotatorTextGrid(SingleAnnotatorTextGrid):
     target = ReferenceField('Annotator')
 
 
-class Frontier:
-    def __init__(self, int_left: Interval, int_right: Interval):
-        assert int_left is not None and int_right is not None
-        # TODO : maybe check that left == right
-        self.left = int_left
-        self.right = int_right
-
-    @property
-    def time(self):
-        return self.left.maxTime
-
-    @time.setter
-    def time(self, mean: float):
-        self.left.maxTime = mean
-        self.right.minTime = mean
+# maximum number of mismatches reported for a pair of ref/target tiers
+MAX_REPORTED_MISMATCHES = 100
+
+
+def check_tiers_pair_matching(ref_tier: CompactTier, target_tier: CompactTier):
+    """Checks that a pair of target/ref tiers have the same number of annotations,
+    and that those annotations are the same. The tiers' labels are aligned, so
+    that every annotation missing, added or changed in the target is reported."""
+    if not len(ref_tier) == len(target_tier):
+        error_log.log_structural("The tiers %s and %s don't have the same number of annotations"
+                                 % (ref_tier.name, target_tier.name))
+
+    # both tiers' label ids, in a common labels table
+    labels_table: Dict[str, int] = {}
+    ref_ids = np.array([labels_table.setdefault(label, len(labels_table)) for label in ref_tier.labels],
+                       dtype=np.int32)[ref_tier.label_ids]
+    target_ids = np.array([labels_table.setdefault(label, len(labels_table)) for label in target_tier.labels],
+                          dtype=np.int32)[target_tier.label_ids]
+
+    # trimming the common head and tail before aligning the rest
+    common_len = min(len(ref_ids), len(target_ids))
+    differences = np.flatnonzero(ref_ids[:common_len] != target_ids[:common_len])
+    if not len(differences) and len(ref_ids) == len(target_ids):
+        return
+    head = int(differences[0]) if len(differences) else common_len
+    tail_differences = np.flatnonzero(ref_ids[::-1][:common_len - head] != target_ids[::-1][:common_len - head])
+    tail = int(tail_differences[0]) if len(tail_differences) else common_len - head
+
+    # a substitution counts as two edits
+    edits = sequence_edits(ref_ids[head:len(ref_ids) - tail].tolist(),
+                           target_ids[head:len(target_ids) - tail].tolist(),
+                           max_edits=2 * MAX_REPORTED_MISMATCHES)
+    if edits is None:
+        error_log.log_structural("The tiers %s and %s are too different to list their mismatches "
+                                 "(more than %i)" % (ref_tier.name, target_tier.name, MAX_REPORTED_MISMATCHES))
+        if head < common_len:
+            error_log.log_mismatch(ref_tier.name, target_tier.name, head, ref_tier[head], target_tier[head])
+        return
+
+    for edit, ref_idx, target_idx in edits[:MAX_REPORTED_MISMATCHES]:
+        ref_idx, target_idx = ref_idx + head, target_idx + head
+        if edit == "replace":
+            error_log.log_mismatch(ref_tier.name, target_tier.name, ref_idx,
+                                   ref_tier[ref_idx], target_tier[target_idx], target_idx)
+        elif edit == "delete":
+            error_log.log_mismatch(ref_tier.name, target_tier.name, ref_idx,
+                                   ref_tier[ref_idx], None, target_idx, kind="deletion")
+        else:
+            error_log.log_mismatch(ref_tier.name, target_tier.name, ref_idx,
+                                   None, target_tier[target_idx], target_idx, kind="insertion")
+    if len(edits) > MAX_REPORTED_MISMATCHES:
+        error_log.log_structural("The tiers %s and %s have %i more mismatches"
+                                 % (ref_tier.name, target_tier.name, len(edits) - MAX_REPORTED_MISMATCHES))
 
 
 class MergedAnnotsTextGrid(DoubleAnnotatorTextGrid):
@@ -146,6 +612,11 @@ class MergedAnnotsTextGrid(DoubleAnnotatorTextGrid):
 
     DIFF_THRESHOLD = 0.1  # in seconds
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # parsed textgrid, and the result of the merge of its times (see `merge_times`)
+        self._times_merging: Optional[Tuple[CompactTextGrid, Tuple[CompactTextGrid, 'MergeResults']]] = None
+
     @classmethod
     def from_ref_and_target(cls, ref_tg: BaseTextGridDocument,
                             target_tg: BaseTextGridDocument):
@@ -168,26 +639,22 @@ class MergedAnnotsTextGrid(DoubleAnnotatorTextGrid):
 
         #  TODO : add support for empty tiers deletion
         assert ref_tg.task == target_tg.task
-        merged_tg = TextGrid(name=ref_tg.textgrid.name,
-                             minTime=ref_tg.textgrid.minTime,
-                             maxTime=ref_tg.textgrid.maxTime)
+        merged_tg = CompactTextGrid(name=ref_tg.textgrid.name,
+                                    minTime=ref_tg.textgrid.minTime,
+                                    maxTime=ref_tg.textgrid.maxTime)
         for tier_name in ref_tg.textgrid.getNames():
-            ref_tier: IntervalTier = deepcopy(ref_tg.textgrid.getFirst(tier_name))
-            target_tier: IntervalTier = deepcopy(target_tg.textgrid.getFirst(tier_name))
-            ref_tier.name = tier_name + "-ref"
-            target_tier.name = tier_name + "-target"
-            merged_tg.append(ref_tier)
-            merged_tg.append(target_tier)
+            merged_tg.append(renamed_tier(ref_tg.textgrid.getFirst(tier_name), tier_name + "-ref"))
+            merged_tg.append(renamed_tier(target_tg.textgrid.getFirst(tier_name), tier_name + "-target"))
         new_doc = cls.from_textgrid(merged_tg, ref_tg.creators + target_tg.creators, ref_tg.task)
         return new_doc
 
+    @property
+    def suffixed_check_plan(self) -> SuffixedCheckPlan:
+        return self.checking_scheme.check_plan.suffixed(self.TOP_GROUP_SUFFIX, self.BOTTOM_GROUP_SUFFIX)
+
     @property
     def suffixed_tier_names(self) -> Set[str]:
-        names = set()
-        for suffix in (self.TOP_GROUP_SUFFIX, self.BOTTOM_GROUP_SUFFIX):
-            for name in set(self.checking_scheme.all_tiers_names):
-                names.add(name + suffix)
-        return names
+        return set(self.suffixed_check_plan.all_tiers)
 
     def check_tiers_matching(self):
         """Checks that all tiers match either suffixes, and that tier radicals are found
@@ -196,21 +663,19 @@ class MergedAnnotsTextGrid(DoubleAnnotatorTextGrid):
 
     def check_scheme_tiers(self):
         """Checks that the tier radicals against the """
+        suffixed_plan = self.suffixed_check_plan
         tier_names_set: Set[str] = set(self.textgrid.getNames())
 
         # checking that required tiers are all there for both suffixes
         for suffix in (self.TOP_GROUP_SUFFIX, self.BOTTOM_GROUP_SUFFIX):
-            req_tiers_suffixed = set(name + suffix for name in set(self.checking_scheme.required_tiers_names))
-            missing_tiers = req_tiers_suffixed - set(self.textgrid.getNames())
+            missing_tiers = suffixed_plan.required_tiers[suffix] - tier_names_set
             if missing_tiers:
                 error_log.log_structural("The tiers %s are missing" % " ,".join(missing_tiers))
-            tier_names_set -= req_tiers_suffixed
 
         # making a list of all valid tier names, and using them to weed out any extra invalid tier name
-        all_tiers_suffixed = set()
-        for suffix in (self.TOP_GROUP_SUFFIX, self.BOTTOM_GROUP_SUFFIX):
-            all_tiers_suffixed |= set(name + suffix for name in set(self.checking_scheme.required_tiers_names))
-        tier_names = set(self.textgrid.getNames()) - all_tiers_suffixed
+        all_tiers_suffixed = (suffixed_plan.required_tiers[self.TOP_GROUP_SUFFIX]
+                              | suffixed_plan.required_tiers[self.BOTTOM_GROUP_SUFFIX])
+        tier_names = tier_names_set - all_tiers_suffixed
         # remaining tiers are invalid
         if tier_names:
             error_log.log_structural("The tiers %s are unexpected (and thus invalid)" % ", ".join(tier_names))
@@ -218,9 +683,7 @@ class MergedAnnotsTextGrid(DoubleAnnotatorTextGrid):
 
         # from here, we can assume all tier names are of the form tier-(ref|target)
         # checking that both top and bottom have the same tiers
-        no_suffix = set(re.sub("(%s|%s)" % (self.TOP_GROUP_SUFFIX, self.BOTTOM_GROUP_SUFFIX), "", name)
-                        for name in self.textgrid.getNames())
-        tier_names_set = set(self.textgrid.getNames())
+        no_suffix = set(suffixed_plan.suffixes_re.sub("", name) for name in tier_names_set)
         for no_suffix_name in no_suffix:
             suffixed_top = no_suffix_name + self.TOP_GROUP_SUFFIX
             suffixed_bottom = no_suffix_name + self.BOTTOM_GROUP_SUFFIX
@@ -229,18 +692,18 @@ class MergedAnnotsTextGrid(DoubleAnnotatorTextGrid):
             elif suffixed_bottom not in tier_names_set:
                 error_log.log_structural("The %s tier is missing" % suffixed_bottom)
 
-    def check_times_merging(self):
-        """Checks that paired tiers can be merged together. Outputs the partially merged textgrid as
-        well as the merge conflicts."""
+    def merge_times(self) -> Tuple[CompactTextGrid, 'MergeResults']:
+        """Merges the paired tiers' frontiers. Outputs the partially merged textgrid as
+        well as the merge conflicts. The merge is only done once for a parsed textgrid."""
+        if self._times_merging is not None and self._times_merging[0] is self.textgrid:
+            return self._times_merging[1]
         from .tasks.double import MergeResults
-        merged_times_tg = TextGrid(
+        merged_times_tg = CompactTextGrid(
             name=self.textgrid.name,
             maxTime=self.textgrid.maxTime,
             minTime=self.textgrid.minTime)
         merge_results = MergeResults()
-        for tier in self.checking_scheme.all_tiers_names:
-            merged_tier_name = tier + self.TOP_GROUP_SUFFIX
-            target_tier_name = tier + self.BOTTOM_GROUP_SUFFIX
+        for tier, merged_tier_name, target_tier_name in self.suffixed_check_plan.tiers_triplets:
             merged_tier = self.textgrid.getFirst(merged_tier_name)
             target_tier = self.textgrid.getFirst(target_tier_name)
             # in case either tier is not present, we just skip this merge
@@ -251,7 +714,12 @@ class MergedAnnotsTextGrid(DoubleAnnotatorTextGrid):
             merge_results.tiers_merges.append(tier_merge)
             times_merged_tier.name = tier
             merged_times_tg.append(times_merged_tier)
+        self._times_merging = (self.textgrid, (merged_times_tg, merge_results))
+        return merged_times_tg, merge_results
 
+    def check_times_merging(self) -> Tuple[CompactTextGrid, 'MergeResults']:
+        """Checks that paired tiers can be merged together (see `merge_times`)"""
+        merged_times_tg, merge_results = self.merge_times()
         # logging conflicts as errors that could be displayed to the
         # annotator (in case of merge attempt)
         for conflict in merge_results.to_merge_conflicts_errors():
@@ -261,90 +729,94 @@ class MergedAnnotsTextGrid(DoubleAnnotatorTextGrid):
     def check_annotations_matching(self):
         """Checks that pairs of target/ref tiers have the same number of annotations,
         and that those annotations are the same"""
-        for tier in self.checking_scheme.all_tiers_names:
-            ref_tier_name = tier + self.TOP_GROUP_SUFFIX
-            target_tier_name = tier + self.BOTTOM_GROUP_SUFFIX
+        tiers_pairs = []
+        for _, ref_tier_name, target_tier_name in self.suffixed_check_plan.tiers_triplets:
             ref_tier = self.textgrid.getFirst(ref_tier_name)
             target_tier = self.textgrid.getFirst(target_tier_name)
             # checking that both tier exist
             if target_tier is None or ref_tier is None:
                 continue
-
-            if not len(ref_tier) == len(target_tier):
-                error_log.log_structural("The tiers %s and %s don't have the same number of annotations"
-                                         % (ref_tier_name, target_tier_name))
-
-            for i, (ref_int, target_int) in enumerate(
-                    zip(ref_tier, target_tier)):
-                if ref_int.mark != target_int.mark:
-                    error_log.log_mismatch(ref_tier_name, target_tier_name, i, ref_int, target_int)
-                    break
+            tiers_pairs.append((ref_tier, target_tier))
+        self.checking_scheme.run_tier_checks(
+            [(check_tiers_pair_matching, tiers_pair) for tiers_pair in tiers_pairs],
+            annotations_count=sum(len(ref_tier) + len(target_tier) for ref_tier, target_tier in tiers_pairs))
 
     @staticmethod
-    def to_frontiers(tier: IntervalTier):
-        return [
-            Frontier(left, right) for right, left in consecutive_couples(tier)
-        ]
+    def frontiers_times(tier: CompactTier, count: int) -> np.ndarray:
+        """Times of the tier's first `count` frontiers (frontier i being the
+        end of interval i, and the start of interval i + 1)"""
+        return tier.ends[:count]
 
     @classmethod
-    def merge_tiers(cls, tier_a: IntervalTier, tier_b: IntervalTier) -> Tuple[IntervalTier, 'TierMerge']:
-        from .tasks.double import TierMerge, FrontierMerge
-        new_tier = deepcopy(tier_a)
-        frontiers_a = cls.to_frontiers(new_tier)
-        frontiers_b = cls.to_frontiers(tier_b)
-        tier_merge = TierMerge(tier_a=tier_a.name, tier_b=tier_b.name)
-
-        for i, (front_a, front_b) in enumerate(zip(frontiers_a, frontiers_b)):
-            front_merge = FrontierMerge(
-                time_a=front_a.time,
-                time_b=front_b.time,
-                interval_index_before=i,
-                interval_index_after=i + 1)
-            if abs(front_a.time - front_b.time) > cls.DIFF_THRESHOLD:
-                front_merge.could_merge = False
-            else:
-                front_merge.could_merge = True
-                front_merge.merged_time = float(mean((front_a.time,
-                                                      front_b.time)))
-            tier_merge.frontiers_merge.append(front_merge)
+    def merge_frontiers(cls, times_a: np.ndarray, times_b: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Compares two tiers' paired frontiers times. Returns whether each
+        frontiers pair can be merged, and their merged (averaged) times."""
+        return np.abs(times_a - times_b) <= cls.DIFF_THRESHOLD, (times_a + times_b) / 2
 
+    @classmethod
+    def merge_tiers(cls, tier_a: CompactTier, tier_b: CompactTier) -> Tuple[CompactTier, 'TierMerge']:
+        """Merges the frontiers of two tiers: the returned tier is tier A, with
+        the frontiers that could be merged moved to their merged time. Only the
+        frontiers that couldn't be merged (the conflicts, left at tier A's
+        time) are listed in the returned `TierMerge`."""
+        from .tasks.double import TierMerge
+        frontiers_count = max(min(len(tier_a), len(tier_b)) - 1, 0)
+        times_a = cls.frontiers_times(tier_a, frontiers_count)
+        times_b = cls.frontiers_times(tier_b, frontiers_count)
+        could_merge, merged_times = cls.merge_frontiers(times_a, times_b)
+
+        merged_idx = np.flatnonzero(could_merge)
+        starts, ends = tier_a.starts.copy(), tier_a.ends.copy()
+        # frontier i is the end of interval i, and the start of interval i + 1
+        ends[merged_idx] = merged_times[merged_idx]
+        starts[merged_idx + 1] = merged_times[merged_idx]
+        new_tier = CompactTier(tier_a.name, tier_a.minTime, tier_a.maxTime, starts, ends,
+                               readonly_view(tier_a.label_ids), tier_a.labels)
+
+        conflicts_idx = np.flatnonzero(~could_merge)
+        tier_merge = TierMerge.from_conflicts(tier_a.name, tier_b.name, frontiers_count, conflicts_idx,
+                                              times_a[conflicts_idx], times_b[conflicts_idx])
         return new_tier, tier_merge
 
     def gen_merged_times(self):
         """Merges times"""
         merged_times_tg, merge_results = self.check_times_merging()
-        new_tg = TextGrid(name=merged_times_tg.name,
-                          maxTime=merged_times_tg.maxTime,
-                          minTime=merged_times_tg.minTime)
+        new_tg = CompactTextGrid(name=merged_times_tg.name,
+                                 maxTime=merged_times_tg.maxTime,
+                                 minTime=merged_times_tg.minTime)
 
-        for tier_name in self.checking_scheme.all_tiers_names:
-            merged_tier: IntervalTier = deepcopy(merged_times_tg.getFirst(tier_name))
-            target_tier: IntervalTier = deepcopy(self.textgrid.getFirst(tier_name + "-target"))
-            merged_tier.name = tier_name + "-merged"
-            new_tg.append(merged_tier)
-            new_tg.append(target_tier)
+        for tier_name in self.checking_scheme.check_plan.tiers_names:
+            target_tier_name = tier_name + "-target"
+            new_tg.append(renamed_tier(merged_times_tg.getFirst(tier_name), tier_name + "-merged"))
+            new_tg.append(renamed_tier(self.textgrid.getFirst(target_tier_name), target_tier_name))
 
         return new_tg, merge_results
 
     def check_annotations(self):
-        #  getting only validated tiers
-        validated_tiers = set(self.checking_scheme.all_tiers_names)
+        check_plan = self.checking_scheme.check_plan
+        suffixes_re = self.suffixed_check_plan.suffixes_re
+        tiers = []
         for tier_name in self.textgrid.getNames():
             # removing suffix from tier, and if that radical isn't defined in the scheme, ignore it
-            no_suffix_name = re.sub("(%s|%s)" % (self.TOP_GROUP_SUFFIX, self.BOTTOM_GROUP_SUFFIX),
-                                    "", tier_name)
-            if no_suffix_name not in validated_tiers:
+            no_suffix_name = suffixes_re.sub("", tier_name)
+            if no_suffix_name not in check_plan.all_tiers:
                 continue
-            tier_scheme = self.checking_scheme.get_tier_scheme(no_suffix_name)
-            tier_scheme.check_tier(self.textgrid.getFirst(tier_name))
+            tiers.append((check_plan.tier_schemes[no_suffix_name], self.textgrid.getFirst(tier_name)))
+        self.check_tiers(tiers)
+
+    @property
+    def is_streamed(self) -> bool:
+        # merged textgrids are always checked as a whole, their paired tiers being compared
+        return False
 
     def check(self):
-        self.check_duplicate_tiers()
-        self.check_tiers_matching()
-        if self.checking_scheme:
-            self.check_scheme_tiers()
-            self.check_annotations()
-        self.check_annotations_matching()
+        with error_log.checking(), parsers_registry.pinned():
+            self.check_duplicate_tiers()
+            self.check_tiers_matching()
+            if self.checking_scheme:
+                self.check_scheme_tiers()
+                self.check_annotations()
+            self.check_annotations_matching()
 
 
 class MergedTimesTextGrid(MergedAnnotsTextGrid):
@@ -352,10 +824,23 @@ class MergedTimesTextGrid(MergedAnnotsTextGrid):
     BOTTOM_GROUP_SUFFIX = "-target"
 
     def check(self):
-        self.check_duplicate_tiers()
-        self.check_tiers_matching()
-        if self.checking_scheme:
-            self.check_scheme_tiers()
-            self.check_annotations()
-        self.check_annotations_matching()
-        self.check_times_merging()
+        with error_log.checking(), parsers_registry.pinned():
+            self.check_duplicate_tiers()
+            self.check_tiers_matching()
+            if self.checking_scheme:
+                self.check_scheme_tiers()
+                self.check_annotations()
+            self.check_annotations_matching()
+            self.check_times_merging()
+
+
+# the signals have to be registered for each of the concrete textgrid classes
+for tg_class in (LoggedTextGrid, SingleAnnotatorTextGrid, DoubleAnnotatorTextGrid,
+                 MergedAnnotsTextGrid, MergedTimesTextGrid):
+    signals.pre_save.connect(BaseTextGridDocument.pre_save_store_blob, sender=tg_class)
+    signals.post_save.connect(BaseTextGridDocument.post_save_acquire_blob, sender=tg_class)
+    signals.post_delete.connect(BaseTextGridDocument.post_delete_release_blob, sender=tg_class)
+
+# later uploads are stored as deltas against their predecessors
+LoggedTextGrid.register_delete_rule(LoggedTextGrid, 'delta_base', DENY)
+signals.post_save.connect(LoggedTextGrid.post_save_cache_text, sender=LoggedTextGrid)
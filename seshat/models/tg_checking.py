@@ -1,16 +1,56 @@
 """Schemas that define how a TextGrid should be checked"""
-from typing import List, Dict, Optional
+import multiprocessing
+import re
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from contextvars import Context, copy_context
+from dataclasses import dataclass, field
+from itertools import repeat
+from threading import Lock
+from types import MappingProxyType
+from typing import List, Dict, Optional, Callable, Tuple, FrozenSet, Mapping, Pattern
 
+import numpy as np
 from mongoengine import Document, StringField, EmbeddedDocumentField, BooleanField, ListField, MapField, \
-    EmbeddedDocument
+    EmbeddedDocument, IntField, signals
 from pyannote.core import Segment
 from pygamma_agreement import Continuum, CombinedCategoricalDissimilarity, PositionalSporadicDissimilarity, \
     CategoricalDissimilarity, AbsoluteCategoricalDissimilarity
 from textgrid import IntervalTier, TextGrid
 
-from .errors import error_log
-from ..parsers import parser_factory
-from ..parsers.base import CategoricalChecker, AnnotationError, AnnotationChecker
+from .errors import error_log, ErrorsLog, ErrorsBudget
+from ..parsers import parser_factory, parsers_registry
+from ..tg_compact import CompactTier
+from ..parsers.base import CategoricalChecker, AnnotationChecker, ParserFailure
+from ..utils import SizedLRUCache
+
+
+# number of workers of each tier checking executor (see `TextGridCheckingScheme.parallel_checking`)
+CHECKING_WORKERS = 4
+_checking_executors: Dict[str, Executor] = {}
+_checking_executors_lock = Lock()
+
+
+def get_checking_executor(kind: str) -> Executor:
+    """Returns the (process-wide) executor of that kind, either "thread" or "process".
+    As for the parsers pool, the processes are spawned: forking a server worker
+    (with its database client's threads) isn't safe."""
+    with _checking_executors_lock:
+        if kind not in _checking_executors:
+            if kind == "thread":
+                executor = ThreadPoolExecutor(max_workers=CHECKING_WORKERS)
+            else:
+                executor = ProcessPoolExecutor(max_workers=CHECKING_WORKERS,
+                                               mp_context=multiprocessing.get_context("spawn"))
+            _checking_executors[kind] = executor
+        return _checking_executors[kind]
+
+
+def run_isolated_check(check_fn: Callable, args: Tuple, budget: ErrorsBudget) -> ErrorsLog:
+    """Runs a check, logging its errors into a new errors log (with that
+    errors budget) that's returned"""
+    with error_log.scope(budget) as check_log, check_log.checking():
+        check_fn(*args)
+    return check_log
 
 
 class TierScheme(EmbeddedDocument):
@@ -24,20 +64,74 @@ class TierScheme(EmbeddedDocument):
 
     parser: AnnotationChecker = None
 
-    def check_tier(self, tier: IntervalTier):
-        for i, annot in enumerate(tier):
-            if not self.allow_empty and annot.mark.strip() == "":
-                error_log.log_annot(tier.name, i, annot, "Empty annotations are not authorized in this tier")
-            if self.parser is None:
+    @staticmethod
+    def from_specs(tier_specs: Dict) -> 'TierScheme':
+        if tier_specs.get("checking_type") == "CATEGORICAL":
+            return CategoricalTier(name=tier_specs["name"],
+                                   required=tier_specs["required"],
+                                   allow_empty=tier_specs["allow_empty"],
+                                   categories=tier_specs["categories"])
+        elif tier_specs.get("checking_type") == "PARSED":
+            return ParsedTier(name=tier_specs["name"],
+                              required=tier_specs["required"],
+                              allow_empty=tier_specs["allow_empty"],
+                              parser_name=tier_specs["parser"]["name"],
+                              parser_module=tier_specs["parser"]["module"])
+        else:
+            return UnCheckedTier(name=tier_specs["name"],
+                                 allow_empty=tier_specs["allow_empty"],
+                                 required=tier_specs["required"])
+
+    def __reduce__(self):
+        # pickled (to be sent to a checking process) as its specs, since
+        # its parser has to be retrieved from the other process' registry
+        return TierScheme.from_specs, (self.to_specs(),)
+
+    def check_empty_labels(self, labels: List[str]) -> Dict[int, str]:
+        """Returns the error message for each empty label's index, if empty
+        annotations aren't authorized"""
+        if self.allow_empty:
+            return {}
+        return {label_id: "Empty annotations are not authorized in this tier"
+                for label_id, label in enumerate(labels) if label.strip() == ""}
+
+    @staticmethod
+    def log_labels_errors(tier: CompactTier, labels_errors: Dict[int, str]):
+        """Logs an error for each of the tier's annotations whose label is invalid"""
+        if not labels_errors:
+            return
+        error_ids = np.fromiter(labels_errors.keys(), dtype=tier.label_ids.dtype)
+        errors_idx = np.flatnonzero(np.isin(tier.label_ids, error_ids))
+        # errors beyond the tier's errors budget are only counted
+        errors_idx = errors_idx[:error_log.reserve_annots(tier.name, len(errors_idx))]
+        for i in errors_idx.tolist():
+            error_log.log_annot(tier.name, i, tier[i], labels_errors[int(tier.label_ids[i])])
+
+    def check_tier(self, tier: CompactTier):
+        if self.parser is None:
+            if len(tier):
                 error_log.log_structural("The parser for tier %s couldn't be found, this tier couldn't be checked. "
                                          "Relay this error to your campaign manager to fix it." % tier.name)
-                return
-            if annot.mark.strip() == "":
-                continue
-            try:
-                self.parser.check_annotation(annot.mark)
-            except AnnotationError as e:
-                error_log.log_annot(tier.name, i, annot, str(e))
+            return
+        # only the tier's distinct labels are checked, in a single batch
+        labels_errors = self.check_empty_labels(tier.labels)
+        checked_ids = [label_id for label_id, label in enumerate(tier.labels) if label.strip() != ""]
+        try:
+            checked_errors = self.parser.check_annotations([tier.labels[label_id] for label_id in checked_ids])
+        except ParserFailure as e:
+            error_log.log_structural("The parser for tier %s failed (%s), this tier couldn't be checked. "
+                                     "Relay this error to your campaign manager to fix it." % (tier.name, e))
+            return
+        for i, error_msg in checked_errors:
+            labels_errors[checked_ids[i]] = error_msg
+        self.log_labels_errors(tier, labels_errors)
+
+    @property
+    def verdicts_fingerprint(self) -> Optional[str]:
+        """Identifies what the tier's verdicts depend on (besides the scheme's
+        version), so recorded checks of that tier are only reused with the
+        same one. None if the tier's checks can't be reused at all."""
+        return self.CHECKING_TYPE
 
     def to_specs(self):
         return {
@@ -61,10 +155,8 @@ class TierScheme(EmbeddedDocument):
 class UnCheckedTier(TierScheme):
     CHECKING_TYPE = "NONE"
 
-    def check_tier(self, tier: IntervalTier):
-        for i, annot in enumerate(tier):
-            if not self.allow_empty and annot.mark.strip() == "":
-                error_log.log_annot(tier.name, i, annot, "Empty annotations are not authorized in this tier")
+    def check_tier(self, tier: CompactTier):
+        self.log_labels_errors(tier, self.check_empty_labels(tier.labels))
 
 
 class CategoricalTier(TierScheme):
@@ -96,17 +188,99 @@ class ParsedTier(TierScheme):
     parser_name = StringField(required=True)
     parser_module = StringField(required=True)
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    @property
+    def parser(self) -> Optional[AnnotationChecker]:
+        """Looked up in the parsers registry on each use, so the schemes (and
+        their cached check plans) use the reloaded parsers right away"""
         try:
-            self.parser = parser_factory(self.parser_module, self.parser_name)
+            return parser_factory(self.parser_module, self.parser_name)
         except ValueError:
-            self.parser = None
+            return None
+
+    @property
+    def verdicts_fingerprint(self) -> Optional[str]:
+        # parsers that opted out of the verdicts' memoization could give
+        # different verdicts for the same tier
+        parser = self.parser
+        if parser is None or not parser.CACHE_VERDICTS:
+            return None
+        return parsers_registry.parser_fingerprint(self.parser_module, self.parser_name)
 
     def to_specs(self):
         return {**super().to_specs(), "parser": {"name": self.parser_name, "module": self.parser_module}}
 
 
+@dataclass(frozen=True)
+class SuffixedCheckPlan:
+    """Tier names of the merged (double annotator) textgrids, where each of
+    the scheme's tiers is found twice, with a top and a bottom suffix"""
+    top_suffix: str
+    bottom_suffix: str
+    # (tier name, top tier name, bottom tier name), in the scheme's order
+    tiers_triplets: Tuple[Tuple[str, str, str], ...]
+    # suffixed names of all the tiers
+    all_tiers: FrozenSet[str]
+    # suffixed names of the required tiers, per suffix
+    required_tiers: Mapping[str, FrozenSet[str]]
+    # matches either suffix
+    suffixes_re: Pattern
+
+
+@dataclass(frozen=True)
+class CheckPlan:
+    """Everything the textgrid checks derive from a checking scheme, computed
+    once per scheme (and version), and shared by all checks using it"""
+    # tier names, in the scheme's order
+    tiers_names: Tuple[str, ...]
+    all_tiers: FrozenSet[str]
+    required_tiers: FrozenSet[str]
+    # tier schemes (and thus, their parsers), by tier name
+    tier_schemes: Mapping[str, TierScheme]
+    _suffixed_plans: Dict[Tuple[str, str], SuffixedCheckPlan] = field(default_factory=dict,
+                                                                       repr=False, compare=False)
+
+    @classmethod
+    def from_scheme(cls, scheme: 'TextGridCheckingScheme') -> 'CheckPlan':
+        tiers_names = tuple(scheme.tiers_specs.keys())
+        return cls(tiers_names=tiers_names,
+                   all_tiers=frozenset(tiers_names),
+                   required_tiers=frozenset(name for name, specs in scheme.tiers_specs.items()
+                                            if specs.required),
+                   tier_schemes=MappingProxyType(dict(scheme.tiers_specs)))
+
+    @property
+    def verdicts_fingerprint(self) -> Optional[Tuple[str, ...]]:
+        """The verdicts fingerprints of the scheme's tiers (see
+        `TierScheme.verdicts_fingerprint`), or None if any tier's checks
+        can't be reused. Computed on each use, as parsers can be reloaded."""
+        fingerprints = tuple(self.tier_schemes[name].verdicts_fingerprint
+                             for name in self.tiers_names)
+        return None if None in fingerprints else fingerprints
+
+    def suffixed(self, top_suffix: str, bottom_suffix: str) -> SuffixedCheckPlan:
+        try:
+            return self._suffixed_plans[(top_suffix, bottom_suffix)]
+        except KeyError:
+            pass
+        suffixed_plan = SuffixedCheckPlan(
+            top_suffix=top_suffix,
+            bottom_suffix=bottom_suffix,
+            tiers_triplets=tuple((name, name + top_suffix, name + bottom_suffix)
+                                 for name in self.tiers_names),
+            all_tiers=frozenset(name + suffix for name in self.tiers_names
+                                for suffix in (top_suffix, bottom_suffix)),
+            required_tiers=MappingProxyType({
+                suffix: frozenset(name + suffix for name in self.required_tiers)
+                for suffix in (top_suffix, bottom_suffix)}),
+            suffixes_re=re.compile("(%s|%s)" % (re.escape(top_suffix), re.escape(bottom_suffix))))
+        # setdefault: concurrent builds end up using the same plan
+        return self._suffixed_plans.setdefault((top_suffix, bottom_suffix), suffixed_plan)
+
+
+# check plans of the saved checking schemes, by (scheme id, scheme version)
+check_plans_cache = SizedLRUCache(max_size=256)
+
+
 class TextGridCheckingScheme(Document):
     name = StringField(required=True)
     # mapping: tier_name -> specs
@@ -116,29 +290,83 @@ class TextGridCheckingScheme(Document):
     # for now this isn't set. In the future it'll be a a pluginizable class that can handle checking outside
     # of the defined generic framework
     tg_checker_name = StringField()
+    # If set, tiers are checked in parallel, in a pool of threads (for parsers
+    # that release the GIL) or of processes (for CPU-heavy parsers)...
+    parallel_checking = StringField(choices=("thread", "process"))
+    # ... but only for textgrids with at least that many annotations
+    parallel_min_annotations = IntField(default=50000)
+    # bumped on each update, invalidating the cached check plans
+    version = IntField(default=0)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._check_plan: Optional[Tuple[int, CheckPlan]] = None
 
     @classmethod
     def from_tierspecs_schema(cls, scheme_data: List, scheme_name: str):
         new_scheme = cls(name=scheme_name)
         for tier_specs in scheme_data:
-            if tier_specs.get("checking_type") == "CATEGORICAL":
-                new_tier_scheme = CategoricalTier(name=tier_specs["name"],
-                                                  required=tier_specs["required"],
-                                                  allow_empty=tier_specs["allow_empty"],
-                                                  categories=tier_specs["categories"])
-            elif tier_specs.get("checking_type") == "PARSED":
-                new_tier_scheme = ParsedTier(name=tier_specs["name"],
-                                             required=tier_specs["required"],
-                                             allow_empty=tier_specs["allow_empty"],
-                                             parser_name=tier_specs["parser"]["name"],
-                                             parser_module=tier_specs["parser"]["module"])
+            new_scheme.tiers_specs[tier_specs["name"]] = TierScheme.from_specs(tier_specs)
+        return new_scheme
+
+    def run_tier_checks(self, checks: List[Tuple[Callable, Tuple]], annotations_count: int,
+                        isolated: bool = False) -> Optional[List[ErrorsLog]]:
+        """Runs each (check function, arguments) couple. If parallel checking
+        is enabled and there are enough annotations, the checks are run in
+        the checking executor, each with its own errors log. Those logs are
+        then merged into the current one in the checks' order, so the errors
+        are the same as with the sequential checking. All the checks share
+        the parsers' per-file time limit.
 
+        If `isolated`, each check is run with its own errors log (whatever
+        the way it's run), and those logs are returned instead of merged."""
+        with parsers_registry.file_deadline():
+            if (self.parallel_checking is None
+                    or annotations_count < self.parallel_min_annotations
+                    or len(checks) < 2):
+                if isolated:
+                    return [run_isolated_check(check_fn, args, error_log.budget) for check_fn, args in checks]
+                for check_fn, args in checks:
+                    check_fn(*args)
+                return None
+
+            executor = get_checking_executor(self.parallel_checking)
+            check_fns, args_list = zip(*checks)
+            if self.parallel_checking == "thread":
+                # each check runs in a copy of the current context, for the parsers' deadline
+                check_logs = executor.map(Context.run, [copy_context() for _ in checks],
+                                          repeat(run_isolated_check), check_fns, args_list,
+                                          repeat(error_log.budget))
             else:
-                new_tier_scheme = UnCheckedTier(name=tier_specs["name"],
-                                                allow_empty=tier_specs["allow_empty"],
-                                                required=tier_specs["required"])
-            new_scheme.tiers_specs[tier_specs["name"]] = new_tier_scheme
-        return new_scheme
+                check_logs = executor.map(run_isolated_check, check_fns, args_list,
+                                          repeat(error_log.budget))
+            if isolated:
+                return list(check_logs)
+            for check_log in check_logs:
+                error_log.merge(check_log)
+            return None
+
+    @classmethod
+    def pre_save(cls, sender, document: 'TextGridCheckingScheme', **kwargs):
+        if document.id is not None and document._get_changed_fields():
+            document.version += 1
+
+    @property
+    def check_plan(self) -> CheckPlan:
+        """The scheme's check plan. Plans of saved schemes are shared by all of
+        the scheme's instances (of the same version). Unsaved schemes are
+        assumed not to be modified once their plan is built."""
+        if self._check_plan is not None and self._check_plan[0] == self.version:
+            return self._check_plan[1]
+        plan = None
+        if self.id is not None:
+            plan = check_plans_cache.get((self.id, self.version))
+        if plan is None:
+            plan = CheckPlan.from_scheme(self)
+            if self.id is not None:
+                check_plans_cache.put((self.id, self.version), plan, 1)
+        self._check_plan = (self.version, plan)
+        return plan
 
     @property
     def required_tiers_names(self):
@@ -168,3 +396,6 @@ class TextGridCheckingScheme(Document):
             "name": self.name,
             "tier_specs": [tier.to_specs() for tier in self.tiers_specs.values()]
         }
+
+
+signals.pre_save.connect(TextGridCheckingScheme.pre_save, sender=TextGridCheckingScheme)
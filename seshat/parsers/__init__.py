@@ -1,10 +1,23 @@
+import hashlib
 import importlib
 import inspect
+import os
 import pkgutil
+import sys
 from collections import defaultdict
-from typing import Dict, Type
+from contextlib import nullcontext, contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from threading import RLock
+from typing import Dict, Type, Optional, Tuple, ContextManager, Iterator
 
-from .base import BaseCustomParser
+from .base import BaseCustomParser, AnnotationChecker
+from .pool import ParsersPool
+
+ParsersDict = Dict[str, Dict[str, Type[BaseCustomParser]]]
+
+# set in the `ParsersRegistry.pinned` blocks, where the reload stamp isn't checked
+_parsers_pinned: ContextVar[bool] = ContextVar("parsers_pinned", default=False)
 
 
 # copied from the python documentation
@@ -19,7 +32,7 @@ def find_parser_packages():
     }
 
 
-def list_parsers() -> Dict[str, Dict[str, Type[BaseCustomParser]]]:
+def scan_parsers() -> ParsersDict:
     """Searches for all available parsers in this namespace and returns
      a dictionary matching parser name to its class"""
     # retrieving all modules installed in seshat.parsers.* (ignoring the base.py)
@@ -30,12 +43,165 @@ def list_parsers() -> Dict[str, Dict[str, Type[BaseCustomParser]]]:
         for name, obj in inspect.getmembers(parser_mod):
             if inspect.isclass(obj) and issubclass(obj, BaseCustomParser):
                 parsers_dict[mod_name][obj.get_name()] = obj
-    return parsers_dict
+    return dict(parsers_dict)
+
+
+class ParsersRegistry:
+    """Process-wide registry of the installed parsers. Installed packages are
+    only scanned once, and each parser is only instantiated once, its instance
+    being shared by all the tiers (and requests) that use it.
+
+    Since each server worker has its own registry, `reload` also touches the
+    `reload_stamp` file (if set): the other workers' registries are rebuilt
+    the next time they're used. The stamp is checked once per request or
+    textgrid check (see `pinned`), and on each use outside of those.
+
+    If a parsers pool is set, the parsers are run by the pool's worker
+    processes instead of in the server's workers."""
+
+    def __init__(self):
+        self.reload_stamp: Optional[Path] = None
+        self.pool: Optional[ParsersPool] = None
+        self._lock = RLock()
+        self._parsers: Optional[ParsersDict] = None
+        self._instances: Dict[Tuple[str, str], AnnotationChecker] = {}
+        self._fingerprints: Dict[str, str] = {}
+        self._stamp_mtime: Optional[float] = None
+        # bumped each time the parsers are (re)loaded
+        self._generation = 0
+
+    def _read_stamp(self) -> Optional[float]:
+        if self.reload_stamp is None:
+            return None
+        try:
+            return os.stat(str(self.reload_stamp)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _is_stale(self) -> bool:
+        return self._parsers is None or self._read_stamp() != self._stamp_mtime
+
+    def _build(self, reload_modules: bool = False):
+        importlib.invalidate_caches()
+        if reload_modules:
+            for mod_name in [name for name in sys.modules if name.startswith('seshat_parser_')]:
+                try:
+                    importlib.reload(sys.modules[mod_name])
+                except ModuleNotFoundError:
+                    # the parsers package was uninstalled
+                    del sys.modules[mod_name]
+        self._parsers = scan_parsers()
+        self._instances = {}
+        self._fingerprints = {}
+        self._stamp_mtime = self._read_stamp()
+        self._generation += 1
+
+    def _refresh(self):
+        if self._parsers is not None and _parsers_pinned.get():
+            return
+        if self._is_stale():
+            self._build(reload_modules=self._parsers is not None)
+
+    @property
+    def parsers(self) -> ParsersDict:
+        with self._lock:
+            self._refresh()
+            return self._parsers
+
+    @property
+    def generation(self) -> int:
+        """Identifies the currently loaded parsers: anything derived from the
+        parsers' verdicts is stale once it changes"""
+        with self._lock:
+            self._refresh()
+            return self._generation
+
+    def get_parser(self, parser_mod: str, parser_name: str) -> AnnotationChecker:
+        with self._lock:
+            parsers = self.parsers
+            try:
+                return self._instances[(parser_mod, parser_name)]
+            except KeyError:
+                pass
+            try:
+                parser_class = parsers[parser_mod][parser_name]
+            except KeyError:
+                raise ValueError("Couldn't find parser with matching name")
+            if self.pool is not None and self.pool.usable:
+                parser = self.pool.get_checker(parser_mod, parser_name, parser_class)
+            else:
+                parser = parser_class()
+            self._instances[(parser_mod, parser_name)] = parser
+            return parser
+
+    def parser_fingerprint(self, parser_mod: str, parser_name: str) -> str:
+        """Identifies the parser's code, whatever the server worker: it changes
+        as soon as its package's source files are modified or upgraded"""
+        with self._lock:
+            self._refresh()
+            if parser_mod not in self._fingerprints:
+                package = sys.modules[parser_mod]
+                package_files = ([Path(package.__file__)] if not hasattr(package, "__path__")
+                                 else sorted(path for package_dir in package.__path__
+                                             for path in Path(package_dir).rglob("*.py")))
+                digest = hashlib.blake2b(digest_size=16)
+                for path in package_files:
+                    digest.update(path.read_bytes())
+                self._fingerprints[parser_mod] = digest.hexdigest()
+            return "%s:%s:%s" % (parser_mod, parser_name, self._fingerprints[parser_mod])
+
+    @contextmanager
+    def pinned(self) -> Iterator[None]:
+        """The reload stamp is only checked when entering that block (a request,
+        or a textgrid's check): the parsers used in it are the ones loaded
+        then (unless they're explicitly reloaded in it)"""
+        with self._lock:
+            self._refresh()
+        token = _parsers_pinned.set(True)
+        try:
+            yield
+        finally:
+            _parsers_pinned.reset(token)
+
+    def file_deadline(self) -> ContextManager:
+        """Parsers used in that block share the pool's per-file time limit (if
+        parsers are run by a pool)"""
+        if self.pool is None:
+            return nullcontext()
+        return self.pool.file_deadline()
+
+    def verdicts_stats(self) -> Dict[Tuple[str, str], Dict]:
+        """Verdicts cache statistics of each instantiated parser"""
+        with self._lock:
+            return {key: parser.verdicts_cache.stats
+                    for key, parser in self._instances.items()
+                    if parser.CACHE_VERDICTS}
+
+    def reload(self):
+        """Rescans the installed parsers packages (reloading the ones that were
+        already imported), and notifies the other workers"""
+        with self._lock:
+            if self.reload_stamp is not None:
+                self.reload_stamp.parent.mkdir(parents=True, exist_ok=True)
+                self.reload_stamp.touch()
+            self._build(reload_modules=True)
+            if self.pool is not None:
+                self.pool.restart()
+
+
+parsers_registry = ParsersRegistry()
+
+
+def list_parsers() -> ParsersDict:
+    """Returns a dictionary matching each parser module to its parsers' classes,
+    indexed by their names"""
+    return parsers_registry.parsers
+
+
+def parser_factory(parser_mod: str, parser_name: str) -> AnnotationChecker:
+    """Returns the (shared) instance of the parser matching that name"""
+    return parsers_registry.get_parser(parser_mod, parser_name)
 
 
-def parser_factory(parser_mod: str, parser_name: str) -> BaseCustomParser:
-    """Uses the importlib to load parser using its name"""
-    try:
-        return list_parsers()[parser_mod][parser_name]()
-    except KeyError:
-        raise ValueError("Couldn't find parser with matching name")
+def reload_parsers():
+    parsers_registry.reload()
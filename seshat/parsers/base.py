@@ -1,11 +1,24 @@
-from typing import List
+from typing import List, Optional, Tuple
 import abc
 
+from ..utils import SizedLRUCache
+
 class AnnotationError(Exception):
     pass
 
 
+class ParserFailure(Exception):
+    """The parser couldn't check the annotations: it timed out, crashed, or is unavailable"""
+    pass
+
+
 class AnnotationChecker(abc.ABC):
+    # Verdicts (whether an annotation is valid, and if not, why) are memoized,
+    # per annotation. Checkers that could give a different verdict for the
+    # same annotation have to set this to False.
+    CACHE_VERDICTS = True
+    # maximum number of memoized verdicts
+    VERDICTS_CACHE_SIZE = 100000
 
     @abc.abstractmethod
     def check_annotation(self, annot: str) -> None:
@@ -16,9 +29,47 @@ class AnnotationChecker(abc.ABC):
     def distance(self, annot_a: str, annot_b: str) -> float:
         raise NotImplemented()
 
+    @property
+    def verdicts_cache(self) -> SizedLRUCache:
+        # created lazily, since subclasses don't have to call this class' __init__
+        cache = self.__dict__.get("_verdicts_cache")
+        if cache is None:
+            cache = self.__dict__.setdefault("_verdicts_cache",
+                                             SizedLRUCache(max_size=self.VERDICTS_CACHE_SIZE))
+        return cache
+
+    def get_verdict(self, annot: str) -> Optional[str]:
+        """Returns the error message for that annotation, or None if it's valid"""
+        if self.CACHE_VERDICTS:
+            cached = self.verdicts_cache.get(annot)
+            if cached is not None:
+                return cached[0]
+        try:
+            self.check_annotation(annot)
+            verdict = None
+        except AnnotationError as e:
+            verdict = str(e)
+        if self.CACHE_VERDICTS:
+            # each verdict counts as 1 towards the cache's size
+            self.verdicts_cache.put(annot, (verdict,), 1)
+        return verdict
+
+    def check_annotations(self, annots: List[str]) -> List[Tuple[int, str]]:
+        """Checks a batch of annotations, and returns the index and error message
+        of each invalid one. Checkers can override this with a faster
+        implementation than this annotation-by-annotation loop."""
+        errors = []
+        for i, annot in enumerate(annots):
+            verdict = self.get_verdict(annot)
+            if verdict is not None:
+                errors.append((i, verdict))
+        return errors
+
 
 class BaseCustomParser(AnnotationChecker):
-    """This is the class that all custom parsers should inherit from"""
+    """This is the class that all custom parsers should inherit from.
+    Parsers are instantiated once per server process, and their instance is
+    shared by all requests: `check_annotation` shouldn't modify its state."""
     NAME = None
     VALID_ANNOT_EXAMPLE = ""
     INVALID_ANNOT_EXAMPLE = ""
@@ -29,13 +80,28 @@ class BaseCustomParser(AnnotationChecker):
 
 
 class CategoricalChecker(AnnotationChecker):
+    # the check is a set lookup, there's nothing to gain from memoizing it
+    CACHE_VERDICTS = False
 
     def __init__(self, categories: List[str]):
         self.categories = set(categories)
+        # listed in the scheme's order: the set's order depends on the process' hash seed
+        self.categories_str = ", ".join(dict.fromkeys(categories))
+
+    def error_msg(self, annot: str) -> str:
+        return f"Annotation {annot} not valid: has to be one of {self.categories_str}"
 
     def check_annotation(self, annot: str):
         if annot.strip() not in self.categories:
-            raise AnnotationError(f"Annotation {annot} not valid: has to be one of {', '.join(self.categories)}")
+            raise AnnotationError(self.error_msg(annot))
+
+    def check_annotations(self, annots: List[str]) -> List[Tuple[int, str]]:
+        stripped_annots = [annot.strip() for annot in annots]
+        invalid_annots = set(stripped_annots) - self.categories
+        if not invalid_annots:
+            return []
+        return [(i, self.error_msg(annots[i]))
+                for i, annot in enumerate(stripped_annots) if annot in invalid_annots]
 
     def distance(self, annot_a: str, annot_b: str) -> float:
         return 1.0# TODO
\ No newline at end of file
@@ -0,0 +1,233 @@
+"""Pool of long-lived worker processes running the custom parsers, so a slow
+or crashing parser can't block (or take down) the server's workers. Each
+worker preloads the installed parsers, and checks batches of annotations
+sent through a pipe. Workers that exceed their time limit, or crash, are
+killed and restarted, up to a number of restarts per time window."""
+import multiprocessing
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from multiprocessing.connection import Connection
+from pathlib import Path
+from queue import Queue, Empty
+from threading import Lock
+from typing import List, Tuple, Optional, Type, Iterator, Union
+
+from .base import AnnotationChecker, AnnotationError, ParserFailure, BaseCustomParser
+
+# monotonic time before which the current textgrid's annotations have to be checked
+_file_deadline: ContextVar[Optional[float]] = ContextVar("parsers_file_deadline", default=None)
+
+
+class WorkerLost(ParserFailure):
+    """The worker timed out or crashed, and has to be restarted"""
+    pass
+
+
+def worker_main(conn: Connection, reload_stamp: Optional[Path]):
+    """Worker process' loop: receives (parser module, parser name, annotations)
+    requests, and answers with (True, errors) or (False, failure message)"""
+    from . import ParsersRegistry
+    registry = ParsersRegistry()
+    registry.reload_stamp = reload_stamp
+    # preloading the parsers
+    registry.parsers
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if request is None:
+            break
+        parser_mod, parser_name, annots = request
+        try:
+            parser = registry.get_parser(parser_mod, parser_name)
+            conn.send((True, parser.check_annotations(annots)))
+        except Exception as e:
+            conn.send((False, "%s: %s" % (type(e).__name__, e)))
+
+
+class ParserWorker:
+
+    def __init__(self, reload_stamp: Optional[Path]):
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, worker_conn = ctx.Pipe()
+        self.process = ctx.Process(target=worker_main, args=(worker_conn, reload_stamp),
+                                   name="seshat-parser-worker", daemon=True)
+        self.process.start()
+        worker_conn.close()
+
+    def call(self, request: Tuple, timeout: float):
+        """Sends a request, and waits for its result. Raises a `WorkerLost`
+        if the worker didn't answer in time, or crashed, and a `ParserFailure`
+        if the parser raised an unexpected exception."""
+        try:
+            self.conn.send(request)
+            if not self.conn.poll(timeout):
+                raise WorkerLost("the parser timed out")
+            success, result = self.conn.recv()
+        except (EOFError, OSError):
+            raise WorkerLost("the parser crashed")
+        if not success:
+            raise ParserFailure(result)
+        return result
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class ParsersPool:
+    """Pool of parser worker processes, shared by a server worker's threads.
+    Workers are only started when first needed, by the process that uses the
+    pool (so a pool set up before the server forks isn't shared)."""
+
+    def __init__(self, workers: int = 2, call_timeout: float = 5.0, file_timeout: float = 60.0,
+                 batch_size: int = 1000, max_restarts: int = 10, restart_window: float = 60.0):
+        self.workers = workers
+        # time limit (in seconds) of each batch of annotations sent to a worker
+        self.call_timeout = call_timeout
+        # time limit (in seconds) of the checks of a single textgrid
+        self.file_timeout = file_timeout
+        self.batch_size = batch_size
+        # workers won't be restarted more than that many times per window (in seconds)
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.reload_stamp: Optional[Path] = None
+        self._lock = Lock()
+        self._owner_pid: Optional[int] = None
+        self._slots: Optional[Queue] = None
+        self._restarts = deque()
+
+    @property
+    def usable(self) -> bool:
+        # daemonic processes (like some executors' workers) can't have children
+        return not multiprocessing.current_process().daemon
+
+    def _get_slots(self) -> Queue:
+        with self._lock:
+            if self._owner_pid != os.getpid():
+                # slots are None until a worker is started in them, and False
+                # once their worker was lost (restarting it counts as a restart)
+                self._slots = Queue()
+                for _ in range(self.workers):
+                    self._slots.put(None)
+                self._owner_pid = os.getpid()
+                self._restarts.clear()
+            return self._slots
+
+    def _start_worker(self, restart: bool) -> ParserWorker:
+        if restart:
+            with self._lock:
+                now = time.monotonic()
+                while self._restarts and self._restarts[0] < now - self.restart_window:
+                    self._restarts.popleft()
+                if len(self._restarts) >= self.max_restarts:
+                    raise ParserFailure("the parsers failed too many times, and are disabled for now")
+                self._restarts.append(now)
+        return ParserWorker(self.reload_stamp)
+
+    @contextmanager
+    def file_deadline(self) -> Iterator[None]:
+        """The parsers' calls made in this block share the per-file time limit"""
+        if _file_deadline.get() is not None:
+            yield
+            return
+        token = _file_deadline.set(time.monotonic() + self.file_timeout)
+        try:
+            yield
+        finally:
+            _file_deadline.reset(token)
+
+    def _timeout(self) -> float:
+        deadline = _file_deadline.get()
+        if deadline is None:
+            return self.call_timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise ParserFailure("the textgrid's checks took too long")
+        return min(self.call_timeout, remaining)
+
+    def check(self, parser_mod: str, parser_name: str, annots: List[str]) -> List[Tuple[int, str]]:
+        """Checks the annotations with that parser in one of the workers, in
+        batches of `batch_size` annotations. Returns the index and error
+        message of each invalid annotation."""
+        slots = self._get_slots()
+        try:
+            worker: Union[ParserWorker, None, bool] = slots.get(timeout=self._timeout())
+        except Empty:
+            raise ParserFailure("no parser worker was available in time")
+        try:
+            if not worker:
+                worker = self._start_worker(restart=worker is False)
+            errors = []
+            for start in range(0, len(annots), self.batch_size):
+                request = (parser_mod, parser_name, annots[start:start + self.batch_size])
+                try:
+                    batch_errors = worker.call(request, self._timeout())
+                except WorkerLost:
+                    worker.kill()
+                    worker = False
+                    worker = self._start_worker(restart=True)
+                    raise
+                errors.extend((start + i, error_msg) for i, error_msg in batch_errors)
+            return errors
+        finally:
+            slots.put(worker)
+
+    def restart(self):
+        """Stops the idle workers, so they're restarted (and reload their
+        parsers) when next needed"""
+        slots = self._get_slots()
+        for _ in range(self.workers):
+            try:
+                worker = slots.get_nowait()
+            except Empty:
+                break
+            if worker:
+                worker.kill()
+            slots.put(None)
+
+    def get_checker(self, parser_mod: str, parser_name: str,
+                    parser_class: Type[BaseCustomParser]) -> 'PooledParser':
+        return PooledParser(self, parser_mod, parser_name, parser_class)
+
+
+class PooledParser(AnnotationChecker):
+    """Stands for a custom parser that's run by the parsers pool. Its verdicts
+    are memoized (if the parser allows it) in the server's worker, so only
+    annotations that weren't seen yet are sent to the pool."""
+
+    def __init__(self, pool: ParsersPool, parser_mod: str, parser_name: str,
+                 parser_class: Type[BaseCustomParser]):
+        self.pool = pool
+        self.parser_mod = parser_mod
+        self.parser_name = parser_name
+        self.CACHE_VERDICTS = parser_class.CACHE_VERDICTS
+        self.VERDICTS_CACHE_SIZE = parser_class.VERDICTS_CACHE_SIZE
+
+    def check_annotation(self, annot: str) -> None:
+        errors = self.pool.check(self.parser_mod, self.parser_name, [annot])
+        if errors:
+            raise AnnotationError(errors[0][1])
+
+    def check_annotations(self, annots: List[str]) -> List[Tuple[int, str]]:
+        if not self.CACHE_VERDICTS:
+            return self.pool.check(self.parser_mod, self.parser_name, annots)
+
+        verdicts = {}
+        for annot in annots:
+            if annot not in verdicts:
+                cached = self.verdicts_cache.get(annot)
+                verdicts[annot] = cached
+        unknown_annots = [annot for annot, cached in verdicts.items() if cached is None]
+        if unknown_annots:
+            unknown_errors = dict(self.pool.check(self.parser_mod, self.parser_name, unknown_annots))
+            for i, annot in enumerate(unknown_annots):
+                verdicts[annot] = (unknown_errors.get(i),)
+                self.verdicts_cache.put(annot, verdicts[annot], 1)
+        return [(i, verdicts[annot][0]) for i, annot in enumerate(annots)
+                if verdicts[annot][0] is not None]
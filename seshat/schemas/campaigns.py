@@ -7,6 +7,8 @@ from seshat.schemas.users import UserShortProfile
 class ParserClass(Schema):
     name = fields.Str(required=True)
     module = fields.Str(required=True)
+    # only there if the parser has been used (and memoizes its verdicts)
+    verdicts_cache = fields.Dict()
 
 
 class TierSpecifications(Schema):
@@ -57,6 +59,16 @@ class CampaignEditSchema(Schema):
     name = fields.Str(required=True)
 
 
+class GammaJobStatus(Schema):
+    status = fields.Str(required=True)
+    progress = fields.Int()
+    tasks_count = fields.Int(allow_none=True)
+    creation_time = fields.DateTime(required=True)
+    start_time = fields.DateTime(allow_none=True)
+    finish_time = fields.DateTime(allow_none=True)
+    error = fields.Str(allow_none=True)
+
+
 class CampaignStats(Schema):
     total_tasks = fields.Int(required=True)
     completed_tasks = fields.Int(required=True)
@@ -66,6 +78,7 @@ class CampaignStats(Schema):
     can_update_gamma = fields.Bool()
     can_compute_gamma = fields.Bool(required=True)
     gamma_updating = fields.Bool()
+    gamma_job = fields.Nested(GammaJobStatus, allow_none=True)
 
 
 class CampaignShortProfile(Schema):
@@ -118,4 +131,14 @@ class TierQuickCheck(Schema):
 
 class QuickCheckResponse(Schema):
     is_valid = fields.Bool(required=True)
-    error_msg = fields.Str()
\ No newline at end of file
+    error_msg = fields.Str()
+
+
+class BatchQuickCheck(Schema):
+    annotations = fields.List(fields.Nested(TierQuickCheck), required=True,
+                              validate=validate.Length(max=10000))
+
+
+class BatchQuickCheckResponse(Schema):
+    # one verdict per annotation, in the same order
+    verdicts = fields.List(fields.Nested(QuickCheckResponse), required=True)
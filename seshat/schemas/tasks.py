@@ -111,6 +111,11 @@ class TaskTextgridSubmission(Schema):
     textgrid_str = fields.Str(required=True)
 
 
+class TaskTextgridValidation(TaskTextgridSubmission):
+    # stops the validation at the first structural error
+    fail_fast = fields.Bool(missing=False)
+
+
 class AnnotationError(Schema):
     tier = fields.Str(required=True)
     msg = fields.Str(required=True)
@@ -127,9 +132,14 @@ class StructuralError(Schema):
 class AnnotMismatchError(Schema):
     ref_tier = fields.Str(required=True)
     target_tier = fields.Str(required=True)
-    ref_annot = fields.Str(required=True)
-    target_annot = fields.Str(required=True)
+    # null for insertions (annotations that are only in the target tier)
+    ref_annot = fields.Str(required=True, allow_none=True)
+    # null for deletions (annotations that are only in the ref tier)
+    target_annot = fields.Str(required=True, allow_none=True)
     index = fields.Int(required=True)
+    target_index = fields.Int()
+    # either "substitution", "insertion" or "deletion"
+    kind = fields.Str()
 
 
 class TextGridErrors(Schema):
@@ -140,3 +150,7 @@ class TextGridErrors(Schema):
     annot = fields.Dict(keys=fields.Str(),
                         values=fields.List(fields.Nested(AnnotationError)))
     total_error_count = fields.Int()
+    # number of annotation errors found in each tier, including the unreported ones
+    annot_counts = fields.Dict(keys=fields.Str(), values=fields.Int())
+    # some errors weren't reported (because of the errors budget), or the validation was stopped
+    truncated = fields.Bool()
@@ -0,0 +1,189 @@
+"""Compact, array-backed representation of parsed TextGrids. Interval tiers
+are stored as NumPy arrays of start and end times, along with an array of
+indexes into an interned labels table, instead of one `Interval` object
+per annotation. `Interval` objects are only built on demand (for instance,
+when logging an error), and the whole TextGrid is only converted back to a
+`textgrid.TextGrid` when it has to be serialized."""
+import hashlib
+import json
+import sys
+from copy import deepcopy
+from typing import List, Optional, Union, Iterator, Dict
+
+import numpy as np
+from textgrid import Interval, IntervalTier, TextGrid, PointTier
+
+
+def readonly_view(array: np.ndarray) -> np.ndarray:
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+class CompactTier:
+    """Array-backed equivalent of the textgrid library's `IntervalTier`"""
+
+    def __init__(self, name: str,
+                 minTime: float,
+                 maxTime: float,
+                 starts: np.ndarray,
+                 ends: np.ndarray,
+                 label_ids: np.ndarray,
+                 labels: List[str]):
+        self.name = name
+        self.minTime = minTime
+        self.maxTime = maxTime
+        self.starts = starts
+        self.ends = ends
+        # index of each annotation's mark in the labels table
+        self.label_ids = label_ids
+        self.labels = labels
+
+    @classmethod
+    def from_lists(cls, name: str, min_time: float, max_time: float,
+                   starts: List[float], ends: List[float], marks: List[str]) -> 'CompactTier':
+        labels_table: Dict[str, int] = {}
+        label_ids = [labels_table.setdefault(mark, len(labels_table)) for mark in marks]
+        return cls(name, min_time, max_time,
+                   np.array(starts, dtype=np.float64),
+                   np.array(ends, dtype=np.float64),
+                   np.array(label_ids, dtype=np.int32),
+                   list(labels_table))
+
+    @classmethod
+    def from_interval_tier(cls, tier: IntervalTier) -> 'CompactTier':
+        return cls.from_lists(tier.name, tier.minTime, tier.maxTime,
+                              [interval.minTime for interval in tier],
+                              [interval.maxTime for interval in tier],
+                              [interval.mark for interval in tier])
+
+    def __len__(self):
+        return len(self.label_ids)
+
+    def __getitem__(self, i: int) -> Interval:
+        return Interval(float(self.starts[i]), float(self.ends[i]),
+                        self.labels[self.label_ids[i]])
+
+    def __iter__(self) -> Iterator[Interval]:
+        labels = self.labels
+        for start, end, label_id in zip(self.starts.tolist(), self.ends.tolist(),
+                                        self.label_ids.tolist()):
+            yield Interval(start, end, labels[label_id])
+
+    def __str__(self):
+        return '<CompactTier {0}, {1} intervals>'.format(self.name, len(self))
+
+    def __repr__(self):
+        return 'CompactTier({0}, {1})'.format(self.name, self.intervals)
+
+    @property
+    def marks(self) -> List[str]:
+        """Annotations' marks, in order"""
+        labels = self.labels
+        return [labels[label_id] for label_id in self.label_ids.tolist()]
+
+    @property
+    def intervals(self) -> List[Interval]:
+        return list(self)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory footprint of the tier"""
+        return (self.starts.nbytes + self.ends.nbytes + self.label_ids.nbytes
+                + sum(sys.getsizeof(label) for label in self.labels))
+
+    @property
+    def content_hash(self) -> str:
+        """Digest of the tier's name, bounds and annotations"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(json.dumps([self.name, str(self.minTime), str(self.maxTime), self.labels]).encode("utf-8"))
+        for array in (self.starts, self.ends, self.label_ids):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    def renamed(self, name: str) -> 'CompactTier':
+        """The same tier, under another name. Both tiers share the same
+        (read-only) arrays and labels table, nothing is copied."""
+        return CompactTier(name, self.minTime, self.maxTime,
+                           readonly_view(self.starts), readonly_view(self.ends),
+                           readonly_view(self.label_ids), self.labels)
+
+    def to_interval_tier(self) -> IntervalTier:
+        tier = IntervalTier(self.name, self.minTime, self.maxTime)
+        tier.intervals = self.intervals
+        return tier
+
+
+AnyTier = Union[CompactTier, PointTier]
+
+
+def renamed_tier(tier: AnyTier, name: str) -> AnyTier:
+    """Renamed copy-free view of a compact tier (point tiers are rare, and
+    just copied)"""
+    if isinstance(tier, CompactTier):
+        return tier.renamed(name)
+    tier = deepcopy(tier)
+    tier.name = name
+    return tier
+
+
+class CompactTextGrid:
+    """Drop-in replacement for the few `textgrid.TextGrid` methods that are used
+    throughout seshat (`getNames`, `getFirst`, `append`, iteration)"""
+
+    def __init__(self, name: Optional[str] = None,
+                 minTime: float = 0.,
+                 maxTime: Optional[float] = None):
+        self.name = name
+        self.minTime = minTime
+        self.maxTime = maxTime
+        # point tiers are rare, they're kept as regular `PointTier` objects
+        self.tiers: List[AnyTier] = []
+
+    @classmethod
+    def from_textgrid(cls, tg: TextGrid) -> 'CompactTextGrid':
+        compact_tg = cls(tg.name, tg.minTime, tg.maxTime)
+        for tier in tg:
+            if isinstance(tier, IntervalTier):
+                tier = CompactTier.from_interval_tier(tier)
+            compact_tg.append(tier)
+        return compact_tg
+
+    def __iter__(self) -> Iterator[AnyTier]:
+        return iter(self.tiers)
+
+    def __len__(self):
+        return len(self.tiers)
+
+    def __getitem__(self, i: int) -> AnyTier:
+        return self.tiers[i]
+
+    def __str__(self):
+        return '<CompactTextGrid {0}, {1} Tiers>'.format(self.name, len(self))
+
+    def getFirst(self, tier_name: str) -> Optional[AnyTier]:
+        for tier in self.tiers:
+            if tier.name == tier_name:
+                return tier
+
+    def getNames(self) -> List[str]:
+        return [tier.name for tier in self.tiers]
+
+    def append(self, tier: AnyTier):
+        if self.maxTime is not None and tier.maxTime is not None and tier.maxTime > self.maxTime:
+            raise ValueError(self.maxTime)  # too late
+        self.tiers.append(tier)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(tier.nbytes if isinstance(tier, CompactTier) else sys.getsizeof(tier.points)
+                   for tier in self.tiers)
+
+    def to_textgrid(self) -> TextGrid:
+        """Converts back to a regular TextGrid, usually for serialization"""
+        tg = TextGrid(name=self.name, minTime=self.minTime, maxTime=self.maxTime)
+        for tier in self.tiers:
+            if isinstance(tier, CompactTier):
+                tier = tier.to_interval_tier()
+            tg.append(tier)
+        return tg
@@ -0,0 +1,274 @@
+"""In-memory reader for Praat's TextGrid text formats (both the "long" and
+the "short" one), working directly from the payload's bytes or string
+instead of going through a temporary file like `TextGrid.fromFile` does.
+Very large TextGrids can also be read one tier at a time from a file
+object (see `iter_compact_tiers`)."""
+import codecs
+import re
+from typing import Union, Iterator, Tuple, List, Callable, Type, TypeVar, BinaryIO, Optional, \
+    Container
+
+from textgrid import TextGrid, IntervalTier, PointTier, Interval, Point
+from textgrid.exceptions import TextGridError
+
+from .tg_compact import CompactTextGrid, CompactTier, AnyTier
+
+TG = TypeVar("TG", TextGrid, CompactTextGrid)
+
+# same rounding as the one used by the textgrid library
+TIME_PRECISION = 5
+
+# Both Praat text formats boil down to the same flat sequence of values: the
+# long format only adds labels (`xmin = `, `intervals [3]:`, ...) around them.
+# Hence, we just need to extract strings, numbers and flags (`<exists>`),
+# while skipping the bracketed indexes and the `!` comments. The leading
+# lookahead lets the regex engine skip the labels' characters quickly.
+TOKEN_RE = re.compile(r'(?=["\d.<\[!-])(?:'
+                      r'"((?:[^"]|"")*)"'
+                      r'|(-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)'
+                      r'|<(\w+)>'
+                      r'|\[[^\]\n]*\]'
+                      r'|![^\n]*)')
+
+BOMS = ((codecs.BOM_UTF8, "utf-8-sig"),
+        (codecs.BOM_UTF16_LE, "utf-16"),
+        (codecs.BOM_UTF16_BE, "utf-16"))
+
+# size of the chunks read from the file when streaming a TextGrid
+STREAM_CHUNK_SIZE = 1024 ** 2
+
+
+def sniff_encoding(head: bytes) -> str:
+    """Guesses a TextGrid's encoding from its first bytes. Praat writes either
+    UTF-8 or UTF-16 (the latter always with a BOM), but BOM-less UTF-16 files
+    are still detected from their null bytes."""
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+    if len(head) >= 2 and not head[0]:
+        return "utf-16-be"
+    if len(head) >= 2 and not head[1]:
+        return "utf-16-le"
+    return "utf-8"
+
+
+def decode_textgrid(payload: Union[bytes, memoryview]) -> str:
+    """Decodes a TextGrid payload, sniffing its encoding. Any bytes-like
+    payload (such as a memory-mapped file) is decoded without being copied."""
+    return codecs.decode(payload, sniff_encoding(bytes(payload[:3])))
+
+
+def iter_textgrid_chunks(tg_file: BinaryIO, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[str]:
+    """Decodes a TextGrid file incrementally, yielding chunks of text that
+    always end on a line break outside of any string, so that no token is
+    ever split between two chunks"""
+    data = tg_file.read(chunk_size)
+    decoder = codecs.getincrementaldecoder(sniff_encoding(data[:3]))()
+    pending = ""
+    while data:
+        pending += decoder.decode(data)
+        cut = pending.rfind("\n") + 1
+        # an odd number of quotes means the line break is inside a string:
+        # waiting for the next chunk
+        if cut and not pending.count('"', 0, cut) % 2:
+            yield pending[:cut]
+            pending = pending[cut:]
+        data = tg_file.read(chunk_size)
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def iter_tokens(textgrid_str: str) -> Iterator[Union[str, float]]:
+    """Yields the values (strings, numbers and flags) of a TextGrid text file,
+    in order"""
+    for match in TOKEN_RE.finditer(textgrid_str):
+        group_idx = match.lastindex
+        if group_idx == 1:
+            yield match.group(1).replace('""', '"')
+        elif group_idx == 2:
+            yield float(match.group(2))
+        elif group_idx == 3:
+            yield "<%s>" % match.group(3)
+
+
+class TokenReader:
+    """Small cursor over the TextGrid tokens, raising a `TextGridError`
+    when the file doesn't have the expected structure"""
+
+    def __init__(self, tokens: Iterator[Union[str, float]]):
+        self.tokens = tokens
+
+    @classmethod
+    def from_file(cls, tg_file: BinaryIO) -> 'TokenReader':
+        chunks = iter_textgrid_chunks(tg_file)
+        return cls(token for chunk in chunks for token in iter_tokens(chunk))
+
+    def next(self) -> Union[str, float]:
+        try:
+            return next(self.tokens)
+        except StopIteration:
+            raise TextGridError("Unexpected end of file")
+
+    def string(self) -> str:
+        token = self.next()
+        if not isinstance(token, str):
+            raise TextGridError("Expected a string, found %s" % token)
+        return token
+
+    def number(self) -> float:
+        token = self.next()
+        if not isinstance(token, float):
+            raise TextGridError("Expected a number, found '%s'" % token)
+        return token
+
+    def time(self) -> float:
+        return round(self.number(), TIME_PRECISION)
+
+    def count(self) -> int:
+        return int(self.number())
+
+
+def read_header(reader: TokenReader) -> Tuple[float, float, int]:
+    """Reads the file's header, and returns the TextGrid's time bounds and
+    its number of tiers"""
+    file_type = reader.next()
+    if not isinstance(file_type, str) or not file_type.startswith("ooTextFile"):
+        raise TextGridError("The file could not be parsed as a Praat text file "
+                            "as it is lacking a proper header.")
+    if reader.next() != "TextGrid":
+        raise TextGridError("The file could not be parsed as a TextGrid "
+                            "as it is lacking a proper header.")
+    min_time, max_time = reader.time(), reader.time()
+    if reader.next() != "<exists>":
+        return min_time, max_time, 0
+    return min_time, max_time, reader.count()
+
+
+def read_intervals(reader: TokenReader, tier_min: float,
+                   tier_max: float) -> Tuple[List[float], List[float], List[str]]:
+    """Reads an interval tier's body, returning its start times, end times and
+    marks as three lists. Raises the same `ValueError` as the textgrid library
+    for intervals that are out of the tier's bounds or that overlap."""
+    starts, ends, marks = [], [], []
+    is_sorted = True
+    for _ in range(reader.count()):
+        start, end, mark = reader.time(), reader.time(), reader.string()
+        if start >= end:
+            # null intervals are dropped, as done by the textgrid library
+            continue
+        if start < tier_min:  # too early
+            raise ValueError(tier_min)
+        if tier_max and end > tier_max:  # too late
+            raise ValueError(tier_max)
+        if ends and start < ends[-1]:
+            is_sorted = False
+        starts.append(start)
+        ends.append(end)
+        marks.append(mark)
+    if not is_sorted:
+        order = sorted(range(len(starts)), key=starts.__getitem__)
+        starts = [starts[i] for i in order]
+        ends = [ends[i] for i in order]
+        marks = [marks[i] for i in order]
+        # once sorted, any overlap shows between two consecutive intervals
+        for i in range(1, len(starts)):
+            if starts[i] < ends[i - 1]:
+                raise ValueError(Interval(starts[i - 1], ends[i - 1], marks[i - 1]),
+                                 Interval(starts[i], ends[i], marks[i]))
+    return starts, ends, marks
+
+
+def skip_tier_body(reader: TokenReader, tier_class: str):
+    """Reads past an interval or point tier's items without storing them"""
+    tokens_per_item = 3 if tier_class == "IntervalTier" else 2
+    for _ in range(reader.count() * tokens_per_item):
+        reader.next()
+
+
+def build_interval_tier(name: str, min_time: float, max_time: float,
+                        starts: List[float], ends: List[float], marks: List[str]) -> IntervalTier:
+    tier = IntervalTier(name, min_time, max_time)
+    tier.intervals = [Interval(start, end, mark) for start, end, mark in zip(starts, ends, marks)]
+    return tier
+
+
+def read_point_tier(reader: TokenReader, name: str,
+                    min_time: float, max_time: float) -> PointTier:
+    tier = PointTier(name, min_time, max_time)
+    for _ in range(reader.count()):
+        time, mark = reader.time(), reader.string()
+        tier.addPoint(Point(time, mark))
+    return tier
+
+
+def read_textgrid(textgrid: Union[bytes, str],
+                  tg_class: Type[TG],
+                  interval_tier_builder: Callable) -> TG:
+    if isinstance(textgrid, (bytes, bytearray, memoryview)):
+        textgrid = decode_textgrid(textgrid)
+    reader = TokenReader(iter_tokens(textgrid))
+    min_time, max_time, tiers_count = read_header(reader)
+    tg = tg_class(minTime=min_time, maxTime=max_time)
+    for _ in range(tiers_count):
+        tg.append(read_tier(reader, interval_tier_builder))
+    return tg
+
+
+def read_tier_header(reader: TokenReader) -> Tuple[str, str, float, float]:
+    tier_class = reader.string()
+    if tier_class not in ("IntervalTier", "TextTier"):
+        raise TextGridError("Unknown tier class %s" % tier_class)
+    name = reader.string()
+    return tier_class, name, reader.time(), reader.time()
+
+
+def read_tier(reader: TokenReader, interval_tier_builder: Callable):
+    tier_class, name, tier_min, tier_max = read_tier_header(reader)
+    if tier_class == "IntervalTier":
+        return interval_tier_builder(name, tier_min, tier_max,
+                                     *read_intervals(reader, tier_min, tier_max))
+    else:
+        return read_point_tier(reader, name, tier_min, tier_max)
+
+
+def parse_textgrid(textgrid: Union[bytes, str]) -> TextGrid:
+    """Parses a TextGrid (in the long or short text format) straight from
+    its payload. Raises a `TextGridError` if the TextGrid is malformed."""
+    return read_textgrid(textgrid, TextGrid, build_interval_tier)
+
+
+def parse_compact_textgrid(textgrid: Union[bytes, str]) -> CompactTextGrid:
+    """Same as `parse_textgrid`, but returns an array-backed `CompactTextGrid`"""
+    return read_textgrid(textgrid, CompactTextGrid, CompactTier.from_lists)
+
+
+def read_tier_names(tg_file: BinaryIO) -> List[str]:
+    """Lists a TextGrid file's tier names, in order, without storing any of
+    its annotations"""
+    reader = TokenReader.from_file(tg_file)
+    _, _, tiers_count = read_header(reader)
+    names = []
+    for _ in range(tiers_count):
+        tier_class, name, _, _ = read_tier_header(reader)
+        skip_tier_body(reader, tier_class)
+        names.append(name)
+    return names
+
+
+def iter_compact_tiers(tg_file: BinaryIO,
+                       tier_names: Optional[Container[str]] = None) -> Iterator[AnyTier]:
+    """Streams a TextGrid file's tiers, one at a time. Only one tier (and
+    a chunk of the file) is held in memory at any time. If `tier_names` is
+    specified, other tiers are skipped without being built."""
+    reader = TokenReader.from_file(tg_file)
+    _, _, tiers_count = read_header(reader)
+    for _ in range(tiers_count):
+        tier_class, name, tier_min, tier_max = read_tier_header(reader)
+        if tier_names is not None and name not in tier_names:
+            skip_tier_body(reader, tier_class)
+        elif tier_class == "IntervalTier":
+            yield CompactTier.from_lists(name, tier_min, tier_max,
+                                         *read_intervals(reader, tier_min, tier_max))
+        else:
+            yield read_point_tier(reader, name, tier_min, tier_max)
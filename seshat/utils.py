@@ -1,14 +1,21 @@
 import traceback
 from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
+from difflib import SequenceMatcher
 from io import StringIO
 from os import makedirs
 from pathlib import Path
-from tempfile import NamedTemporaryFile
+from threading import Lock
+from time import perf_counter
+from typing import Union, Optional, Any, Hashable, Dict, List, Tuple, Sequence
 
 from flask import current_app as app
 from textgrid import TextGrid
 
+from .tg_compact import CompactTextGrid
+from .tg_parsing import parse_textgrid, decode_textgrid
+
 
 def percentage(a, b):
     try:
@@ -45,6 +52,81 @@ class FixSizeOrderedDict(OrderedDict):
                 self.popitem(False)
 
 
+class SizedLRUCache:
+    """Thread-safe LRU cache, bounded by the total (estimated) size of its
+    values instead of by their number. Keeps some hit/miss counters."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            try:
+                value, _ = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, size: int):
+        with self._lock:
+            if key in self._entries:
+                _, old_size = self._entries.pop(key)
+                self.size -= old_size
+            if size > self.max_size:
+                # doesn't fit anyway, not worth evicting everything for it
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats(self) -> Dict[str, Union[int, float]]:
+        lookups = self.hits + self.misses
+        return {"entries": len(self),
+                "size": self.size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+class StagesTimer:
+    """Measures the time spent (in seconds) in each stage of some processing.
+    Stages entered several times add up."""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + perf_counter() - start
+
+
 class PersistantStringIO(StringIO):
     """StringIO that stores its buffer when you close it, as not to lose
     the data that was written to it"""
@@ -58,19 +140,17 @@ class PersistantStringIO(StringIO):
         super().close()
 
 
-def open_str_textgrid(textgrid_str: str) -> TextGrid:
-    """Since the textgrid librairy only can open TextGrid from an actual file
-    (and not a TextIOWrapper type of object), this function enables us to parse
-    a TextGrid directly from a string, using a temporary file."""
-    with NamedTemporaryFile(mode="w") as temptg:
-        temptg.write(textgrid_str)
-        temptg.flush()
-        return TextGrid.fromFile(temptg.name)
+def open_str_textgrid(textgrid_str: Union[str, bytes]) -> TextGrid:
+    """Parses a TextGrid from a string (or its raw bytes), in memory, with
+    our own parser (see `tg_parsing`), without going through a file"""
+    return parse_textgrid(textgrid_str)
 
 
-def tg_to_str(textgrid: TextGrid) -> str:
+def tg_to_str(textgrid: Union[TextGrid, CompactTextGrid]) -> str:
     """Uses a StringIO to write the textgrid into a string instead of into
     a file"""
+    if isinstance(textgrid, CompactTextGrid):
+        textgrid = textgrid.to_textgrid()
     str_io = PersistantStringIO()
     textgrid.write(str_io)
     return str_io.data
@@ -85,14 +165,130 @@ def consecutive_couples(iterable):
         yield first, second
 
 
+# A line delta is a list of operations, each being either a `[start, end]`
+# slice of the base's lines to copy, or a string to insert
+LineDelta = List[Union[List[int], str]]
+
+
+def line_delta(base: str, new: str) -> LineDelta:
+    """Computes the line-level delta turning `base` into `new`. The common
+    head and tail of both texts are trimmed before diffing, since successive
+    uploads of a textgrid usually only differ in a few places."""
+    base_lines = base.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    max_common = min(len(base_lines), len(new_lines))
+    prefix = 0
+    while prefix < max_common and base_lines[prefix] == new_lines[prefix]:
+        prefix += 1
+    suffix = 0
+    while (suffix < max_common - prefix
+           and base_lines[-1 - suffix] == new_lines[-1 - suffix]):
+        suffix += 1
+
+    delta: LineDelta = []
+    if prefix:
+        delta.append([0, prefix])
+    base_middle = base_lines[prefix:len(base_lines) - suffix]
+    new_middle = new_lines[prefix:len(new_lines) - suffix]
+    matcher = SequenceMatcher(None, base_middle, new_middle)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            delta.append([prefix + i1, prefix + i2])
+        elif j2 > j1:
+            delta.append("".join(new_middle[j1:j2]))
+    if suffix:
+        delta.append([len(base_lines) - suffix, len(base_lines)])
+    return delta
+
+
+def apply_line_delta(base: str, delta: LineDelta) -> str:
+    base_lines = base.splitlines(keepends=True)
+    return "".join(op if isinstance(op, str) else "".join(base_lines[op[0]:op[1]])
+                   for op in delta)
+
+
+# An edit is a ("delete", i, j), ("insert", i, j) or ("replace", i, j) tuple,
+# i and j being the positions in the first and second sequence
+Edit = Tuple[str, int, int]
+
+
+def sequence_edits(a: Sequence[Hashable], b: Sequence[Hashable], max_edits: int) -> Optional[List[Edit]]:
+    """Shortest list of edits turning `a` into `b`, using Myers' O((N+M)D) diff
+    algorithm, D being the number of insertions and deletions. Deletions
+    followed by insertions at the same place are paired as replacements.
+    Returns None if more than `max_edits` insertions and deletions are needed."""
+    n, m = len(a), len(b)
+    # furthest x reached on each diagonal k (y = x - k), saved at each step
+    v = {1: 0}
+    trace = []
+    for d in range(min(n + m, max_edits) + 1):
+        trace.append(v.copy())
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return _pair_replacements(_backtrack_edits(trace, n, m))
+    return None
+
+
+def _backtrack_edits(trace: List[Dict[int, int]], x: int, y: int) -> List[Edit]:
+    edits = []
+    for d in range(len(trace) - 1, 0, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        if prev_k == k + 1:
+            # moving down: b[prev_y] is inserted
+            edits.append(("insert", prev_x, prev_y))
+        else:
+            # moving right: a[prev_x] is deleted
+            edits.append(("delete", prev_x, prev_y))
+        x, y = prev_x, prev_y
+    edits.reverse()
+    return edits
+
+
+def _pair_replacements(edits: List[Edit]) -> List[Edit]:
+    paired = []
+    i = 0
+    while i < len(edits):
+        if edits[i][0] == "insert":
+            paired.append(edits[i])
+            i += 1
+            continue
+        # a run of deletions, directly followed by insertions at the same place
+        j = i
+        while j < len(edits) and edits[j][0] == "delete" and edits[j][2] == edits[i][2]:
+            j += 1
+        deletions = edits[i:j]
+        k = j
+        while (k < len(edits) and edits[k][0] == "insert" and deletions
+               and edits[k][1] == deletions[-1][1] + 1):
+            k += 1
+        insertions = edits[j:k]
+        for (_, del_i, _), (_, _, ins_j) in zip(deletions, insertions):
+            paired.append(("replace", del_i, ins_j))
+        paired.extend(deletions[len(insertions):])
+        paired.extend(insertions[len(deletions):])
+        i = k
+    return paired
+
+
 def textfile_decode(file_content: bytes):
-    try:
-        return file_content.decode("utf-8")
-    except UnicodeDecodeError:
-        # attempting at decoding using utf-16be
-        textgrid_content = file_content.decode("utf-16be")
-        # stripping it of that useless byte-order mark thing
-        return textgrid_content.strip("\ufeff")
+    # the encoding is sniffed from the byte-order mark (if there's one)
+    return decode_textgrid(file_content)
 
 
 def log_tgcheck_error(error: Exception, textgrid: bytes):
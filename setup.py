@@ -46,9 +46,12 @@ setup(
             'add-annotator = seshat.cli_apps.add_annotator:main',
             'delete-annotator = seshat.cli_apps.delete_annotator:main',
             'campaign-gamma = seshat.cli_apps.campaign_gamma:main',
+            'gamma-worker = seshat.cli_apps.gamma_worker:main',
             'assign-task = seshat.cli_apps.assign_task:main',
             'list-tasks = seshat.cli_apps.list_tasks:main',
             'list-campaigns = seshat.cli_apps.list_campaigns:main',
+            'migrate-textgrids = seshat.cli_apps.migrate_textgrids:main',
+            'collect-blobs = seshat.cli_apps.collect_blobs:main',
         ]
     }
 )
@@ -0,0 +1,63 @@
+import itertools
+from types import SimpleNamespace
+from typing import Optional, Type
+
+import mongomock.gridfs
+import pytest
+from mongoengine import connect
+
+from seshat.models import Campaign, Annotator, Admin, User, SingleAnnotatorTask, DoubleAnnotatorTask, FolderCorpus
+from seshat.models.tg_checking import TextGridCheckingScheme
+
+# lets the textgrids be stored in (mongomock's) GridFS
+mongomock.gridfs.enable_gridfs_integration()
+connect('mongoenginetest', host='mongomock://localhost')
+
+
+def save_user(user_class: Type[User], username: str) -> User:
+    user = user_class(username=username, email="%s@seshat.test" % username,
+                      salted_password_hash="", salt="", first_name="a", last_name="a")
+    user.save(validate=False)
+    return user
+
+
+@pytest.fixture
+def campaign_factory(request):
+    """Builds campaigns, along with their admin, corpus, single annotator
+    tasks (each with its own annotator) and double annotator tasks (each with
+    its own reference and target annotators). Their names are derived from
+    the test's name, so that each test has its own documents."""
+    counter = itertools.count()
+
+    def build(checking_scheme: Optional[TextGridCheckingScheme] = None,
+              tasks_count: int = 1, start_tasks: bool = False,
+              double_tasks_count: int = 0) -> SimpleNamespace:
+        prefix = "%s_%i" % (request.node.name, next(counter))
+        admin = save_user(Admin, prefix + "_admin")
+        corpus = FolderCorpus(name=prefix + "_corpus")
+        corpus.save()
+        campaign = Campaign(name=prefix, slug=prefix, creator=admin, corpus=corpus,
+                            checking_scheme=checking_scheme)
+        campaign.save(validate=False)
+        annotators, tasks = [], []
+        for i in range(tasks_count):
+            annotator = save_user(Annotator, "%s_annotator_%i" % (prefix, i))
+            task = SingleAnnotatorTask(campaign=campaign, annotator=annotator,
+                                       assigner=admin, data_file="file_%i.wav" % i)
+            task.save(validate=False)
+            if start_tasks:
+                task.log_download(annotator, "file_%i.zip" % i)
+            annotators.append(annotator)
+            tasks.append(task)
+        double_tasks = []
+        for i in range(double_tasks_count):
+            reference, target = (save_user(Annotator, "%s_%s_%i" % (prefix, role, i))
+                                 for role in ("reference", "target"))
+            task = DoubleAnnotatorTask(campaign=campaign, reference=reference, target=target,
+                                       assigner=admin, data_file="double_file_%i.wav" % i)
+            task.save(validate=False)
+            double_tasks.append(task)
+        return SimpleNamespace(admin=admin, campaign=campaign, annotators=annotators, tasks=tasks,
+                               double_tasks=double_tasks)
+
+    return build
@@ -0,0 +1,54 @@
+import os
+
+from mongoengine import connect
+from textgrid import TextGrid, IntervalTier
+
+from seshat.models import blobs
+from seshat.models.blobs import BlobRef, LocalBlobStore
+from seshat.models.textgrids import SingleAnnotatorTextGrid
+
+connect('mongoenginetest', host='mongomock://localhost')
+
+
+def build_textgrid(mark: str) -> TextGrid:
+    tg = TextGrid(maxTime=10)
+    tier = IntervalTier("A", minTime=0, maxTime=10)
+    tier.add(0, 10, mark)
+    tg.append(tier)
+    return tg
+
+
+def test_blobs_lifecycle(tmp_path):
+    blobs.blob_store = store = LocalBlobStore(tmp_path)
+    try:
+        # blobs are only written once their document is saved
+        unsaved_doc = SingleAnnotatorTextGrid.from_textgrid(build_textgrid("unsaved"), [], None)
+        assert not store.exists(unsaved_doc.textgrid_hash)
+        assert unsaved_doc.to_str() == unsaved_doc.payload.decode("utf-8")
+
+        doc = SingleAnnotatorTextGrid.from_textgrid(build_textgrid("saved"), [], None)
+        doc.save()
+        assert store.exists(doc.textgrid_hash)
+        assert BlobRef.objects.get(digest=doc.textgrid_hash).refcount == 1
+        first_hash = doc.textgrid_hash
+
+        # the reference moves to the new payload once the document is saved again
+        doc.textgrid = build_textgrid("updated")
+        doc.save()
+        assert BlobRef.objects.get(digest=first_hash).refcount == 0
+        assert BlobRef.objects.get(digest=doc.textgrid_hash).refcount == 1
+        reloaded = SingleAnnotatorTextGrid.objects.get(id=doc.id)
+        assert bytes(reloaded.payload) == doc.payload
+
+        # an orphan blob (its document's save failed), older than the grace period
+        orphan_hash = store.put(b"orphan")
+        os.utime(str(store.path(orphan_hash)), (0, 0))
+        assert store.collect_garbage(grace_period=60) == 2
+        assert not store.exists(first_hash) and not store.exists(orphan_hash)
+        assert store.exists(doc.textgrid_hash)
+
+        reloaded.delete()
+        assert store.collect_garbage(grace_period=60) == 1
+        assert not store.exists(doc.textgrid_hash)
+    finally:
+        blobs.blob_store = None
@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+from flask_smorest import Api
+from mongoengine import connect
+from textgrid import TextGrid, IntervalTier
+
+from seshat.configs import BaseConfig
+from seshat.handlers import tasks_blp
+from seshat.models.tg_checking import TextGridCheckingScheme
+from seshat.utils import tg_to_str
+
+connect('mongoenginetest', host='mongomock://localhost')
+
+THREADS = 8
+REQUESTS_PER_THREAD = 5
+
+
+class TestConfig(BaseConfig):
+    SECRET_KEY = "test"
+    TESTING = True
+
+
+def build_app() -> Flask:
+    app = Flask("test")
+    app.config.from_object(TestConfig)
+    api = Api(app)
+    api.register_blueprint(tasks_blp)
+    return app
+
+
+def build_textgrid(invalid_count: int) -> str:
+    """Textgrid with `invalid_count` invalid annotations"""
+    tg = TextGrid(maxTime=20)
+    tier = IntervalTier("A", minTime=0, maxTime=20)
+    for i in range(20):
+        tier.add(i, i + 1, "b" if i < invalid_count else "a")
+    tg.append(tier)
+    return tg_to_str(tg)
+
+
+def test_concurrent_validations(campaign_factory):
+    scheme = TextGridCheckingScheme.from_tierspecs_schema(
+        [{"name": "A", "required": True, "allow_empty": False,
+          "checking_type": "CATEGORICAL", "categories": ["a"]}],
+        "concurrency scheme")
+    scheme.save()
+    setup = campaign_factory(scheme, tasks_count=THREADS)
+    tasks = setup.tasks
+
+    app = build_app()
+    tokens = []
+    for annotator in setup.annotators:
+        with app.app_context():
+            tokens.append(annotator.get_token())
+
+    def hammer(thread_idx: int):
+        client = app.test_client()
+        # each thread submits textgrids with its own number of errors
+        textgrid = build_textgrid(thread_idx)
+        for _ in range(REQUESTS_PER_THREAD):
+            response = client.post("/tasks/validate/%s" % tasks[thread_idx].id,
+                                   json={"textgrid_str": textgrid},
+                                   headers={"Auth-token": tokens[thread_idx]})
+            assert response.status_code == 200
+            errors = response.get_json()
+            assert errors["has_errors"] == bool(thread_idx)
+            assert len(errors["annot"].get("A", [])) == thread_idx
+
+    with ThreadPoolExecutor(THREADS) as executor:
+        for future in [executor.submit(hammer, i) for i in range(THREADS)]:
+            future.result()
@@ -0,0 +1,95 @@
+import time
+from datetime import datetime, timedelta
+
+from mongoengine import connect
+
+from seshat.models.jobs import GammaJob
+
+connect('mongoenginetest', host='mongomock://localhost')
+
+
+def test_gamma_jobs_queue(campaign_factory):
+    campaign = campaign_factory(tasks_count=0).campaign
+    campaign.update_stats()
+
+    # requests made while the job is pending share that job
+    job = campaign.launch_gamma_update()
+    assert campaign.launch_gamma_update().id == job.id
+    assert GammaJob.objects(campaign=campaign).count() == 1
+    assert campaign.stats.gamma_updating
+
+    claimed = GammaJob.claim("node_a:1")
+    assert claimed.id == job.id
+    assert claimed.status == GammaJob.RUNNING and claimed.attempts == 1
+    assert GammaJob.claim("node_b:1") is None
+
+    # a new request, once the job is running, gets its own job
+    next_job = GammaJob.enqueue(campaign)
+    assert next_job.id != job.id
+    assert GammaJob.claim("node_b:1").id == next_job.id
+    assert next_job.beat("node_b:1")
+    next_job.finish("node_b:1")
+
+    # the running job's worker stopped responding: another worker takes over
+    stale_date = datetime.now() - timedelta(seconds=GammaJob.STALE_AFTER + 1)
+    GammaJob.objects(id=job.id).update_one(set__heartbeat=stale_date)
+    reclaimed = GammaJob.claim("node_b:1")
+    assert reclaimed.id == job.id and reclaimed.attempts == 2
+    assert not job.beat("node_a:1")
+    job.finish("node_a:1", error="too late")
+    reclaimed.finish("node_b:1")
+
+    job.reload()
+    assert job.status == GammaJob.DONE and job.error is None
+    campaign.reload()
+    assert not campaign.stats.gamma_updating
+    assert campaign.status["stats"]["gamma_job"]["status"] == GammaJob.DONE
+
+
+def test_gamma_worker_config(monkeypatch, capsys):
+    from seshat.cli_apps import gamma_worker
+    from seshat.configs import get_config, DevConfig
+
+    assert gamma_worker.argparser.parse_args(["--config", "dev"]).config is DevConfig
+    # the worker runs with the default config, on the tests' db
+    set_up_configs = []
+    monkeypatch.setattr(gamma_worker, "set_up_db", set_up_configs.append)
+    monkeypatch.setattr("sys.argv", ["gamma-worker", "--once"])
+    gamma_worker.main()
+    assert set_up_configs == [get_config()]
+    assert "started" in capsys.readouterr().out
+
+
+def test_gamma_job_process(monkeypatch, campaign_factory):
+    from seshat.cli_apps.gamma_worker import JobProcess
+
+    job = GammaJob.enqueue(campaign_factory(tasks_count=0).campaign)
+    # a computation whose process dies is reported as failed
+    crashed = JobProcess(job, "unknown config")
+    while not crashed.is_done:
+        time.sleep(0.1)
+    assert crashed.error() == "The computation's process exited with code 1"
+
+    # computations that don't finish in time are killed
+    monkeypatch.setattr(GammaJob, "TIMEOUT", 0)
+    overdue = JobProcess(job, "dev")
+    assert overdue.is_overdue
+    overdue.kill()
+    assert not overdue.process.is_alive()
+    job.delete()
+
+
+def test_gamma_job_taken_over(monkeypatch, campaign_factory):
+    from seshat.cli_apps.gamma_worker import JobProcess, poll_running_jobs
+
+    job = GammaJob.enqueue(campaign_factory(tasks_count=0).campaign)
+    job_process = JobProcess(job, "dev")
+    running = [job_process]
+    # the job's heartbeat fails once another worker has taken it over: its
+    # computation is killed, and the job is left to the other worker
+    monkeypatch.setattr(GammaJob, "beat", lambda self, worker: False)
+    poll_running_jobs(running, "node_a:1")
+    assert not running
+    assert not job_process.process.is_alive()
+    assert GammaJob.objects.get(id=job.id).finish_time is None
+    job.delete()
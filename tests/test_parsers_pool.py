@@ -0,0 +1,67 @@
+import sys
+import time
+
+import pytest
+
+from seshat.parsers import ParsersRegistry
+from seshat.parsers.base import ParserFailure
+from seshat.parsers.pool import ParsersPool
+
+POOL_PARSERS = '''import os
+import time
+
+from seshat.parsers.base import BaseCustomParser, AnnotationError
+
+
+class DigitsParser(BaseCustomParser):
+
+    def check_annotation(self, annot: str):
+        if annot == "crash":
+            os._exit(1)
+        if annot == "slow":
+            time.sleep(10)
+        if not annot.isdigit():
+            raise AnnotationError("%s isn't a number" % annot)
+'''
+
+
+@pytest.fixture(scope="module")
+def pool_registry(tmp_path_factory):
+    parsers_dir = tmp_path_factory.mktemp("parsers")
+    (parsers_dir / "seshat_parser_pooltest").mkdir()
+    (parsers_dir / "seshat_parser_pooltest" / "__init__.py").write_text(POOL_PARSERS)
+    # the pool's workers are spawned with this process' import path
+    sys.path.insert(0, str(parsers_dir))
+    registry = ParsersRegistry()
+    registry.pool = ParsersPool(workers=1, call_timeout=1.0, batch_size=2, max_restarts=2)
+    yield registry
+    sys.path.remove(str(parsers_dir))
+    registry.pool.restart()
+
+
+def test_pooled_parser(pool_registry):
+    parser = pool_registry.get_parser("seshat_parser_pooltest", "DigitsParser")
+    annots = ["1", "a", "22", "b", "a", "333"]
+    assert parser.check_annotations(annots) == [(1, "a isn't a number"), (3, "b isn't a number"),
+                                                (4, "a isn't a number")]
+    assert parser.get_verdict("c") == "c isn't a number"
+    # verdicts are memoized in this process
+    assert parser.check_annotations(["22", "a"]) == [(1, "a isn't a number")]
+    assert parser.verdicts_cache.hits == 2
+
+
+def test_pool_failures(pool_registry):
+    parser = pool_registry.get_parser("seshat_parser_pooltest", "DigitsParser")
+    start = time.monotonic()
+    with pytest.raises(ParserFailure):
+        parser.check_annotations(["slow"])
+    assert time.monotonic() - start < 5
+    with pytest.raises(ParserFailure):
+        parser.check_annotations(["crash"])
+    # the worker was restarted
+    assert parser.check_annotations(["4", "d"]) == [(1, "d isn't a number")]
+    # ... but not more than twice
+    with pytest.raises(ParserFailure):
+        parser.check_annotations(["crash"])
+    with pytest.raises(ParserFailure, match="disabled"):
+        parser.check_annotations(["5"])
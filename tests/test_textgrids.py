@@ -0,0 +1,142 @@
+import zlib
+
+import pytest
+from mongoengine import connect
+from textgrid import TextGrid, IntervalTier
+
+from seshat.models import textgrids
+from seshat.models.textgrids import SingleAnnotatorTextGrid, textgrid_cache
+from seshat.utils import tg_to_str
+
+connect('mongoenginetest', host='mongomock://localhost')
+
+
+def build_textgrid(marks) -> TextGrid:
+    tg = TextGrid(maxTime=len(marks))
+    tier = IntervalTier("A", minTime=0, maxTime=len(marks))
+    for i, mark in enumerate(marks):
+        tier.add(i, i + 1, mark)
+    tg.append(tier)
+    return tg
+
+
+def counting_parser(monkeypatch) -> list:
+    """Counts (in the returned list) the textgrids parsed by the documents"""
+    parsed = []
+    parse_compact_textgrid = textgrids.parse_compact_textgrid
+
+    def counting_parse(payload):
+        parsed.append(payload)
+        return parse_compact_textgrid(payload)
+
+    monkeypatch.setattr(textgrids, "parse_compact_textgrid", counting_parse)
+    return parsed
+
+
+def test_textgrid_cache(monkeypatch):
+    parsed = counting_parser(monkeypatch)
+    textgrid = tg_to_str(build_textgrid(["cached", "textgrid"]))
+    doc = SingleAnnotatorTextGrid.from_textgrid(textgrid, [], None)
+    doc.save()
+    assert doc.textgrid.getNames() == ["A"]
+    # other documents holding the same file (as the same upload, once reloaded,
+    # or its next upload) don't parse it again
+    reloaded = SingleAnnotatorTextGrid.objects.get(id=doc.id)
+    assert reloaded.textgrid is doc.textgrid
+    assert SingleAnnotatorTextGrid.from_textgrid(textgrid, [], None).textgrid is doc.textgrid
+    assert len(parsed) == 1
+
+    # neither do the uploads of textgrids built by the server (e.g., merged ones)
+    built_doc = SingleAnnotatorTextGrid.from_textgrid(build_textgrid(["built"]), [], None)
+    uploaded_doc = SingleAnnotatorTextGrid.from_textgrid(built_doc.to_str(), [], None)
+    assert uploaded_doc.textgrid is built_doc.textgrid
+    assert len(parsed) == 1
+
+
+def test_textgrid_cache_eviction(monkeypatch):
+    parsed = counting_parser(monkeypatch)
+    first, second = (tg_to_str(build_textgrid([mark] * 10)) for mark in ("first", "other"))
+    first_size = SingleAnnotatorTextGrid.from_textgrid(first, [], None).textgrid.nbytes
+    # the cache only holds one of those textgrids
+    monkeypatch.setattr(textgrid_cache, "max_size", first_size * 3 // 2)
+    SingleAnnotatorTextGrid.from_textgrid(second, [], None).textgrid
+    assert len(parsed) == 2
+
+    SingleAnnotatorTextGrid.from_textgrid(second, [], None).textgrid
+    assert len(parsed) == 2
+    SingleAnnotatorTextGrid.from_textgrid(first, [], None).textgrid
+    assert len(parsed) == 3
+    assert textgrid_cache.size <= textgrid_cache.max_size
+
+
+def test_payload_storage(monkeypatch):
+    from seshat.cli_apps.migrate_textgrids import migrate_documents
+
+    small, large = (tg_to_str(build_textgrid(["stored"] * count)).encode("utf-8")
+                    for count in (1, 100))
+    monkeypatch.setattr(SingleAnnotatorTextGrid, "INLINE_MAX_SIZE", len(small))
+    inline_doc = SingleAnnotatorTextGrid.from_textgrid(small, [], None)
+    gridfs_doc = SingleAnnotatorTextGrid.from_textgrid(large, [], None)
+    inline_doc.save()
+    gridfs_doc.save()
+    # small textgrids are stored compressed in their document, the others in GridFS
+    assert inline_doc.textgrid_inline == zlib.compress(small) and not inline_doc.textgrid_file
+    assert gridfs_doc.textgrid_inline is None and gridfs_doc.textgrid_file
+    for doc, payload in ((inline_doc, small), (gridfs_doc, large)):
+        reloaded = SingleAnnotatorTextGrid.objects.get(id=doc.id)
+        assert bytes(reloaded.payload) == payload and reloaded.payload_size == len(payload)
+
+    # the migration moves the textgrids (up to its size limit) out of GridFS, only once
+    monkeypatch.setattr(SingleAnnotatorTextGrid, "INLINE_MAX_SIZE", 0)
+    moved_doc = SingleAnnotatorTextGrid.from_textgrid(small, [], None)
+    moved_doc.save()
+    assert moved_doc.textgrid_file
+    moved, skipped = migrate_documents(SingleAnnotatorTextGrid, len(small), batch_size=1)
+    assert moved >= 1 and skipped >= 1
+    assert migrate_documents(SingleAnnotatorTextGrid, len(small), batch_size=1) == (0, skipped)
+    moved_doc = SingleAnnotatorTextGrid.objects.get(id=moved_doc.id)
+    assert zlib.decompress(moved_doc.textgrid_inline) == small and not moved_doc.textgrid_file
+    assert bytes(moved_doc.payload) == small
+    assert SingleAnnotatorTextGrid.objects.get(id=gridfs_doc.id).textgrid_file
+
+
+def test_logged_uploads(monkeypatch, campaign_factory):
+    from mongoengine import OperationError
+    from seshat.models.textgrids import LoggedTextGrid
+
+    setup = campaign_factory()
+    task, annotator = setup.tasks[0], setup.annotators[0]
+    marks = ["mark_%i" % i for i in range(50)]
+    versions, logged_ids = [], []
+    rebuilds = []
+    apply_line_delta = textgrids.apply_line_delta
+    monkeypatch.setattr(textgrids, "apply_line_delta",
+                        lambda base, delta: rebuilds.append(delta) or apply_line_delta(base, delta))
+    for i in range(LoggedTextGrid.KEYFRAME_INTERVAL + 2):
+        marks[i] = "fixed_%i" % i
+        versions.append(tg_to_str(build_textgrid(marks)))
+        logged_tg = LoggedTextGrid.from_upload(versions[-1], annotator, task)
+        logged_tg.save()
+        logged_ids.append(logged_tg.id)
+    # the uploads' deltas were computed without rebuilding their predecessors
+    assert not rebuilds
+
+    logged_tgs = [LoggedTextGrid.objects.get(id=logged_id) for logged_id in logged_ids]
+    # a keyframe is stored every KEYFRAME_INTERVAL uploads
+    assert [logged_tg.delta_depth for logged_tg in logged_tgs] == \
+           list(range(LoggedTextGrid.KEYFRAME_INTERVAL)) + [0, 1]
+    assert [logged_tg.delta is None for logged_tg in logged_tgs] == \
+           [True] + [False] * (LoggedTextGrid.KEYFRAME_INTERVAL - 1) + [True, False]
+    # each version is rebuilt from its keyframe, once evicted from the cache
+    textgrid_cache.clear()
+    for logged_tg, version in zip(logged_tgs, versions):
+        assert logged_tg.to_str() == version
+        assert logged_tg.payload.decode("utf-8") == version
+    assert len(rebuilds) == LoggedTextGrid.KEYFRAME_INTERVAL
+
+    # versions that others are stored against can't be deleted
+    with pytest.raises(OperationError):
+        logged_tgs[3].delete()
+    logged_tgs[-1].delete()
+    textgrid_cache.clear()
+    assert LoggedTextGrid.objects.get(id=logged_ids[4]).to_str() == versions[4]
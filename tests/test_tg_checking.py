@@ -1,5 +1,14 @@
-from seshat.models.tg_checking import error_log
-from seshat.models.textgrids import SingleAnnotatorTextGrid
+import sys
+
+import pytest
+
+from seshat.models.errors import ErrorsBudget
+from seshat.models.tg_checking import error_log, TierScheme, TextGridCheckingScheme
+from seshat.parsers import reload_parsers, parsers_registry
+from seshat.parsers.base import BaseCustomParser, AnnotationError, CategoricalChecker
+from seshat.tg_compact import CompactTier, CompactTextGrid
+from seshat.utils import tg_to_str
+from seshat.models.textgrids import SingleAnnotatorTextGrid, MergedAnnotsTextGrid, check_tiers_pair_matching
 from textgrid import TextGrid, IntervalTier
 from mongoengine import connect
 
@@ -16,4 +25,462 @@ def test_tier_duplication():
 
 
 def test_missing_tier():
-    pass
\ No newline at end of file
+    pass
+
+class CountingParser(BaseCustomParser):
+
+    def __init__(self):
+        self.calls = 0
+
+    def check_annotation(self, annot: str):
+        self.calls += 1
+        if annot != "ok":
+            raise AnnotationError("not ok")
+
+
+def test_verdicts_cache():
+    tier = CompactTier.from_lists("A", 0, 6, [0, 1, 2, 3, 4, 5], [1, 2, 3, 4, 5, 6],
+                                  ["ok", "ko", "ok", "ko", "", "ok"])
+    for cache_verdicts, expected_calls in ((True, 2), (False, 4)):
+        parser = CountingParser()
+        parser.CACHE_VERDICTS = cache_verdicts
+        tier_scheme = TierScheme(name="A", allow_empty=False)
+        tier_scheme.parser = parser
+        for _ in range(2):
+            error_log.flush()
+            tier_scheme.check_tier(tier)
+            assert [error.annot_idx for error in error_log.annot["A"]] == [1, 3, 4]
+        assert parser.calls == expected_calls
+
+
+def test_batch_check_matches_single_check():
+    annots = ["a", " b", "c", "", "a ", "d"]
+    for checker in (CategoricalChecker(["a", "b"]), CountingParser()):
+        expected = []
+        for i, annot in enumerate(annots):
+            try:
+                checker.check_annotation(annot)
+            except AnnotationError as e:
+                expected.append((i, str(e)))
+        assert checker.check_annotations(annots) == expected
+
+
+def test_parallel_checking():
+    scheme = TextGridCheckingScheme.from_tierspecs_schema(
+        [{"name": name, "required": True, "allow_empty": False,
+          "checking_type": "CATEGORICAL", "categories": ["a", "b"]} for name in "ABC"]
+        + [{"name": "D", "required": True, "allow_empty": False, "checking_type": "NONE"}],
+        "parallel scheme")
+    tg = CompactTextGrid(maxTime=100)
+    for tier_idx, name in enumerate("ABCD"):
+        marks = [["a", "b", "", "c"][(i * (tier_idx + 1)) % 4] for i in range(100)]
+        tg.append(CompactTier.from_lists(name, 0, 100, list(range(100)), list(range(1, 101)), marks))
+    tg_doc = SingleAnnotatorTextGrid.from_textgrid(tg, [], None)
+    tg_doc.checking_scheme = scheme
+    scheme.parallel_min_annotations = 0
+
+    summaries = []
+    for parallel_checking in (None, "thread", "process"):
+        scheme.parallel_checking = parallel_checking
+        error_log.flush()
+        tg_doc.check()
+        summary = error_log.to_errors_summary()
+        summaries.append((summary, list(summary["annot"])))
+    assert list(summaries[0][0]["annot"]) == ["A", "B", "C"]
+    assert summaries[0] == summaries[1] == summaries[2]
+
+
+def test_streaming_check():
+    scheme = TextGridCheckingScheme.from_tierspecs_schema(
+        [{"name": name, "required": True, "allow_empty": False,
+          "checking_type": "CATEGORICAL", "categories": ["a", "b"]} for name in "AB"],
+        "streaming scheme")
+    tg = CompactTextGrid(maxTime=20)
+    for name in "ABC":
+        tg.append(CompactTier.from_lists(name, 0, 20, list(range(20)), list(range(1, 21)),
+                                         ["a", "c", ""] * 6 + ["b", "b"]))
+    summaries = []
+    for streaming_min_size in (None, 0):
+        tg_doc = SingleAnnotatorTextGrid.from_textgrid(tg_to_str(tg).encode("utf-8"), [], None)
+        tg_doc.checking_scheme = scheme
+        if streaming_min_size is not None:
+            tg_doc.STREAMING_CHECK_MIN_SIZE = streaming_min_size
+            assert tg_doc.is_streamed
+        error_log.flush()
+        tg_doc.check()
+        summaries.append(error_log.to_errors_summary())
+    expected, streamed = summaries
+    assert streamed == expected
+    assert list(expected["annot"]) == ["A", "B"]
+    # merged textgrids are never checked while streaming them
+    merged_doc = MergedAnnotsTextGrid.from_textgrid(tg_to_str(tg).encode("utf-8"), [], None)
+    merged_doc.STREAMING_CHECK_MIN_SIZE = 0
+    assert not merged_doc.is_streamed
+
+
+def test_check_plan_invalidation():
+    scheme = TextGridCheckingScheme.from_tierspecs_schema(
+        [{"name": "A", "required": True, "allow_empty": False, "checking_type": "NONE"},
+         {"name": "B", "required": False, "allow_empty": True, "checking_type": "NONE"}],
+        "plan scheme")
+    scheme.save()
+    plan = scheme.check_plan
+    assert plan.tiers_names == ("A", "B")
+    assert plan.required_tiers == {"A"}
+    # other instances of the same scheme share its plan
+    assert TextGridCheckingScheme.objects.get(id=scheme.id).check_plan is plan
+    suffixed_plan = plan.suffixed("-top", "-bottom")
+    assert suffixed_plan is plan.suffixed("-top", "-bottom")
+    assert suffixed_plan.required_tiers["-bottom"] == {"A-bottom"}
+
+    scheme.tiers_specs["B"].required = True
+    scheme.save()
+    assert scheme.version == 1
+    assert scheme.check_plan.required_tiers == {"A", "B"}
+    assert TextGridCheckingScheme.objects.get(id=scheme.id).check_plan is scheme.check_plan
+
+
+RELOADED_PARSERS = '''from seshat.parsers.base import BaseCustomParser, AnnotationError
+
+
+class VersionParser(BaseCustomParser):
+
+    def check_annotation(self, annot: str):
+        if annot != "%s":
+            raise AnnotationError("%s only")
+
+
+class VolatileParser(VersionParser):
+    CACHE_VERDICTS = False
+'''
+
+
+@pytest.fixture
+def install_parsers(tmp_path):
+    """Installs (or upgrades) the `seshat_parser_reloadtest` parsers package,
+    whose parsers only accept that version, and reloads the parsers"""
+    package_dir = tmp_path / "seshat_parser_reloadtest"
+    package_dir.mkdir()
+    sys.path.insert(0, str(tmp_path))
+
+    def install(version: str, message: str):
+        # messages of different sizes, so the module's cached bytecode isn't reused
+        (package_dir / "__init__.py").write_text(RELOADED_PARSERS % (version, message))
+        reload_parsers()
+
+    yield install
+    sys.path.remove(str(tmp_path))
+    reload_parsers()
+
+
+def parsed_scheme(scheme_name: str, parser_name: str = "VersionParser") -> TextGridCheckingScheme:
+    scheme = TextGridCheckingScheme.from_tierspecs_schema(
+        [{"name": "A", "required": True, "allow_empty": True, "checking_type": "PARSED",
+          "parser": {"name": parser_name, "module": "seshat_parser_reloadtest"}}],
+        scheme_name)
+    scheme.save()
+    return scheme
+
+
+def test_parsers_reload(install_parsers):
+    install_parsers("v1", "v1")
+    scheme = parsed_scheme("reload scheme")
+    plan = scheme.check_plan
+    generation = parsers_registry.generation
+    assert plan.tier_schemes["A"].parser.get_verdict("v2") == "v1 only"
+
+    install_parsers("v2", "v2 (reloaded)")
+    assert parsers_registry.generation > generation
+    # the cached plan uses the reloaded parser
+    assert TextGridCheckingScheme.objects.get(id=scheme.id).check_plan is plan
+    assert plan.tier_schemes["A"].parser.get_verdict("v2") is None
+    assert plan.tier_schemes["A"].parser.get_verdict("v1") == "v2 (reloaded) only"
+
+
+def test_parsers_pinning(install_parsers, tmp_path, monkeypatch):
+    install_parsers("v1", "v1")
+    tg = CompactTextGrid(maxTime=100)
+    tg.append(CompactTier.from_lists("A", 0, 100, list(range(100)), list(range(1, 101)), ["v1", "v2"] * 50))
+    tg_doc = SingleAnnotatorTextGrid.from_textgrid(tg, [], None)
+    tg_doc.checking_scheme = parsed_scheme("pinned scheme")
+
+    stamp_reads = []
+    read_stamp = parsers_registry._read_stamp
+    monkeypatch.setattr(parsers_registry, "reload_stamp", tmp_path / "parsers.reload")
+    monkeypatch.setattr(parsers_registry, "_read_stamp", lambda: stamp_reads.append(1) or read_stamp())
+    error_log.flush()
+    tg_doc.check()
+    # the reload stamp is only checked once for the whole check
+    assert len(stamp_reads) == 1
+    assert error_log.to_errors_summary()["annot"]["A"][0]["msg"] == "v1 only"
+    parsers_registry.parser_fingerprint("seshat_parser_reloadtest", "VersionParser")
+    assert len(stamp_reads) == 2
+
+
+def test_errors_budget():
+    scheme = TextGridCheckingScheme.from_tierspecs_schema(
+        [{"name": name, "required": True, "allow_empty": True,
+          "checking_type": "CATEGORICAL", "categories": ["a"]} for name in "ABCE"],
+        "budget scheme")
+    tg = CompactTextGrid(maxTime=100)
+    for name in "ABC":
+        # each tier has 50 invalid annotations
+        marks = ["a" if i % 2 else "b" for i in range(100)]
+        tg.append(CompactTier.from_lists(name, 0, 100, list(range(100)), list(range(1, 101)), marks))
+    tg_doc = SingleAnnotatorTextGrid.from_textgrid(tg, [], None)
+    tg_doc.checking_scheme = scheme
+    scheme.parallel_min_annotations = 0
+
+    for parallel_checking in (None, "thread"):
+        scheme.parallel_checking = parallel_checking
+        with error_log.scope(ErrorsBudget(max_tier_errors=3)):
+            tg_doc.check()
+            summary = error_log.to_errors_summary()
+        assert summary["truncated"]
+        assert summary["annot_counts"] == {"A": 50, "B": 50, "C": 50}
+        assert [error["index"] for error in summary["annot"]["B"]] == [0, 2, 4]
+
+        with error_log.scope(ErrorsBudget(max_errors=60)):
+            tg_doc.check()
+            summary = error_log.to_errors_summary()
+        # the missing "E" tier is reported, and the checks stop in the second tier
+        assert summary["truncated"]
+        assert len(summary["structural"]) == 1
+        assert len(summary["annot"]["A"]) == 50
+        assert len(summary["annot"]["B"]) == 9
+        assert "C" not in summary["annot"]
+
+        with error_log.scope(ErrorsBudget(fail_fast=True)):
+            tg_doc.check()
+            summary = error_log.to_errors_summary()
+        assert summary["truncated"] and summary["has_errors"]
+        assert len(summary["structural"]) == 1
+        assert summary["annot"] == {}
+
+
+def test_mismatches_report():
+    ref_marks = list("abcdefghij")
+    target_marks = list("abXdefhijk")
+    ref_tier = CompactTier.from_lists("A-ref", 0, 10, list(range(10)), list(range(1, 11)), ref_marks)
+    target_tier = CompactTier.from_lists("A-target", 0, 10, list(range(10)), list(range(1, 11)), target_marks)
+    with error_log.scope():
+        check_tiers_pair_matching(ref_tier, target_tier)
+        mismatches = error_log.to_errors_summary()["annot_mismatch"]
+    assert [(m["kind"], m["index"], m["target_index"], m["ref_annot"], m["target_annot"]) for m in mismatches] == [
+        ("substitution", 2, 2, "c", "X"),
+        ("deletion", 6, 6, "g", None),
+        ("insertion", 10, 9, None, "k")]
+
+
+def test_incremental_check(monkeypatch, campaign_factory):
+    from seshat.models.tasks import SingleAnnotatorTask
+    from seshat.models.textgrids import LoggedTextGrid
+    from seshat.models.tg_checking import CategoricalTier
+
+    scheme = TextGridCheckingScheme.from_tierspecs_schema(
+        [{"name": name, "required": True, "allow_empty": False,
+          "checking_type": "CATEGORICAL", "categories": ["a"]} for name in "AB"],
+        "incremental scheme")
+    scheme.save()
+    # the annotator has started the task
+    setup = campaign_factory(scheme, start_tasks=True)
+    task, annotator = setup.tasks[0], setup.annotators[0]
+
+    checked_tiers = []
+    check_tier = CategoricalTier.check_tier
+
+    def counting_check_tier(self, tier):
+        checked_tiers.append(tier.name)
+        check_tier(self, tier)
+
+    monkeypatch.setattr(CategoricalTier, "check_tier", counting_check_tier)
+
+    def validate(b_marks):
+        tg = CompactTextGrid(maxTime=3)
+        for name, marks in (("A", ["a", "b", "a"]), ("B", b_marks)):
+            tg.append(CompactTier.from_lists(name, 0, 3, [0, 1, 2], [1, 2, 3], marks))
+        checked_tiers.clear()
+        error_log.flush()
+        task.validate_textgrid(tg_to_str(tg), annotator)
+        return error_log.to_errors_summary()
+
+    first_summary = validate(["b", "a", "b"])
+    assert checked_tiers == ["A", "B"]
+    # only the changed tier is checked again, the other one's errors are reused
+    summary = validate(["a", "a", "b"])
+    assert checked_tiers == ["B"]
+    assert summary["annot"]["A"] == first_summary["annot"]["A"]
+    assert list(summary["annot"]) == ["A", "B"]
+    assert [error["index"] for error in summary["annot"]["B"]] == [2]
+    logged_tg = LoggedTextGrid.objects(task=task).order_by("-creation_time").first()
+    assert set(logged_tg.tiers_checks) == {"A", "B"}
+    assert logged_tg.tiers_checks["A"].errors_count == 1
+
+    # changing the checking scheme invalidates the recorded checks
+    scheme.tiers_specs["A"].categories = ["a", "b"]
+    scheme.save()
+    task = SingleAnnotatorTask.objects.get(id=task.id)
+    summary = validate(["a", "a", "b"])
+    assert checked_tiers == ["A", "B"]
+    assert "A" not in summary["annot"]
+
+
+def test_tier_checks_reuse(install_parsers):
+    from seshat.models.textgrids import TierCheck
+
+    install_parsers("v1", "v1")
+    tier = CompactTier.from_lists("A", 0, 2, [0, 1], [1, 2], ["v1", "v2"])
+    stable_scheme = parsed_scheme("stable scheme").check_plan.tier_schemes["A"]
+    volatile_scheme = parsed_scheme("volatile scheme", "VolatileParser").check_plan.tier_schemes["A"]
+    with error_log.scope(None) as check_log:
+        stable_scheme.check_tier(tier)
+
+    tier_check = TierCheck.from_log(stable_scheme, tier, check_log)
+    assert tier_check.errors_count == 1 and tier_check.matches(stable_scheme, tier)
+    # the checks of parsers whose verdicts aren't memoized are never reused
+    assert TierCheck.from_log(volatile_scheme, tier, check_log) is None
+    # ... nor the checks made by another version of the parser
+    install_parsers("v1", "v1 (upgraded)")
+    assert not tier_check.matches(stable_scheme, tier)
+    # ... nor the checks recorded before the parsers' fingerprints were
+    legacy_check = TierCheck(content_hash=tier.content_hash, errors_count=0)
+    assert not legacy_check.matches(stable_scheme, tier)
+
+
+def test_upload_checks_cache(monkeypatch, campaign_factory):
+    from seshat.models.textgrids import LoggedTextGrid
+    from seshat.models.tg_checking import CategoricalTier
+
+    scheme = TextGridCheckingScheme.from_tierspecs_schema(
+        [{"name": "A", "required": True, "allow_empty": False,
+          "checking_type": "CATEGORICAL", "categories": ["a"]}],
+        "cached scheme")
+    scheme.save()
+    setup = campaign_factory(scheme, start_tasks=True)
+    task, annotator = setup.tasks[0], setup.annotators[0]
+
+    checks_count = 0
+    check_tier = CategoricalTier.check_tier
+
+    def counting_check_tier(self, tier):
+        nonlocal checks_count
+        checks_count += 1
+        check_tier(self, tier)
+
+    monkeypatch.setattr(CategoricalTier, "check_tier", counting_check_tier)
+    tg = CompactTextGrid(maxTime=3)
+    tg.append(CompactTier.from_lists("A", 0, 3, [0, 1, 2], [1, 2, 3], ["a", "b", "b"]))
+    textgrid = tg_to_str(tg)
+
+    summaries = []
+    for upload in (task.validate_textgrid, task.submit_textgrid):
+        error_log.flush()
+        upload(textgrid, annotator)
+        summaries.append(error_log.to_errors_summary())
+    # the submitted file was already checked when it was validated
+    assert checks_count == 1
+    assert summaries[0] == summaries[1]
+    assert [error["index"] for error in summaries[1]["annot"]["A"]] == [1, 2]
+    assert not task.is_done
+    logged_tg = LoggedTextGrid.objects(task=task).order_by("-creation_time").first()
+    assert logged_tg.tiers_checks["A"].errors_count == 2
+    # the submitted file wasn't parsed either
+    validation, submission = task.file_uploads[-2:]
+    assert set(validation.timings) == {"store", "parse", "check", "log"}
+    assert set(submission.timings) == {"store", "persist", "log"}
+
+
+def test_upload_checks_cache_parsers(install_parsers, campaign_factory):
+    install_parsers("v1", "v1")
+    tg = CompactTextGrid(maxTime=2)
+    tg.append(CompactTier.from_lists("A", 0, 2, [0, 1], [1, 2], ["v1", "v2"]))
+    textgrid = tg_to_str(tg)
+
+    def uploads_stages(parser_name: str, upgrade: bool = False):
+        setup = campaign_factory(parsed_scheme(parser_name + " scheme", parser_name),
+                                 start_tasks=True)
+        task, annotator = setup.tasks[0], setup.annotators[0]
+        task.validate_textgrid(textgrid, annotator)
+        if upgrade:
+            install_parsers("v1", "v1 (upgraded)")
+        task.validate_textgrid(textgrid, annotator)
+        return [set(upload.timings) for upload in task.file_uploads[-2:]]
+
+    assert uploads_stages("VersionParser") == [{"store", "parse", "check", "log"},
+                                               {"store", "log"}]
+    # uploads checked by another version of the parser are checked again...
+    assert "check" in uploads_stages("VersionParser", upgrade=True)[1]
+    # ... as are those checked by parsers whose verdicts can't be reused
+    assert "check" in uploads_stages("VolatileParser")[1]
+
+
+def test_double_task_submissions(monkeypatch, campaign_factory):
+    from seshat.models import textgrids
+    from seshat.models.textgrids import textgrid_cache
+
+    scheme = TextGridCheckingScheme.from_tierspecs_schema(
+        [{"name": "A", "required": True, "allow_empty": False,
+          "checking_type": "CATEGORICAL", "categories": ["a", "b"]}],
+        "double scheme")
+    scheme.save()
+    setup = campaign_factory(scheme, tasks_count=0, double_tasks_count=1)
+    setup.campaign.update_stats()
+    task = setup.double_tasks[0]
+
+    parsed = []
+    parse_compact_textgrid = textgrids.parse_compact_textgrid
+    monkeypatch.setattr(textgrids, "parse_compact_textgrid",
+                        lambda payload: parsed.append(bytes(payload)) or parse_compact_textgrid(payload))
+
+    def submit(textgrid: str, annotator) -> set:
+        # (the uploaded file can't be already parsed)
+        textgrid_cache.clear()
+        parsed.clear()
+        task.submit_textgrid(textgrid, annotator)
+        assert not error_log.has_errors
+        # the uploaded file is only parsed once, from its check to its merge
+        assert parsed.count(textgrid.encode("utf-8")) == 1
+        return set(task.file_uploads[-1].timings)
+
+    def annotated_tg(frontiers):
+        tg = CompactTextGrid(maxTime=3)
+        tg.append(CompactTier.from_lists("A", 0, 3, [0] + frontiers, frontiers + [3], ["a", "b", "a"]))
+        return tg_to_str(tg)
+
+    assert submit(annotated_tg([1, 2]), task.reference) == {"store", "parse", "check", "persist", "log"}
+    assert submit(annotated_tg([1.05, 2]), task.target) == {"store", "parse", "check", "merge", "persist", "log"}
+    assert task.merged_tg is not None
+    assert submit(task.merged_tg.to_str(), task.reference) == {"store", "parse", "check", "merge", "persist", "log"}
+    assert task.merged_times_tg is not None
+    assert submit(task.merged_times_tg.to_str(), task.reference) == {"store", "parse", "check", "merge",
+                                                                     "persist", "log"}
+    assert task.is_done
+    # the final frontiers are between the reference's and the target's
+    final_ends = task.final_tg.textgrid.getFirst("A").ends
+    assert 1 < final_ends[0] < 1.05 and final_ends[1:].tolist() == [2, 3]
+
+
+def test_merge_results_storage():
+    from seshat.models.tasks.double import MergeResults, TierMerge, FrontierMerge
+
+    tier_a = CompactTier.from_lists("A", 0, 4, [0, 1, 2, 3], [1, 2, 3, 4], ["a"] * 4)
+    tier_b = CompactTier.from_lists("A", 0, 4, [0, 1.05, 2.5, 3], [1.05, 2.5, 3, 4], ["a"] * 4)
+    merged_tier, tier_merge = MergedAnnotsTextGrid.merge_tiers(tier_a, tier_b)
+    # the frontiers that could be merged are moved to their average time
+    assert merged_tier.starts.tolist() == [0, 1.025, 2, 3]
+    assert merged_tier.ends.tolist() == [1.025, 2, 3, 4]
+    assert merged_tier.marks == tier_a.marks
+    merge_results = MergeResults(tiers_merges=[tier_merge])
+    # conflicts are still there once the results are stored and loaded
+    merge_results = MergeResults._from_son(merge_results.to_mongo())
+    assert merge_results.tiers_merges[0].frontiers_count == 3
+    expected_table = [{"tier_a": "A", "tier_b": "A", "time_a": 2.0, "time_b": 2.5,
+                       "index_before": 1, "index_after": 2, "threshold": MergedAnnotsTextGrid.DIFF_THRESHOLD}]
+    assert merge_results.to_merge_table() == expected_table
+    assert [error.to_msg() for error in merge_results.to_merge_conflicts_errors()] == expected_table
+
+    # results stored before the conflicts were stored as arrays
+    legacy_merge = TierMerge(tier_a="A", tier_b="A", frontiers_merge=[
+        FrontierMerge(time_a=1.0, time_b=1.05, interval_index_before=0, interval_index_after=1, could_merge=True),
+        FrontierMerge(time_a=2.0, time_b=2.5, interval_index_before=1, interval_index_after=2, could_merge=False)])
+    assert MergeResults(tiers_merges=[legacy_merge]).to_merge_table() == expected_table
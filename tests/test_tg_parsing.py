@@ -0,0 +1,125 @@
+from io import BytesIO
+from tempfile import NamedTemporaryFile
+
+import pytest
+from textgrid import TextGrid, IntervalTier, PointTier, Interval
+
+from seshat.tg_parsing import parse_textgrid, parse_compact_textgrid, iter_textgrid_chunks, \
+    read_tier_names, iter_compact_tiers
+from seshat.utils import tg_to_str
+
+SHORT_TG = '''File type = "ooTextFile"
+Object class = "TextGrid"
+
+0
+2.5
+<exists>
+1
+"IntervalTier"
+"words"
+0
+2.5
+2
+0
+1
+"say ""hi"""
+1
+2.5
+""
+'''
+
+
+def build_textgrid() -> TextGrid:
+    tg = TextGrid(minTime=0, maxTime=10)
+    tier = IntervalTier("A", minTime=0, maxTime=10)
+    tier.add(0, 1.5, "first")
+    tier.add(1.5, 4, 'with "quotes"')
+    tier.add(4, 10, "multi\nline")
+    points = PointTier("B", minTime=0, maxTime=10)
+    points.add(2.0, "point")
+    tg.tiers = [tier, points]
+    return tg
+
+
+def assert_same_textgrids(tg_a: TextGrid, tg_b: TextGrid):
+    assert (tg_a.minTime, tg_a.maxTime) == (tg_b.minTime, tg_b.maxTime)
+    assert tg_a.getNames() == tg_b.getNames()
+    for tier_a, tier_b in zip(tg_a, tg_b):
+        assert type(tier_a) == type(tier_b)
+        assert [repr(item) for item in tier_a] == [repr(item) for item in tier_b]
+
+
+def test_long_format_matches_textgrid_lib():
+    tg_str = tg_to_str(build_textgrid())
+    with NamedTemporaryFile(mode="w") as temptg:
+        temptg.write(tg_str)
+        temptg.flush()
+        reference = TextGrid.fromFile(temptg.name)
+    assert_same_textgrids(parse_textgrid(tg_str), reference)
+
+
+def test_short_format():
+    tg = parse_textgrid(SHORT_TG)
+    assert tg.getNames() == ["words"]
+    assert [interval.mark for interval in tg.getFirst("words")] == ['say "hi"', ""]
+
+
+def test_encodings_sniffing():
+    tg_str = tg_to_str(build_textgrid())
+    reference = parse_textgrid(tg_str)
+    for encoding in ("utf-8", "utf-8-sig", "utf-16", "utf-16-be", "utf-16-le"):
+        assert_same_textgrids(parse_textgrid(tg_str.encode(encoding)), reference)
+
+
+def test_compact_textgrid():
+    tg_str = tg_to_str(build_textgrid())
+    compact_tg = parse_compact_textgrid(tg_str)
+    tier = compact_tg.getFirst("A")
+    assert tier.marks == ["first", 'with "quotes"', "multi\nline"]
+    assert repr(tier[1]) == repr(parse_textgrid(tg_str).getFirst("A")[1])
+    assert_same_textgrids(compact_tg.to_textgrid(), parse_textgrid(tg_str))
+
+
+def test_streaming():
+    tg_str = tg_to_str(build_textgrid())
+    for encoding in ("utf-8", "utf-16"):
+        tg_bytes = tg_str.encode(encoding)
+        # chunks never split a string, even a multi-line one
+        chunks = list(iter_textgrid_chunks(BytesIO(tg_bytes), chunk_size=16))
+        assert "".join(chunks) == tg_str
+        assert all(chunk.count('"') % 2 == 0 for chunk in chunks)
+
+        assert read_tier_names(BytesIO(tg_bytes)) == ["A", "B"]
+        tiers = list(iter_compact_tiers(BytesIO(tg_bytes), {"A"}))
+        assert [tier.name for tier in tiers] == ["A"]
+        assert tiers[0].marks == parse_compact_textgrid(tg_str).getFirst("A").marks
+
+
+def malformed_tg(intervals) -> str:
+    """TextGrid with a single tier spanning from 0 to 3, whose intervals are
+    written as is, without being checked"""
+    tg = TextGrid(minTime=0, maxTime=3)
+    tier = IntervalTier("A", minTime=0, maxTime=3)
+    tier.intervals = [Interval(start, end, mark) for start, end, mark in intervals]
+    tg.tiers = [tier]
+    return tg_to_str(tg)
+
+
+def test_malformed_intervals():
+    overlapping = malformed_tg([(0, 1, "a"), (0.5, 3, "b")])
+    unsorted_overlapping = malformed_tg([(1, 3, "b"), (0, 1.5, "a")])
+    too_early = malformed_tg([(-1, 1, "a"), (1, 3, "b")])
+    too_late = malformed_tg([(0, 1, "a"), (1, 4, "b")])
+    for tg_str in (overlapping, unsorted_overlapping, too_early, too_late):
+        # rejected just like the textgrid library does
+        with NamedTemporaryFile(mode="w") as temptg:
+            temptg.write(tg_str)
+            temptg.flush()
+            with pytest.raises(ValueError):
+                TextGrid.fromFile(temptg.name)
+        for parse in (parse_textgrid, parse_compact_textgrid):
+            with pytest.raises(ValueError):
+                parse(tg_str)
+        with pytest.raises(ValueError):
+            list(iter_compact_tiers(BytesIO(tg_str.encode())))
+
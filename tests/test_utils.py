@@ -0,0 +1,38 @@
+from seshat.utils import line_delta, apply_line_delta, sequence_edits
+
+BASE = "".join("line %d\n" % i for i in range(50))
+
+
+def test_line_delta_roundtrip():
+    new_versions = [
+        BASE,
+        "",
+        BASE.replace("line 10\n", "line 10 edited\n"),
+        "header\n" + BASE.replace("line 30\n", "") + "trailer",
+        BASE.replace("\n", "\r\n"),
+    ]
+    for new in new_versions:
+        assert apply_line_delta(BASE, line_delta(BASE, new)) == new
+        assert apply_line_delta(new, line_delta(new, BASE)) == BASE
+
+
+def test_line_delta_is_small():
+    new = BASE.replace("line 25\n", "line 25 edited\n")
+    delta = line_delta(BASE, new)
+    assert delta == [[0, 25], "line 25 edited\n", [26, 50]]
+
+
+def test_sequence_edits():
+    assert sequence_edits("abcdef", "abcdef", max_edits=10) == []
+    assert sequence_edits("abcdef", "abXdeYf", max_edits=10) == [("replace", 2, 2), ("insert", 5, 5)]
+    assert sequence_edits("abcdef", "acdf", max_edits=10) == [("delete", 1, 1), ("delete", 4, 3)]
+    assert sequence_edits("abcdef", "uvwxyz", max_edits=4) is None
+
+
+def test_errors_limit():
+    from seshat.configs import errors_limit
+
+    # limits set by environment variables are strings
+    assert errors_limit("200") == errors_limit(200) == 200
+    for unlimited in (None, "", "0", 0, "-1"):
+        assert errors_limit(unlimited) is None